@@ -0,0 +1,139 @@
+"""
+Benchmark del índice de búsqueda (/buscar) contra el recorrido lineal que
+haría un filtro sin índice (normalizar cada registro y buscar subcadenas).
+
+    python bench/bench_busqueda.py --registros 50000
+    python bench/bench_busqueda.py --registros 10000 50000 200000 --consultas 2000
+
+Mide en proceso, sin HTTP ni Supabase: carga completa, altas incrementales y
+latencia de consulta (p50/p99) con una mezcla de nombres, razas, prefijos,
+teléfonos y errores de dedo. Sale con error si el p99 del índice pasa de
+--max-p99-ms.
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from comun import RAZAS, imprimir_tabla, percentil
+
+NOMBRES_PERRO = ["Max", "Luna", "Rocky", "Nala", "Toby", "Kira", "Bruno", "Maya", "Thor", "Lola",
+                 "Canela", "Chispa", "Frida", "Simón", "Coco", "Ñoño", "Pelusa", "Rayo", "Tequila", "Milo"]
+NOMBRES = ["José", "María", "Juan", "Guadalupe", "Luis", "Ana", "Jesús", "Sofía", "Miguel", "Valeria",
+           "Andrés", "Lucía", "Ramón", "Ximena", "Óscar", "Regina", "Iñaki", "Renata", "Ángel", "Paola"]
+APELLIDOS = ["Hernández", "García", "Martínez", "López", "González", "Pérez", "Rodríguez", "Sánchez",
+             "Ramírez", "Cruz", "Flores", "Gómez", "Morales", "Vázquez", "Jiménez", "Reyes", "Díaz",
+             "Torres", "Gutiérrez", "Ruiz", "Mendoza", "Aguilar", "Ortiz", "Castillo", "Núñez", "Peña"]
+RAZAS_EXTRA = RAZAS + ["Schnauzer", "Poodle", "Dálmata", "Pastor Alemán", "Xoloitzcuintle", "French Poodle"]
+
+
+def generar(registros: int, semilla: int = 11) -> tuple:
+    """Un propietario por cada dos perros, hasta sumar `registros`."""
+    rnd = random.Random(semilla)
+    n_props = max(1, registros // 3)
+    propietarios = []
+    for i in range(n_props):
+        nombre = f"{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}"
+        usuario = nombre.split()[0].lower()[:3] + nombre.split()[1].lower()[:4] + str(i)
+        propietarios.append({"id": f"p{i}", "nombre": nombre, "telefono": f"55{rnd.randrange(10**8):08d}",
+                             "email": f"{usuario}@example.com"})
+    perros = [{"id": f"d{i}", "nombre": rnd.choice(NOMBRES_PERRO), "raza": rnd.choice(RAZAS_EXTRA),
+               "propietario_id": f"p{rnd.randrange(n_props)}"} for i in range(registros - n_props)]
+    return propietarios, perros
+
+
+def consultas(propietarios: list, n: int, semilla: int = 5) -> list:
+    rnd = random.Random(semilla)
+    generadores = [
+        lambda: rnd.choice(NOMBRES_PERRO),
+        lambda: rnd.choice(RAZAS_EXTRA)[:4],                          # prefijo
+        lambda: rnd.choice(propietarios)["nombre"].split()[1],        # apellido con acento
+        lambda: " ".join(rnd.choice(propietarios)["nombre"].split()[:2]),
+        lambda: rnd.choice(propietarios)["telefono"][-4:],            # terminación del teléfono
+        lambda: rnd.choice(["lavrador", "chiuahua", "hernandes", "gonsalez", "schnauser"]),
+        lambda: f"{rnd.choice(NOMBRES_PERRO)} {rnd.choice(APELLIDOS)}",  # perro + dueño
+    ]
+    return [rnd.choice(generadores)() for _ in range(n)]
+
+
+def lineal(propietarios: list, perros: list, por_id: dict, q: str, limite: int) -> list:
+    """Lo que haría un filtro sin índice: normalizar cada registro y buscar subcadenas."""
+    from busqueda import normalizar
+
+    terminos = normalizar(q).split()
+    resultados = []
+    for p in propietarios:
+        texto = normalizar(f"{p['nombre']} {p['telefono']} {p['email']}")
+        if all(t in texto for t in terminos):
+            resultados.append(p)
+    for d in perros:
+        texto = normalizar(f"{d['nombre']} {d['raza']} {por_id[d['propietario_id']]['nombre']}")
+        if all(t in texto for t in terminos):
+            resultados.append(d)
+    return resultados[:limite]
+
+
+def correr(registros: int, n_consultas: int, limite: int, lineales: int) -> list:
+    from busqueda import IndiceBusqueda
+
+    propietarios, perros = generar(registros)
+    indice = IndiceBusqueda()
+    t0 = time.perf_counter()
+    indice.cargar(propietarios, perros)
+    carga_ms = (time.perf_counter() - t0) * 1000
+
+    # Altas y cambios incrementales (lo que hacen los handlers de la API)
+    t0 = time.perf_counter()
+    for i in range(500):
+        indice.registrar_perro({"id": f"nuevo{i}", "nombre": f"Firulais {i}", "raza": "Mestizo",
+                                "propietario_id": propietarios[i % len(propietarios)]["id"]})
+    alta_us = (time.perf_counter() - t0) * 1e6 / 500
+    for i in range(500):
+        indice.quitar_perro(f"nuevo{i}")
+
+    textos = consultas(propietarios, n_consultas)
+    tiempos, encontrados = [], 0
+    for q in textos:
+        t0 = time.perf_counter()
+        encontrados += bool(indice.buscar(q, limite))
+        tiempos.append((time.perf_counter() - t0) * 1000)
+
+    por_id = {p["id"]: p for p in propietarios}
+    tiempos_lineal = []
+    for q in textos[:lineales]:
+        t0 = time.perf_counter()
+        lineal(propietarios, perros, por_id, q, limite)
+        tiempos_lineal.append((time.perf_counter() - t0) * 1000)
+
+    stats = indice.estadisticas()
+    return [
+        {"ruta": "indice", "registros": registros, "palabras": stats["palabras"], "carga_ms": round(carga_ms, 1),
+         "alta_us": round(alta_us, 1), "p50_ms": round(percentil(tiempos, 50), 3),
+         "p99_ms": round(percentil(tiempos, 99), 3), "con_resultados": f"{encontrados}/{len(textos)}"},
+        {"ruta": "lineal", "registros": registros, "palabras": "", "carga_ms": "", "alta_us": "",
+         "p50_ms": round(percentil(tiempos_lineal, 50), 3), "p99_ms": round(percentil(tiempos_lineal, 99), 3),
+         "con_resultados": ""},
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--registros", type=int, nargs="+", default=[50000])
+    parser.add_argument("--consultas", type=int, default=1000)
+    parser.add_argument("--limite", type=int, default=20)
+    parser.add_argument("--lineales", type=int, default=20, help="consultas medidas con el recorrido lineal")
+    parser.add_argument("--max-p99-ms", type=float, default=5.0)
+    args = parser.parse_args()
+    resultados = []
+    for registros in args.registros:
+        resultados.extend(correr(registros, args.consultas, args.limite, args.lineales))
+    imprimir_tabla(resultados, ["ruta", "registros", "palabras", "carga_ms", "alta_us",
+                                "p50_ms", "p99_ms", "con_resultados"])
+    lentos = [r for r in resultados if r["ruta"] == "indice" and r["p99_ms"] > args.max_p99_ms]
+    if lentos:
+        sys.exit(f"p99 mayor a {args.max_p99_ms} ms con {', '.join(str(r['registros']) for r in lentos)} registros")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Ancho de banda de las lecturas repetidas con y sin validadores (ETag/304).
+
+    python bench/bench_cache_http.py --rondas 10 --propietarios 300
+    python bench/bench_cache_http.py --escribir-cada 3   # una alta de perro cada 3 rondas
+
+Simula a un navegador que recarga las vistas principales en cada ronda: sin
+validadores descarga todo cada vez; con validadores manda el ETag que guardó
+(If-None-Match) y solo descarga de nuevo lo que cambió. Reporta bytes por
+endpoint, proporción de 304 y la latencia media de cada modo.
+"""
+
+import argparse
+import asyncio
+import time
+
+from comun import api_local, imprimir_tabla
+
+ENDPOINTS = [
+    "/propietarios",
+    "/perros",
+    "/estancias",
+    "/catalogo-servicios",
+    "/catalogo-paseos",
+    "/catalogo-habitaciones",
+    "/catalogo-colores",
+    "/dashboard/resumen-dia",
+    "/calendario?dias=60",
+    "/tickets",
+    "/inventario",
+    "/alertas/vacunas?dias=30",
+]
+
+
+async def correr(args) -> list:
+    filas = {e: {"endpoint": e, "bytes_sin": 0, "bytes_con": 0, "ms_sin": 0.0, "ms_con": 0.0, "304": 0}
+             for e in ENDPOINTS}
+    async with api_local(latencia_ms=args.latencia_ms, propietarios=args.propietarios) as cliente:
+        propietario = (await cliente.get("/propietarios")).json()[0]
+        etags: dict = {}
+        for ronda in range(args.rondas):
+            if args.escribir_cada and ronda and ronda % args.escribir_cada == 0:
+                await cliente.post("/perros", json={"nombre": f"Bench {ronda}", "propietario_id": propietario["id"]})
+            for endpoint in ENDPOINTS:
+                fila = filas[endpoint]
+                t0 = time.perf_counter()
+                r = await cliente.get(endpoint)
+                fila["ms_sin"] += (time.perf_counter() - t0) * 1000
+                fila["bytes_sin"] += len(r.content)
+
+                headers = {"If-None-Match": etags[endpoint]} if endpoint in etags else {}
+                t0 = time.perf_counter()
+                r = await cliente.get(endpoint, headers=headers)
+                fila["ms_con"] += (time.perf_counter() - t0) * 1000
+                fila["bytes_con"] += len(r.content)
+                if r.status_code == 304:
+                    fila["304"] += 1
+                elif "etag" in r.headers:
+                    etags[endpoint] = r.headers["etag"]
+    resultados = list(filas.values())
+    total = {"endpoint": "TOTAL", **{k: sum(f[k] for f in resultados)
+                                     for k in ("bytes_sin", "bytes_con", "ms_sin", "ms_con", "304")}}
+    for fila in resultados + [total]:
+        fila["ahorro_%"] = round(100 * (1 - fila["bytes_con"] / fila["bytes_sin"]), 1) if fila["bytes_sin"] else 0.0
+        fila["ms_sin"] = round(fila["ms_sin"] / args.rondas, 2)
+        fila["ms_con"] = round(fila["ms_con"] / args.rondas, 2)
+        fila["304"] = f"{fila['304']}/{args.rondas * (len(ENDPOINTS) if fila is total else 1)}"
+    return resultados + [total]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rondas", type=int, default=10)
+    parser.add_argument("--propietarios", type=int, default=300)
+    parser.add_argument("--latencia-ms", type=float, default=0.0)
+    parser.add_argument("--escribir-cada", type=int, default=0, help="alta de un perro cada N rondas (0 = nunca)")
+    args = parser.parse_args()
+    resultados = asyncio.run(correr(args))
+    imprimir_tabla(resultados, ["endpoint", "bytes_sin", "bytes_con", "ahorro_%", "304", "ms_sin", "ms_con"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark del checkout (POST /tickets) según el número de cargos.
+
+    python bench/bench_checkout.py --latencia-ms 20
+    python bench/bench_checkout.py --latencia-ms 20 --sin-rpc   # ruta alterna sin función SQL
+
+Con el checkout por lotes la latencia y los round trips a Supabase deben
+mantenerse constantes aunque crezca el número de cargos.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from comun import api_local, imprimir_tabla, transporte_local
+
+
+async def correr(args) -> list:
+    resultados = []
+    async with api_local(latencia_ms=args.latencia_ms, propietarios=20) as cliente:
+        transporte = transporte_local()
+        if args.sin_rpc:
+            transporte.base.funciones_rpc.pop("crear_ticket_checkout", None)
+        perro = (await cliente.get("/perros")).json()[0]
+        for n in args.cargos:
+            latencias, round_trips = [], 0
+            for _ in range(args.repeticiones):
+                cargos = transporte.base.insertar("cargos", [
+                    {"perro_id": perro["id"], "fecha_cargo": "2026-01-01", "concepto": "Hospedaje", "monto": 350}
+                    for _ in range(n)
+                ], [])
+                antes = transporte.peticiones
+                t0 = time.perf_counter()
+                r = await cliente.post("/tickets", json={
+                    "perro_id": perro["id"], "propietario_id": perro["propietario_id"],
+                    "cargos_ids": [c["id"] for c in cargos], "subtotal": 350.0 * n, "total": 350.0 * n,
+                })
+                latencias.append((time.perf_counter() - t0) * 1000)
+                round_trips = transporte.peticiones - antes
+                assert r.status_code == 200 and len(r.json()["cargos"]) == n, r.text
+            resultados.append({"cargos": n, "round_trips": round_trips,
+                               "p50_ms": round(statistics.median(latencias), 2),
+                               "max_ms": round(max(latencias), 2)})
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cargos", type=int, nargs="*", default=[1, 5, 10, 20, 40, 80])
+    parser.add_argument("--repeticiones", type=int, default=10)
+    parser.add_argument("--latencia-ms", type=float, default=20.0)
+    parser.add_argument("--sin-rpc", action="store_true", help="Simula un Supabase sin la función SQL")
+    args = parser.parse_args()
+    imprimir_tabla(asyncio.run(correr(args)), ["cargos", "round_trips", "p50_ms", "max_ms"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark de carga de los endpoints más usados contra SQLite local.
+
+    python bench/bench_endpoints.py --peticiones 300 --concurrencia 10 --latencia-ms 20
+
+Reporta p50/p95/p99 y peticiones por segundo. Con --latencia-ms se simula el
+round trip a Supabase para que las mejoras de número de peticiones se noten.
+"""
+
+import argparse
+import asyncio
+import json
+
+from comun import api_local, imprimir_tabla, medir
+
+ENDPOINTS = [
+    "/estancias",
+    "/calendario?dias=60",
+    "/perros",
+    "/dashboard/resumen-dia",
+    "/alertas/vacunas?dias=30",
+    "/reportes/ingresos",
+    "/tickets",
+]
+
+
+async def correr(args) -> list:
+    resultados = []
+    escala = {"propietarios": args.propietarios}
+    async with api_local(latencia_ms=args.latencia_ms, **escala) as cliente:
+        for endpoint in args.endpoints or ENDPOINTS:
+            stats = await medir(lambda: cliente.get(endpoint), args.peticiones, args.concurrencia)
+            resultados.append({"endpoint": endpoint, **stats})
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peticiones", type=int, default=200)
+    parser.add_argument("--concurrencia", type=int, default=10)
+    parser.add_argument("--latencia-ms", type=float, default=0.0)
+    parser.add_argument("--propietarios", type=int, default=300)
+    parser.add_argument("--endpoints", nargs="*")
+    parser.add_argument("--json", action="store_true", help="Salida JSON en lugar de tabla")
+    args = parser.parse_args()
+
+    resultados = asyncio.run(correr(args))
+    if args.json:
+        print(json.dumps(resultados, indent=2))
+    else:
+        imprimir_tabla(resultados, ["endpoint", "n", "errores", "p50_ms", "p95_ms", "p99_ms", "media_ms", "rps"])
+
+
+if __name__ == "__main__":
+    main()
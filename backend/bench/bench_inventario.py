@@ -0,0 +1,90 @@
+"""
+Prueba de estrés del stock de inventario: N escritores concurrentes registran
+movimientos sobre el mismo ítem y al final el stock debe cuadrar exactamente.
+
+    python bench/bench_inventario.py --escritores 100 --latencia-ms 5
+
+Compara la función SQL (UPDATE atómico), la ruta optimista por versión (sin la
+función) y, como referencia, el leer-modificar-escribir de tres round trips
+que usaba el endpoint antes, que pierde actualizaciones bajo concurrencia.
+Sale con error si alguna de las dos rutas de la API pierde una actualización.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from comun import api_local, imprimir_tabla, transporte_local
+
+STOCK_INICIAL = 1000.0
+
+
+async def leer_modificar_escribir(cliente, item_id: str, tipo: str, cantidad: float):
+    """Lógica anterior del endpoint (insert + GET + PATCH), directa contra Supabase."""
+    import main
+
+    await main.supabase_request("POST", "inventario_movimientos",
+                                {"item_id": item_id, "tipo": tipo, "cantidad": cantidad})
+    item = await main.supabase_request("GET", f"inventario_items?id=eq.{item_id}&select=stock_actual")
+    stock = float(item[0]["stock_actual"])
+    nuevo = stock + cantidad if tipo == "entrada" else max(0, stock - cantidad)
+    await main.supabase_request("PATCH", f"inventario_items?id=eq.{item_id}", {"stock_actual": nuevo})
+
+
+async def via_api(cliente, item_id: str, tipo: str, cantidad: float):
+    r = await cliente.post("/inventario/movimiento", json={"item_id": item_id, "tipo": tipo, "cantidad": cantidad})
+    assert r.status_code == 200, r.text
+
+
+async def correr_modo(cliente, transporte, modo: str, escritores: int) -> dict:
+    item = transporte.base.insertar("inventario_items", {"nombre": f"Croquetas {modo}",
+                                                         "stock_actual": STOCK_INICIAL}, [])[0]
+    # Escritores alternan entradas de 3 y salidas de 1: el stock nunca llega a 0
+    movimientos = [("entrada", 3.0) if i % 2 == 0 else ("salida", 1.0) for i in range(escritores)]
+    esperado = STOCK_INICIAL + sum(c if t == "entrada" else -c for t, c in movimientos)
+    llamada = leer_modificar_escribir if modo == "lectura_escritura" else via_api
+
+    antes = transporte.peticiones
+    t0 = time.perf_counter()
+    await asyncio.gather(*(llamada(cliente, item["id"], t, c) for t, c in movimientos))
+    ms = (time.perf_counter() - t0) * 1000
+
+    final = transporte.base.seleccionar("inventario_items", [("id", f"eq.{item['id']}")])[0][0]
+    registrados = len(transporte.base.seleccionar("inventario_movimientos", [("item_id", f"eq.{item['id']}")])[0])
+    return {"modo": modo, "escritores": escritores, "esperado": esperado,
+            "stock_final": final["stock_actual"], "diferencia": round(esperado - final["stock_actual"], 2),
+            "movimientos": registrados, "round_trips": transporte.peticiones - antes, "total_ms": round(ms, 1)}
+
+
+async def correr(args) -> list:
+    resultados = []
+    async with api_local(latencia_ms=args.latencia_ms, propietarios=5) as cliente:
+        transporte = transporte_local()
+        import main
+
+        resultados.append(await correr_modo(cliente, transporte, "sql_atomico", args.escritores))
+        funcion = transporte.base.funciones_rpc.pop("registrar_movimientos_inventario")
+        resultados.append(await correr_modo(cliente, transporte, "optimista", args.escritores))
+        resultados.append(await correr_modo(cliente, transporte, "lectura_escritura", args.escritores))
+        transporte.base.funciones_rpc["registrar_movimientos_inventario"] = funcion
+        main._rpc_faltantes.discard("registrar_movimientos_inventario")
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--escritores", type=int, default=100)
+    parser.add_argument("--latencia-ms", type=float, default=5.0)
+    args = parser.parse_args()
+    resultados = asyncio.run(correr(args))
+    imprimir_tabla(resultados, ["modo", "escritores", "esperado", "stock_final", "diferencia",
+                                "movimientos", "round_trips", "total_ms"])
+    fallas = [r for r in resultados if r["modo"] != "lectura_escritura"
+              and (r["stock_final"] != r["esperado"] or r["movimientos"] != r["escritores"])]
+    if fallas:
+        sys.exit(f"Actualizaciones perdidas en: {', '.join(r['modo'] for r in fallas)}")
+
+
+if __name__ == "__main__":
+    main()
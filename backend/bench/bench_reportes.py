@@ -0,0 +1,84 @@
+"""
+Benchmark de los reportes en sus tres rutas: resúmenes diarios (rollup_*_dia),
+agregación en SQL (funciones RPC) y la ruta alterna que descarga las filas y
+suma en Python.
+
+    python bench/bench_reportes.py --filas 10000 100000
+    python bench/bench_reportes.py --filas 1000000 --repeticiones 3   # tarda en sembrar
+
+`--filas` es el número aproximado de tickets; estancias y cargos crecen en proporción.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from comun import api_local, imprimir_tabla, transporte_local
+
+TICKETS_POR_PERRO = 50
+
+REPORTES = [
+    "/reportes/resumen",
+    "/reportes/ingresos?fecha_inicio=2000-01-01&fecha_fin=2100-01-01",
+    "/reportes/cargos-por-concepto?fecha_inicio=2000-01-01&fecha_fin=2100-01-01",
+    "/reportes/ocupacion?fecha_inicio=2000-01-01&fecha_fin=2100-01-01",
+    "/reportes/clientes-frecuentes",
+]
+
+FUNCIONES = ["resumen_montos", "reporte_ingresos", "reporte_cargos_concepto",
+             "reporte_ocupacion", "reporte_clientes_frecuentes"]
+
+
+async def medir_reporte(cliente, transporte, url: str, repeticiones: int) -> dict:
+    latencias, round_trips = [], 0
+    for _ in range(repeticiones):
+        antes = transporte.peticiones
+        t0 = time.perf_counter()
+        r = await cliente.get(url)
+        latencias.append((time.perf_counter() - t0) * 1000)
+        assert r.status_code == 200, r.text
+        round_trips = transporte.peticiones - antes
+    return {"p50_ms": round(statistics.median(latencias), 2), "round_trips": round_trips}
+
+
+async def correr(args) -> list:
+    resultados = []
+    for filas in args.filas:
+        propietarios = max(1, filas // (2 * TICKETS_POR_PERRO))
+        async with api_local(latencia_ms=args.latencia_ms, propietarios=propietarios,
+                             tickets_por_perro=TICKETS_POR_PERRO) as cliente:
+            transporte = transporte_local()
+            import main
+
+            rollup = {url: await medir_reporte(cliente, transporte, url, args.repeticiones) for url in REPORTES}
+            main._rollups_faltantes.update(main.ROLLUPS)
+            sql = {url: await medir_reporte(cliente, transporte, url, args.repeticiones) for url in REPORTES}
+            funciones = {n: transporte.base.funciones_rpc.pop(n) for n in FUNCIONES}
+            python = {url: await medir_reporte(cliente, transporte, url, args.repeticiones) for url in REPORTES}
+            transporte.base.funciones_rpc.update(funciones)
+            main._rpc_faltantes.difference_update(FUNCIONES)
+            main._rollups_faltantes.clear()
+            for url in REPORTES:
+                resultados.append({
+                    "filas": filas, "reporte": url.split("?")[0],
+                    "rollup_ms": rollup[url]["p50_ms"], "sql_ms": sql[url]["p50_ms"],
+                    "python_ms": python[url]["p50_ms"],
+                    "rt_rollup": rollup[url]["round_trips"], "rt_sql": sql[url]["round_trips"],
+                    "rt_python": python[url]["round_trips"],
+                })
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, nargs="*", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--latencia-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    imprimir_tabla(asyncio.run(correr(args)),
+                   ["filas", "reporte", "rollup_ms", "sql_ms", "python_ms", "rt_rollup", "rt_sql", "rt_python"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Utilidades compartidas por los benchmarks: datos de prueba, arranque de la
+API contra SQLite local y medición de latencias.
+
+Se ejecutan desde backend/:  python bench/bench_endpoints.py --help
+"""
+
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import date, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# El log por petición de httpx distorsiona las mediciones
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Token HS256 válido para la verificación local de JWT (mismo secreto que usa el backend SQLite)
+SECRETO_BENCH = "local-jwt-secret"
+
+def _token_bench() -> str:
+    from jwt_local import firmar_hs256
+
+    return firmar_hs256({"sub": "00000000-0000-0000-0000-000000000001", "email": "bench@example.com",
+                         "role": "authenticated", "aud": "authenticated", "iss": "http://supabase.local/auth/v1",
+                         "exp": 4102444800}, SECRETO_BENCH)
+
+
+TOKEN_BENCH = _token_bench()
+HEADERS_BENCH = {"Authorization": f"Bearer {TOKEN_BENCH}"}
+
+NOMBRES = ["Max", "Luna", "Rocky", "Nala", "Toby", "Kira", "Bruno", "Maya", "Thor", "Lola"]
+RAZAS = ["Labrador", "Golden", "Pug", "Beagle", "Husky", "Chihuahua", "Mestizo", "Boxer"]
+METODOS = ["Efectivo", "Tarjeta", "Transferencia"]
+HABITACIONES = [f"H{n}" for n in range(1, 13)]
+
+
+def sembrar(path: str, propietarios: int = 300, perros_por_propietario: int = 2,
+            estancias_por_perro: int = 4, tickets_por_perro: int = 3, semilla: int = 7) -> dict:
+    """Llena una base SQLite con datos sintéticos reproducibles."""
+    from sqlite_local import BaseLocal, crear_conexion
+
+    rnd = random.Random(semilla)
+    base = BaseLocal(crear_conexion(path))
+    hoy = date.today()
+
+    base.insertar("catalogo_servicios", [
+        {"nombre": n, "precio": p, "tipo_cobro": t}
+        for n, p, t in [("Hospedaje", 350, "por_dia"), ("Baño", 200, "unico"), ("Medicación", 50, "por_dia")]
+    ], [])
+    base.insertar("catalogo_paseos", [
+        {"nombre": "Paseo 30 min", "duracion_minutos": 30, "precio": 120},
+        {"nombre": "Paseo 60 min", "duracion_minutos": 60, "precio": 200},
+    ], [])
+    base.insertar("catalogo_habitaciones", [{"nombre": h, "capacidad": rnd.choice([1, 2])} for h in HABITACIONES], [])
+    base.insertar("catalogo_colores", [{"color": "#45BF4D", "texto": "Pagado", "orden": 1},
+                                       {"color": "#E53935", "texto": "Pendiente", "orden": 2}], [])
+    base.insertar("catalogo_grooming", [{"nombre": "Corte completo", "precio_base": 450}], [])
+
+    props = base.insertar("propietarios", [
+        {"nombre": f"Cliente {i}", "telefono": f"55{i:08d}", "email": f"cliente{i}@example.com"}
+        for i in range(propietarios)
+    ], [])
+    perros = base.insertar("perros", [
+        {"propietario_id": p["id"], "nombre": f"{rnd.choice(NOMBRES)} {i}", "raza": rnd.choice(RAZAS),
+         "vacuna_rabia_vence": str(hoy + timedelta(days=rnd.randint(-60, 400))),
+         "vacuna_sextuple_vence": str(hoy + timedelta(days=rnd.randint(-60, 400))),
+         "vacuna_bordetella_vence": str(hoy + timedelta(days=rnd.randint(-60, 400))),
+         "vacuna_giardia_vence": str(hoy + timedelta(days=rnd.randint(-60, 400)))}
+        for p in props for i in range(perros_por_propietario)
+    ], [])
+
+    estancias, paseos, cargos, tickets = [], [], [], []
+    for perro in perros:
+        for _ in range(estancias_por_perro):
+            entrada = hoy - timedelta(days=rnd.randint(-30, 365))
+            salida = entrada + timedelta(days=rnd.randint(1, 10))
+            estancias.append({
+                "perro_id": perro["id"], "habitacion": rnd.choice(HABITACIONES),
+                "fecha_entrada": str(entrada), "fecha_salida": str(salida),
+                "total_estimado": 350 * (salida - entrada).days,
+                "estado": "Activa" if salida >= hoy else "Completada",
+            })
+        paseos.append({"perro_id": perro["id"], "fecha": str(hoy - timedelta(days=rnd.randint(0, 30))),
+                       "tipo_paseo": "Paseo 30 min", "precio": 120})
+        for _ in range(tickets_por_perro):
+            total = rnd.choice([350, 700, 1050, 1200])
+            tickets.append({"perro_id": perro["id"], "propietario_id": perro["propietario_id"],
+                            "cargos_ids": [], "subtotal": total, "total": total,
+                            "metodo_pago": rnd.choice(METODOS),
+                            "fecha": str(hoy - timedelta(days=rnd.randint(0, 365)))})
+        cargos.append({"perro_id": perro["id"], "fecha_cargo": str(hoy), "concepto": "Hospedaje", "monto": 350})
+    base.insertar("estancias", estancias, [])
+    base.insertar("paseos", paseos, [])
+    base.insertar("tickets", tickets, [])
+    base.insertar("cargos", cargos, [])
+    base.conn.close()
+    return {"propietarios": len(props), "perros": len(perros), "estancias": len(estancias),
+            "tickets": len(tickets), "cargos": len(cargos)}
+
+
+@asynccontextmanager
+async def api_local(latencia_ms: float = 0.0, path: str = None, **escala):
+    """Arranca la app contra SQLite (sembrado) y entrega un cliente httpx ASGI."""
+    import httpx
+
+    temporal = None
+    if path is None:
+        temporal = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+        temporal.close()
+        path = temporal.name
+        sembrar(path, **escala)
+    os.environ["DATA_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = path
+    os.environ["SQLITE_LATENCIA_MS"] = str(latencia_ms)
+    os.environ["SUPABASE_JWT_SECRET"] = SECRETO_BENCH
+    import main
+
+    main.DATA_BACKEND, main.SQLITE_PATH, main.SQLITE_LATENCIA_MS = "sqlite", path, latencia_ms
+    main.SUPABASE_JWT_SECRET = main.verificador_jwt.secreto = SECRETO_BENCH
+    try:
+        async with main.lifespan(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://api",
+                                         headers=HEADERS_BENCH, timeout=60.0) as cliente:
+                yield cliente
+    finally:
+        if temporal is not None:
+            for sufijo in ("", "-wal", "-shm"):
+                try:
+                    os.unlink(path + sufijo)
+                except FileNotFoundError:
+                    pass
+
+
+def transporte_local():
+    """El SQLiteTransport que usa la app (para sembrar datos o contar round trips)."""
+    import main
+
+    transporte = main.http_client._transport
+    return getattr(transporte, "interno", transporte)
+
+
+def percentil(valores: list, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p / 100
+    i = int(k)
+    j = min(i + 1, len(ordenados) - 1)
+    return ordenados[i] + (ordenados[j] - ordenados[i]) * (k - i)
+
+
+async def medir(llamada, total: int, concurrencia: int, calentamiento: int = 5) -> dict:
+    """Ejecuta `llamada()` `total` veces con `concurrencia` tareas y resume latencias en ms."""
+    for _ in range(calentamiento):
+        await llamada()
+    latencias, errores = [], 0
+    pendientes = iter(range(total))
+
+    async def trabajador():
+        nonlocal errores
+        for _ in pendientes:
+            t0 = time.perf_counter()
+            try:
+                r = await llamada()
+                if getattr(r, "status_code", 200) >= 400:
+                    errores += 1
+            except Exception:
+                errores += 1
+            latencias.append((time.perf_counter() - t0) * 1000)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+    duracion = time.perf_counter() - inicio
+    return {
+        "n": total,
+        "errores": errores,
+        "p50_ms": round(percentil(latencias, 50), 3),
+        "p95_ms": round(percentil(latencias, 95), 3),
+        "p99_ms": round(percentil(latencias, 99), 3),
+        "media_ms": round(statistics.fmean(latencias), 3) if latencias else 0.0,
+        "rps": round(total / duracion, 1) if duracion else 0.0,
+    }
+
+
+def imprimir_tabla(filas: list, columnas: list):
+    anchos = [max(len(str(c)), *(len(str(f.get(c, ""))) for f in filas)) for c in columnas]
+    print("  ".join(str(c).ljust(a) for c, a in zip(columnas, anchos)))
+    print("  ".join("-" * a for a in anchos))
+    for f in filas:
+        print("  ".join(str(f.get(c, "")).ljust(a) for c, a in zip(columnas, anchos)))
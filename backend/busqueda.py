@@ -0,0 +1,310 @@
+"""
+ComfortCan México - Índice de búsqueda de perros y propietarios
+
+Índice invertido en memoria: cada texto (nombre y raza del perro, nombre del
+dueño, teléfono y correo) se normaliza sin acentos ni mayúsculas y se parte
+en palabras. Cada palabra distinta apunta a los registros que la contienen y
+además se indexa por trigramas (como pg_trgm), así que una búsqueda encuentra
+prefijos ("lab" -> Labrador) y errores de dedo ("lavrador") sin recorrer los
+registros.
+
+Las consultas trabajan sobre el vocabulario (palabras distintas, muchas menos
+que registros) y solo tocan los registros de las palabras que coinciden. El
+índice se actualiza de forma incremental con los altas, cambios y bajas de la
+API y se recarga completo periódicamente.
+"""
+
+import heapq
+import re
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from operator import itemgetter
+from typing import Optional
+
+from indice_base import IndiceRecargable
+
+# Peso de cada campo en el puntaje (la coincidencia en el nombre pesa más)
+PESOS = {
+    "perro": {"nombre": 3.0, "raza": 1.0, "propietario": 1.5},
+    "propietario": {"nombre": 3.0, "telefono": 2.0, "email": 1.5},
+}
+
+# Similitud mínima de trigramas para aceptar una palabra como coincidencia aproximada
+UMBRAL_SIMILITUD = 0.35
+# Palabras del vocabulario que se revisan como prefijo de un término
+MAX_PREFIJOS = 500
+# Términos por consulta (el resto se ignora)
+MAX_TERMINOS = 6
+
+_NO_ALFANUMERICO = re.compile(r"[^0-9a-z]+")
+
+
+def normalizar(texto) -> str:
+    """Minúsculas, sin acentos (ñ -> n) y solo letras, dígitos y espacios."""
+    if not texto:
+        return ""
+    descompuesto = unicodedata.normalize("NFKD", str(texto).lower())
+    sin_acentos = "".join(c for c in descompuesto if not unicodedata.combining(c))
+    return _NO_ALFANUMERICO.sub(" ", sin_acentos).strip()
+
+
+def palabras(texto) -> list:
+    return normalizar(texto).split()
+
+
+def trigramas(palabra: str) -> set:
+    relleno = f"  {palabra} "
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+
+def _trigramas_indexados(palabra: str) -> set:
+    """Teléfonos y usuarios con números no se buscan aproximados: fuera del índice de
+    trigramas (son la mayor parte del vocabulario y no aportan a los errores de dedo)."""
+    return set() if any(c.isdigit() for c in palabra) else trigramas(palabra)
+
+
+def _palabras_telefono(telefono) -> list:
+    """El número completo y sus últimos 4, 7 y 10 dígitos (se busca por terminación o sin lada)."""
+    digitos = re.sub(r"\D", "", str(telefono or ""))
+    if len(digitos) < 4:
+        return []
+    return list(dict.fromkeys([digitos] + [digitos[-n:] for n in (4, 7, 10) if len(digitos) > n]))
+
+
+def _palabras_email(email) -> list:
+    """Solo la parte local: el dominio (gmail, com) coincidiría con casi todos."""
+    local = str(email or "").split("@")[0]
+    return palabras(local)
+
+
+def _terminos_consulta(q: str) -> list:
+    # Un teléfono escrito con espacios o guiones ("55 1234-5678") es un solo término
+    if re.fullmatch(r"[\d\s\-\(\)\+\.]+", q or "") and sum(c.isdigit() for c in q) >= 4:
+        return [re.sub(r"\D", "", q)]
+    return list(dict.fromkeys(palabras(q)))[:MAX_TERMINOS]
+
+
+class IndiceBusqueda(IndiceRecargable):
+    """Postings por palabra, trigramas por palabra del vocabulario y resumen de cada registro."""
+
+    def __init__(self):
+        super().__init__()
+        self.registros: dict = {}          # (tipo, id) -> {"resumen": dict, "palabras": {palabra: peso}}
+        self.postings: dict = {}           # palabra -> {(tipo, id): peso}
+        self.por_trigrama: dict = {}       # trigrama -> set de palabras
+        self.vocabulario: list = []        # palabras ordenadas (prefijos con bisect)
+        self.propietarios: dict = {}       # id -> fila del propietario (para el nombre en sus perros)
+        self.perros_por_propietario: dict = {}
+        self._carga_masiva = False
+
+    # -- carga --------------------------------------------------------------
+
+    def _reconstruir(self, propietarios: list, perros: list):
+        self.registros, self.postings, self.por_trigrama = {}, {}, {}
+        self.propietarios, self.perros_por_propietario = {}, {}
+        self.vocabulario = []
+        # Carga masiva: el vocabulario se ordena una sola vez al final
+        self._carga_masiva = True
+        try:
+            for fila in propietarios:
+                self.registrar_propietario(fila)
+            for fila in perros:
+                self.registrar_perro(fila)
+        finally:
+            self._carga_masiva = False
+        self.vocabulario = sorted(self.postings)
+
+    # -- escritura incremental ---------------------------------------------
+
+    def registrar_propietario(self, fila: dict):
+        """Alta o reemplazo; un propietario inactivo sale del índice. Re-indexa sus perros
+        para que la búsqueda por nombre del dueño refleje el cambio."""
+        self._anotar("registrar_propietario", fila)
+        propietario_id = fila["id"]
+        self.propietarios[propietario_id] = {**self.propietarios.get(propietario_id, {}), **fila}
+        fila = self.propietarios[propietario_id]
+        if fila.get("activo") is False:
+            self._quitar(("propietario", propietario_id))
+        else:
+            self._indexar(("propietario", propietario_id), {
+                "tipo": "propietario", "id": propietario_id, "nombre": fila.get("nombre"),
+                "telefono": fila.get("telefono"), "email": fila.get("email"),
+            }, {
+                "nombre": palabras(fila.get("nombre")),
+                "telefono": _palabras_telefono(fila.get("telefono")),
+                "email": _palabras_email(fila.get("email")),
+            })
+        for perro_id in list(self.perros_por_propietario.get(propietario_id, ())):
+            registro = self.registros.get(("perro", perro_id))
+            if registro is not None:
+                self.registrar_perro(registro["fila"], anotar=False)
+
+    def registrar_perro(self, fila: dict, anotar: bool = True):
+        """Alta o reemplazo de un perro (columnas de la tabla; el dueño sale de `propietarios`
+        o del embebido `propietarios(nombre)` si viene). Un perro inactivo sale del índice."""
+        if anotar:
+            self._anotar("registrar_perro", fila)
+        perro_id = fila["id"]
+        self._desligar_perro(perro_id)
+        if fila.get("activo") is False:
+            self._quitar(("perro", perro_id))
+            return
+        propietario_id = fila.get("propietario_id")
+        dueno = self.propietarios.get(propietario_id) or fila.get("propietarios") or {}
+        fila = {k: fila.get(k) for k in ("id", "nombre", "raza", "propietario_id", "activo")}
+        self._indexar(("perro", perro_id), {
+            "tipo": "perro", "id": perro_id, "nombre": fila["nombre"], "raza": fila["raza"],
+            "propietario_id": propietario_id, "propietario": dueno.get("nombre"),
+        }, {
+            "nombre": palabras(fila["nombre"]),
+            "raza": palabras(fila["raza"]),
+            "propietario": palabras(dueno.get("nombre")),
+        }, fila)
+        if propietario_id:
+            self.perros_por_propietario.setdefault(propietario_id, set()).add(perro_id)
+
+    def quitar_perro(self, perro_id: str):
+        self._anotar("quitar_perro", perro_id)
+        self._desligar_perro(perro_id)
+        self._quitar(("perro", perro_id))
+
+    def quitar_propietario(self, propietario_id: str):
+        self._anotar("quitar_propietario", propietario_id)
+        self.propietarios.pop(propietario_id, None)
+        self._quitar(("propietario", propietario_id))
+
+    def _desligar_perro(self, perro_id: str):
+        registro = self.registros.get(("perro", perro_id))
+        if registro is not None:
+            self.perros_por_propietario.get(registro["resumen"]["propietario_id"], set()).discard(perro_id)
+
+    def _indexar(self, llave: tuple, resumen: dict, campos: dict, fila: Optional[dict] = None):
+        self._quitar(llave)
+        pesos = PESOS[llave[0]]
+        por_palabra: dict = {}
+        for campo, lista in campos.items():
+            for palabra in lista:
+                por_palabra[palabra] = max(por_palabra.get(palabra, 0), pesos[campo])
+        for palabra, peso in por_palabra.items():
+            posting = self.postings.get(palabra)
+            if posting is None:
+                posting = self.postings[palabra] = {}
+                for trigrama in _trigramas_indexados(palabra):
+                    self.por_trigrama.setdefault(trigrama, set()).add(palabra)
+                if not self._carga_masiva:
+                    insort(self.vocabulario, palabra)
+            posting[llave] = peso
+        self.registros[llave] = {"resumen": resumen, "palabras": por_palabra, "fila": fila}
+
+    def _quitar(self, llave: tuple):
+        registro = self.registros.pop(llave, None)
+        if registro is None:
+            return
+        for palabra in registro["palabras"]:
+            posting = self.postings.get(palabra)
+            if posting is None:
+                continue
+            posting.pop(llave, None)
+            if not posting:
+                # Palabra que ya nadie usa: fuera del vocabulario y de los trigramas
+                del self.postings[palabra]
+                for trigrama in _trigramas_indexados(palabra):
+                    conjunto = self.por_trigrama.get(trigrama)
+                    if conjunto is not None:
+                        conjunto.discard(palabra)
+                        if not conjunto:
+                            del self.por_trigrama[trigrama]
+                i = bisect_left(self.vocabulario, palabra)
+                if i < len(self.vocabulario) and self.vocabulario[i] == palabra:
+                    del self.vocabulario[i]
+
+    # -- consultas ----------------------------------------------------------
+
+    def _similares(self, termino: str) -> dict:
+        """{palabra del vocabulario: similitud 0..1} para un término de la consulta."""
+        similares: dict = {}
+        # Prefijos: la palabra exacta vale 1; más larga que el término, un poco menos
+        i = bisect_left(self.vocabulario, termino)
+        fin = min(len(self.vocabulario), i + MAX_PREFIJOS)
+        while i < fin and self.vocabulario[i].startswith(termino):
+            palabra = self.vocabulario[i]
+            similares[palabra] = 1.0 if palabra == termino else 0.6 + 0.3 * len(termino) / len(palabra)
+            i += 1
+        # Trigramas: errores de dedo (términos de 3+ letras que no existen tal cual)
+        if len(termino) >= 3 and termino not in self.postings and not any(c.isdigit() for c in termino):
+            propios = trigramas(termino)
+            comunes: dict = {}
+            for trigrama in propios:
+                for palabra in self.por_trigrama.get(trigrama, ()):
+                    comunes[palabra] = comunes.get(palabra, 0) + 1
+            for palabra, n in comunes.items():
+                similitud = n / (len(propios) + len(palabra) + 2 - n)
+                if similitud >= UMBRAL_SIMILITUD and similitud > similares.get(palabra, 0):
+                    similares[palabra] = similitud
+        return similares
+
+    def _puntajes(self, similares: dict) -> dict:
+        """{llave: mejor similitud × peso} sobre las palabras de un término."""
+        # La lista más grande se arma con una comprensión; las demás se mezclan encima
+        palabras_ordenadas = sorted(similares, key=lambda p: len(self.postings[p]), reverse=True)
+        primera = palabras_ordenadas[0]
+        similitud = similares[primera]
+        puntajes = {llave: peso * similitud for llave, peso in self.postings[primera].items()}
+        for palabra in palabras_ordenadas[1:]:
+            similitud = similares[palabra]
+            for llave, peso in self.postings[palabra].items():
+                puntaje = peso * similitud
+                if puntaje > puntajes.get(llave, 0):
+                    puntajes[llave] = puntaje
+        return puntajes
+
+    def buscar(self, q: str, limite: int = 20, tipo: Optional[str] = None) -> list:
+        """Registros que coinciden con todos los términos de `q`, del mejor al peor puntaje."""
+        terminos = []
+        for termino in _terminos_consulta(q):
+            similares = self._similares(termino)
+            if not similares:
+                return []
+            terminos.append((sum(len(self.postings[p]) for p in similares), similares))
+        if not terminos:
+            return []
+        # El término más selectivo arma los candidatos; los demás los filtran
+        terminos.sort(key=lambda t: t[0])
+        acumulado = self._puntajes(terminos[0][1])
+        for costo, similares in terminos[1:]:
+            if costo <= len(acumulado) * len(similares):
+                puntajes = self._puntajes(similares)
+                acumulado = {llave: p + puntajes[llave] for llave, p in acumulado.items() if llave in puntajes}
+            else:
+                # Pocos candidatos: se buscan directo en los postings del término
+                if len(similares) == 1:
+                    (palabra, similitud), = similares.items()
+                    posting = self.postings[palabra]
+                    acumulado = {llave: p + posting[llave] * similitud
+                                 for llave, p in acumulado.items() if llave in posting}
+                    if not acumulado:
+                        return []
+                    continue
+                postings = [(self.postings[p], similitud) for p, similitud in similares.items()]
+                siguiente = {}
+                for llave, puntaje in acumulado.items():
+                    mejor = max(posting.get(llave, 0) * similitud for posting, similitud in postings)
+                    if mejor:
+                        siguiente[llave] = puntaje + mejor
+                acumulado = siguiente
+            if not acumulado:
+                return []
+        candidatos = acumulado.items()
+        if tipo:
+            candidatos = [item for item in candidatos if item[0][0] == tipo]
+        mejores = heapq.nlargest(limite, candidatos, key=itemgetter(1))
+        return [{**self.registros[llave]["resumen"], "puntaje": round(puntaje, 3)} for llave, puntaje in mejores]
+
+    def estadisticas(self) -> dict:
+        return {
+            "registros": len(self.registros),
+            "palabras": len(self.postings),
+            "trigramas": len(self.por_trigrama),
+            "edad_segundos": round(time.monotonic() - self.cargado_en, 1) if self.cargado_en else None,
+        }
@@ -0,0 +1,117 @@
+"""
+ComfortCan México - ETag y Cache-Control en las lecturas
+
+Middleware ASGI: a cada respuesta 200 de un GET le agrega un ETag calculado
+sobre el cuerpo (blake2b: unos microsegundos aun para listados de cientos de
+KB) y el Cache-Control de su clase de ruta. Si el If-None-Match de la petición
+coincide responde 304 sin cuerpo, así que un polling o una recarga que ya tiene
+los datos no los vuelve a descargar.
+
+Solo se validan respuestas que llegan en un único mensaje (JSONResponse y
+Response); los streams (exportaciones, CSV, /eventos) pasan sin buffer. Las
+rutas que ya ponen su propio ETag (dashboard, calendario) se respetan.
+"""
+
+import hashlib
+from typing import Optional
+
+# Headers que no van en un 304 (no hay cuerpo que describir)
+_SIN_CUERPO = {b"content-length", b"content-type", b"content-encoding"}
+
+
+def calcular_etag(cuerpo: bytes) -> str:
+    return '"' + hashlib.blake2b(cuerpo, digest_size=16).hexdigest() + '"'
+
+
+def coincide_etag(if_none_match: Optional[str], etag: str) -> bool:
+    """True si algún tag del If-None-Match es `etag` (comparación débil, como pide GET)."""
+    if not if_none_match:
+        return False
+    candidatos = {e.strip().removeprefix("W/") for e in if_none_match.split(",")}
+    return etag in candidatos or "*" in candidatos
+
+
+class PoliticaCache:
+    """Cache-Control por clase de ruta y contadores de validación.
+
+    `reglas`: ((prefijo de ruta, Cache-Control), ...) en orden; la primera que coincide
+    gana y si ninguna coincide se usa `por_defecto`. Las rutas de `excluir` no se tocan."""
+
+    def __init__(self, reglas: tuple, por_defecto: str, excluir: tuple = ()):
+        self.reglas = tuple((prefijo, valor.encode()) for prefijo, valor in reglas)
+        self.por_defecto = por_defecto.encode()
+        self.excluir = excluir
+        self.validadas = 0
+        self.no_modificadas = 0
+        self.bytes_ahorrados = 0
+
+    def cache_control(self, ruta: str) -> bytes:
+        for prefijo, valor in self.reglas:
+            if ruta.startswith(prefijo):
+                return valor
+        return self.por_defecto
+
+    def estadisticas(self) -> dict:
+        return {
+            "validadas": self.validadas,
+            "no_modificadas": self.no_modificadas,
+            "bytes_ahorrados": self.bytes_ahorrados,
+        }
+
+
+class MiddlewareCacheHTTP:
+    """ASGI: ETag, Cache-Control y 304 para las respuestas completas de GET."""
+
+    def __init__(self, app, politica: PoliticaCache):
+        self.app = app
+        self.politica = politica
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or scope["path"].startswith(self.politica.excluir):
+            return await self.app(scope, receive, send)
+        if_none_match = None
+        for nombre, valor in scope["headers"]:
+            if nombre == b"if-none-match":
+                if_none_match = valor.decode("latin-1")
+                break
+        inicio = None
+
+        async def send_validado(mensaje):
+            nonlocal inicio
+            if mensaje["type"] == "http.response.start":
+                if mensaje["status"] == 200 and not any(n == b"etag" for n, _ in mensaje.get("headers", ())):
+                    # Se detiene hasta ver el cuerpo: el ETag depende de él
+                    inicio = mensaje
+                    return
+                return await send(mensaje)
+            if inicio is None or mensaje["type"] != "http.response.body":
+                return await send(mensaje)
+            arranque, inicio = inicio, None
+            if mensaje.get("more_body"):
+                # Stream: se deja pasar sin validar
+                await send(arranque)
+                return await send(mensaje)
+            await self._responder(arranque, mensaje, if_none_match, scope["path"], send)
+
+        await self.app(scope, receive, send_validado)
+
+    async def _responder(self, arranque: dict, mensaje: dict, if_none_match: Optional[str], ruta: str, send):
+        politica = self.politica
+        cuerpo = mensaje.get("body", b"")
+        etag = calcular_etag(cuerpo)
+        headers = list(arranque.get("headers", ()))
+        if not any(n == b"cache-control" for n, _ in headers):
+            headers.append((b"cache-control", politica.cache_control(ruta)))
+        if not any(n == b"vary" for n, _ in headers):
+            # El cuerpo depende del token (RLS): otra sesión en el mismo navegador no reutiliza la copia
+            headers.append((b"vary", b"Authorization"))
+        headers.append((b"etag", etag.encode()))
+        politica.validadas += 1
+        if coincide_etag(if_none_match, etag):
+            politica.no_modificadas += 1
+            politica.bytes_ahorrados += len(cuerpo)
+            await send({"type": "http.response.start", "status": 304,
+                        "headers": [(n, v) for n, v in headers if n not in _SIN_CUERPO]})
+            return await send({"type": "http.response.body", "body": b""})
+        await send({**arranque, "headers": headers})
+        await send(mensaje)
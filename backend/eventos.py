@@ -0,0 +1,115 @@
+"""
+ComfortCan México - Eventos en vivo (Server-Sent Events)
+
+Centro pub/sub en memoria: los handlers que escriben publican un evento
+compacto (la fila cambiada, sin embebidos) y cada cliente conectado a
+GET /eventos lo recibe por su propia cola. El evento se serializa una sola vez
+y se reparte a todas las colas sin bloquear al handler que lo publicó.
+
+Un cliente lento cuya cola se llena se desconecta con un evento `resync`
+(el frontend vuelve a sincronizar y se reconecta). Los últimos eventos se
+guardan para reenviarlos si el navegador se reconecta con Last-Event-ID.
+
+El reparto es dentro del proceso: con varios workers cada uno tiene su centro
+y un cliente solo ve las escrituras atendidas por su worker.
+"""
+
+import asyncio
+import json
+import uuid
+from collections import deque
+from typing import Optional
+
+# Marca que se pone en la cola de un suscriptor desbordado en lugar del siguiente evento
+_DESBORDE = object()
+
+
+def formato_sse(evento: str, datos, id_evento: Optional[str] = None) -> bytes:
+    lineas = []
+    if id_evento is not None:
+        lineas.append(f"id: {id_evento}")
+    lineas.append(f"event: {evento}")
+    lineas.append("data: " + json.dumps(datos, default=str, ensure_ascii=False, separators=(",", ":")))
+    return ("\n".join(lineas) + "\n\n").encode()
+
+
+class CentroEventos:
+    def __init__(self, max_cola: int = 256, historial: int = 512):
+        self.max_cola = max_cola
+        # Prefijo por proceso: un Last-Event-ID de otro arranque obliga a resincronizar
+        self.instancia = uuid.uuid4().hex[:8]
+        self.ultimo = 0
+        self.historial: deque = deque(maxlen=historial)
+        self.suscriptores: set = set()
+        self.publicados = 0
+        self.desbordados = 0
+
+    def publicar(self, tipo: str, accion: str, datos: dict):
+        """Reparte el evento a todos los suscriptores. No bloquea ni lanza excepciones."""
+        self.ultimo += 1
+        self.publicados += 1
+        mensaje = formato_sse(tipo, {"accion": accion, **datos}, f"{self.instancia}-{self.ultimo}")
+        self.historial.append((self.ultimo, mensaje))
+        for cola in list(self.suscriptores):
+            try:
+                cola.put_nowait(mensaje)
+            except asyncio.QueueFull:
+                self._desbordar(cola)
+
+    def _desbordar(self, cola: asyncio.Queue):
+        self.suscriptores.discard(cola)
+        self.desbordados += 1
+        while not cola.empty():
+            cola.get_nowait()
+        cola.put_nowait(_DESBORDE)
+
+    def suscribir(self, ultimo_id: Optional[str] = None) -> tuple:
+        """(cola, al día). Con `ultimo_id` se precargan los eventos posteriores del historial;
+        `al día` es False si ya no están (el cliente debe resincronizar)."""
+        cola: asyncio.Queue = asyncio.Queue(self.max_cola)
+        al_dia = True
+        if ultimo_id:
+            instancia, _, numero = ultimo_id.partition("-")
+            numero = int(numero) if numero.isdigit() else -1
+            pendientes = [m for n, m in self.historial if n > numero]
+            primero = self.historial[0][0] if self.historial else self.ultimo + 1
+            if instancia != self.instancia or numero < primero - 1 or numero > self.ultimo \
+                    or len(pendientes) >= self.max_cola:
+                al_dia = False
+            else:
+                for mensaje in pendientes:
+                    cola.put_nowait(mensaje)
+        self.suscriptores.add(cola)
+        return cola, al_dia
+
+    def cancelar(self, cola: asyncio.Queue):
+        self.suscriptores.discard(cola)
+
+    async def transmitir(self, ultimo_id: Optional[str] = None, heartbeat: float = 20.0):
+        """Generador para StreamingResponse: eventos de la cola y un comentario cada
+        `heartbeat` segundos para que proxies y navegador no cierren la conexión."""
+        cola, al_dia = self.suscribir(ultimo_id)
+        try:
+            yield b"retry: 3000\n\n"
+            if not al_dia:
+                yield formato_sse("resync", {"motivo": "historial"})
+            while True:
+                try:
+                    mensaje = await asyncio.wait_for(cola.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                if mensaje is _DESBORDE:
+                    yield formato_sse("resync", {"motivo": "desborde"})
+                    return
+                yield mensaje
+        finally:
+            self.cancelar(cola)
+
+    def estadisticas(self) -> dict:
+        return {
+            "suscriptores": len(self.suscriptores),
+            "publicados": self.publicados,
+            "desbordados": self.desbordados,
+            "historial": len(self.historial),
+        }
@@ -0,0 +1,113 @@
+"""
+ComfortCan México - Procesamiento de fotos subidas
+
+Re-codifica las fotos a WebP (lado mayor acotado) y genera miniaturas de
+varios tamaños para que las vistas de lista descarguen kilobytes en lugar de
+la foto original del teléfono. El trabajo de Pillow corre en un pool de hilos
+(decodificar, redimensionar y codificar liberan el GIL).
+
+Pillow viene en requirements.txt. Si aun así no está instalado,
+`PILLOW_DISPONIBLE` es False y la API sube el archivo original sin miniaturas.
+"""
+
+import io
+import json
+from typing import BinaryIO, Optional
+
+from starlette.exceptions import HTTPException
+
+try:
+    from PIL import Image, ImageOps
+    PILLOW_DISPONIBLE = True
+except ImportError:
+    Image = ImageOps = None
+    PILLOW_DISPONIBLE = False
+
+
+class ImagenInvalida(Exception):
+    pass
+
+
+class LimiteSubida:
+    """Middleware ASGI: rechaza con 413 los uploads mayores a `limite` bytes sin recibirlos
+    completos (por Content-Length o contando los bloques del cuerpo conforme llegan)."""
+
+    def __init__(self, app, limite: int, prefijo: str = "/upload/"):
+        self.app = app
+        self.limite = limite
+        self.prefijo = prefijo
+        self.detalle = f"Archivo demasiado grande (max {limite // (1024 * 1024)} MB)"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefijo):
+            return await self.app(scope, receive, send)
+        largo = dict(scope["headers"]).get(b"content-length")
+        if largo and largo.isdigit() and int(largo) > self.limite:
+            return await self._rechazar(send)
+
+        recibido = 0
+
+        async def receive_limitado():
+            nonlocal recibido
+            mensaje = await receive()
+            if mensaje["type"] == "http.request":
+                recibido += len(mensaje.get("body", b""))
+                if recibido > self.limite:
+                    # FastAPI deja pasar HTTPException al leer el formulario: sale como 413
+                    raise HTTPException(status_code=413, detail=self.detalle)
+            return mensaje
+
+        await self.app(scope, receive_limitado, send)
+
+    async def _rechazar(self, send):
+        cuerpo = json.dumps({"detail": self.detalle}).encode()
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(cuerpo)).encode()),
+                                (b"connection", b"close")]})
+        await send({"type": "http.response.body", "body": cuerpo})
+
+
+def _a_webp(imagen, lado: int, calidad: int) -> bytes:
+    copia = imagen.copy()
+    copia.thumbnail((lado, lado), Image.LANCZOS if lado <= 512 else Image.BICUBIC)
+    salida = io.BytesIO()
+    copia.save(salida, "WEBP", quality=calidad, method=4)
+    return salida.getvalue()
+
+
+def procesar_imagen(archivo: BinaryIO, lado_maximo: int, tamanos: tuple, calidad: int = 80) -> Optional[dict]:
+    """Variantes WebP de la imagen: {"original": bytes, "<tam>": bytes, ...}.
+
+    Regresa None si Pillow no está instalado. Lanza ImagenInvalida si no se puede decodificar.
+    Pensada para correr en un hilo del pool (no toca el event loop)."""
+    if not PILLOW_DISPONIBLE:
+        return None
+    try:
+        archivo.seek(0)
+        imagen = Image.open(archivo)
+        # JPEG: decodificar directo a escala reducida ahorra la mayor parte del tiempo
+        imagen.draft("RGB", (lado_maximo, lado_maximo))
+        imagen = ImageOps.exif_transpose(imagen)
+        imagen.load()
+    except Exception as e:
+        raise ImagenInvalida(str(e)) from e
+    if imagen.mode not in ("RGB", "RGBA"):
+        imagen = imagen.convert("RGBA" if "A" in imagen.getbands() else "RGB")
+
+    variantes = {"original": _a_webp(imagen, lado_maximo, calidad)}
+    for tam in sorted(tamanos, reverse=True):
+        # Cada miniatura parte de la anterior (más grande): menos píxeles que re-muestrear
+        variantes[str(tam)] = _a_webp(imagen, tam, calidad)
+        imagen.thumbnail((tam, tam))
+    return variantes
+
+
+async def leer_en_bloques(upload, tam_bloque: int = 256 * 1024):
+    """Bloques de un UploadFile para reenviarlo tal cual sin cargarlo completo en memoria."""
+    await upload.seek(0)
+    while True:
+        bloque = await upload.read(tam_bloque)
+        if not bloque:
+            return
+        yield bloque
@@ -0,0 +1,49 @@
+"""
+ComfortCan México - Base de los índices en memoria
+
+Los índices de ocupación, vacunas y búsqueda se reconstruyen de vez en cuando
+con una foto completa de la base de datos mientras la API los sigue
+actualizando al momento. Los cambios que lleguen durante la descarga se anotan
+en una bitácora y se vuelven a aplicar encima de la foto nueva, para que
+ninguno se pierda.
+"""
+
+import time
+from typing import Optional
+
+
+class IndiceRecargable:
+    """Vigencia y bitácora de cambios; cada índice implementa `_reconstruir`."""
+
+    def __init__(self):
+        self.cargado_en: Optional[float] = None
+        self._bitacora: Optional[list] = None
+
+    def vigente(self, max_edad: float) -> bool:
+        return self.cargado_en is not None and time.monotonic() - self.cargado_en < max_edad
+
+    def invalidar(self):
+        self.cargado_en = None
+
+    def iniciar_carga(self):
+        """Registra los cambios que lleguen mientras se descarga la foto completa."""
+        self._bitacora = []
+
+    def cancelar_carga(self):
+        self._bitacora = None
+
+    def cargar(self, *foto):
+        """Reconstruye con la foto completa y reaplica lo anotado desde `iniciar_carga`."""
+        bitacora, self._bitacora = self._bitacora or [], None
+        self._reconstruir(*foto)
+        for operacion, args in bitacora:
+            getattr(self, operacion)(*args)
+        self.cargado_en = time.monotonic()
+
+    def _anotar(self, operacion: str, *args):
+        """Guarda la llamada `operacion(*args)` si hay una carga en curso."""
+        if self._bitacora is not None:
+            self._bitacora.append((operacion, args))
+
+    def _reconstruir(self, *foto):
+        raise NotImplementedError
@@ -0,0 +1,238 @@
+"""
+ComfortCan México - Verificación local de JWT de Supabase
+
+Valida firma, expiración, audiencia y emisor de los access tokens sin ir a
+Supabase: HS256 con el JWT secret del proyecto o RS256/ES256 con las llaves
+públicas del JWKS (`/auth/v1/.well-known/jwks.json`), verificadas con
+`cryptography`. El JWKS se recarga periódicamente en segundo plano.
+Los claims ya verificados se guardan en un LRU indexado por el hash del token.
+
+Sin secreto ni JWKS utilizable la verificación local queda deshabilitada y
+`verificar` regresa None: el token se sigue validando en cada llamada a PostgREST.
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+
+logger = logging.getLogger("comfortcan")
+
+
+class TokenInvalido(Exception):
+    pass
+
+
+class ClaveDesconocida(TokenInvalido):
+    """El `kid` del token no está en el JWKS cargado (puede ser una rotación reciente)."""
+
+
+def _b64_decodificar(valor: str) -> bytes:
+    return base64.urlsafe_b64decode(valor + "=" * (-len(valor) % 4))
+
+
+def _b64_codificar(datos: bytes) -> str:
+    return base64.urlsafe_b64encode(datos).rstrip(b"=").decode()
+
+
+def firmar_hs256(claims: dict, secreto: str) -> str:
+    """Emite un JWT HS256 (lo usan el backend SQLite local y los benchmarks)."""
+    header = _b64_codificar(json.dumps({"alg": "HS256", "typ": "JWT"}, separators=(",", ":")).encode())
+    payload = _b64_codificar(json.dumps(claims, separators=(",", ":")).encode())
+    firma = hmac.new(secreto.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest()
+    return f"{header}.{payload}.{_b64_codificar(firma)}"
+
+
+def _verificar_rs256(jwk: dict, mensaje: bytes, firma: bytes) -> bool:
+    if jwk.get("kty") != "RSA" or not jwk.get("n") or not jwk.get("e"):
+        raise TokenInvalido("La llave de firma no corresponde al algoritmo del token")
+    publica = rsa.RSAPublicNumbers(
+        int.from_bytes(_b64_decodificar(jwk["e"]), "big"),
+        int.from_bytes(_b64_decodificar(jwk["n"]), "big"),
+    ).public_key()
+    try:
+        publica.verify(firma, mensaje, padding.PKCS1v15(), hashes.SHA256())
+        return True
+    except InvalidSignature:
+        return False
+
+
+def _verificar_es256(jwk: dict, mensaje: bytes, firma: bytes) -> bool:
+    if jwk.get("kty") != "EC" or jwk.get("crv") != "P-256" or not jwk.get("x") or not jwk.get("y"):
+        raise TokenInvalido("La llave de firma no corresponde al algoritmo del token")
+    if len(firma) != 64:
+        return False
+    publica = ec.EllipticCurvePublicNumbers(
+        int.from_bytes(_b64_decodificar(jwk["x"]), "big"),
+        int.from_bytes(_b64_decodificar(jwk["y"]), "big"),
+        ec.SECP256R1(),
+    ).public_key()
+    der = encode_dss_signature(int.from_bytes(firma[:32], "big"), int.from_bytes(firma[32:], "big"))
+    try:
+        publica.verify(der, mensaje, ec.ECDSA(hashes.SHA256()))
+        return True
+    except InvalidSignature:
+        return False
+
+
+class VerificadorJWT:
+    """Verificación local con caché LRU de claims por hash de token."""
+
+    def __init__(self, secreto: Optional[str] = None, jwks_url: Optional[str] = None,
+                 refresco: float = 600.0, max_entradas: int = 1024, tolerancia: float = 30.0,
+                 refresco_minimo: float = 30.0, audiencia: Optional[str] = None, emisor: Optional[str] = None):
+        self.secreto = secreto
+        self.jwks_url = jwks_url
+        self.audiencia = audiencia
+        self.emisor = emisor
+        self.refresco = refresco
+        self.refresco_minimo = refresco_minimo
+        self.max_entradas = max_entradas
+        self.tolerancia = tolerancia
+        self.claves: dict = {}
+        self.jwks_cargado_en: Optional[float] = None
+        self._recarga: Optional[asyncio.Task] = None
+        self._cache: OrderedDict = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+        self.rechazos = 0
+        self.sin_verificar = 0
+
+    # -- JWKS ---------------------------------------------------------------
+
+    async def refrescar_jwks(self, cliente, forzar: bool = False, headers: Optional[dict] = None):
+        """Recarga el JWKS si está vencido (o `forzar`). Los errores conservan las llaves previas.
+
+        Aun forzada, no se recarga más de una vez cada `refresco_minimo` segundos: un `kid`
+        inventado en el header no debe costar una descarga del JWKS por petición."""
+        if not self.jwks_url or cliente is None:
+            return
+        ahora = time.monotonic()
+        espera = self.refresco_minimo if forzar else self.refresco
+        if self.jwks_cargado_en is not None and ahora - self.jwks_cargado_en < espera:
+            return
+        # Se marca antes de pedir para no repetir la descarga en peticiones concurrentes
+        self.jwks_cargado_en = ahora
+        try:
+            headers = {k: v for k, v in (headers or {}).items() if v}
+            response = await cliente.get(self.jwks_url, headers=headers, timeout=5.0)
+            response.raise_for_status()
+            claves = {k.get("kid"): k for k in response.json().get("keys", []) if k.get("kid")}
+        except Exception as e:
+            logger.warning("No se pudo cargar el JWKS de Supabase: %s", e)
+            return
+        if claves != self.claves:
+            self.claves = claves
+            self._cache.clear()
+
+    def refrescar_en_segundo_plano(self, cliente, headers: Optional[dict] = None):
+        """Recarga periódica sin bloquear: la petición que la dispara sigue con las llaves
+        actuales (stale-while-revalidate). Solo un `kid` desconocido espera la descarga."""
+        if not self.jwks_url or cliente is None:
+            return
+        if self._recarga is not None and not self._recarga.done():
+            return
+        if self.jwks_cargado_en is not None and time.monotonic() - self.jwks_cargado_en < self.refresco:
+            return
+        self._recarga = asyncio.ensure_future(self.refrescar_jwks(cliente, headers=headers))
+
+    # -- verificación -------------------------------------------------------
+
+    def verificar(self, token: str) -> Optional[dict]:
+        """Claims del token si la firma y la vigencia son válidas; None si no hay cómo verificarlo.
+
+        Lanza TokenInvalido (o ClaveDesconocida) si el token no es válido."""
+        llave = hashlib.sha256(token.encode()).digest()
+        claims = self._cache.get(llave)
+        if claims is not None:
+            if not self._vencido(claims):
+                self._cache.move_to_end(llave)
+                self.aciertos += 1
+                return claims
+            del self._cache[llave]
+        self.fallos += 1
+        try:
+            claims = self._verificar_firma(token)
+        except TokenInvalido:
+            self.rechazos += 1
+            raise
+        if claims is None:
+            self.sin_verificar += 1
+            return None
+        if self._vencido(claims):
+            self.rechazos += 1
+            raise TokenInvalido("Token expirado")
+        if "nbf" in claims and float(claims["nbf"]) > time.time() + self.tolerancia:
+            self.rechazos += 1
+            raise TokenInvalido("Token aún no válido")
+        if self.audiencia:
+            aud = claims.get("aud")
+            if self.audiencia not in (aud if isinstance(aud, list) else [aud]):
+                self.rechazos += 1
+                raise TokenInvalido("Audiencia del token inválida")
+        if self.emisor and claims.get("iss") != self.emisor:
+            self.rechazos += 1
+            raise TokenInvalido("Emisor del token inválido")
+        self._cache[llave] = claims
+        if len(self._cache) > self.max_entradas:
+            self._cache.popitem(last=False)
+        return claims
+
+    def _vencido(self, claims: dict) -> bool:
+        exp = claims.get("exp")
+        return exp is not None and float(exp) + self.tolerancia < time.time()
+
+    def _verificar_firma(self, token: str) -> Optional[dict]:
+        try:
+            header_b64, payload_b64, firma_b64 = token.split(".")
+            header = json.loads(_b64_decodificar(header_b64))
+            claims = json.loads(_b64_decodificar(payload_b64))
+            firma = _b64_decodificar(firma_b64)
+        except (ValueError, TypeError):
+            raise TokenInvalido("Token con formato inválido")
+        if not isinstance(header, dict) or not isinstance(claims, dict):
+            raise TokenInvalido("Token con formato inválido")
+        mensaje = f"{header_b64}.{payload_b64}".encode()
+        alg = header.get("alg")
+
+        if alg == "HS256":
+            if not self.secreto:
+                return None
+            esperada = hmac.new(self.secreto.encode(), mensaje, hashlib.sha256).digest()
+            if not hmac.compare_digest(esperada, firma):
+                raise TokenInvalido("Firma del token inválida")
+            return claims
+
+        if alg in ("RS256", "ES256"):
+            if not self.claves:
+                return None
+            jwk = self.claves.get(header.get("kid"))
+            if jwk is None:
+                raise ClaveDesconocida("Llave de firma desconocida")
+            valido = _verificar_rs256(jwk, mensaje, firma) if alg == "RS256" else _verificar_es256(jwk, mensaje, firma)
+            if not valido:
+                raise TokenInvalido("Firma del token inválida")
+            return claims
+
+        raise TokenInvalido(f"Algoritmo no soportado: {alg}")
+
+    def estadisticas(self) -> dict:
+        return {
+            "habilitado": bool(self.secreto or self.claves),
+            "claves_jwks": len(self.claves),
+            "entradas": len(self._cache),
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "rechazos": self.rechazos,
+            "sin_verificar": self.sin_verificar,
+        }
@@ -4,17 +4,38 @@ Sistema ERP completo para hotel canino
 """
 
 from contextlib import asynccontextmanager
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
 from fastapi import FastAPI, HTTPException, Header, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime, date, timedelta
+from urllib.parse import quote
+from datetime import datetime, date, timedelta, timezone
 import asyncio
+import hashlib
+import hmac
 import logging
 import os
+import random
+import time
+import uuid
 from dotenv import load_dotenv
 import httpx
 import base64
+import csv
+import io
+import json
+from jwt_local import ClaveDesconocida, TokenInvalido, VerificadorJWT
+from ocupacion import IndiceOcupacion, asignar_carriles, orden_natural, parse_fecha
+from vacunas import SELECT_PERROS, IndiceVacunas
+from busqueda import IndiceBusqueda
+from metricas import MetricasApp, MiddlewareMetricas
+from eventos import CentroEventos
+from cache_http import MiddlewareCacheHTTP, PoliticaCache, calcular_etag, coincide_etag
+from imagenes import PILLOW_DISPONIBLE, ImagenInvalida, LimiteSubida, leer_en_bloques, procesar_imagen
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
@@ -34,21 +55,205 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
+# JWT secret del proyecto (Settings > API) para validar tokens HS256 sin ir a Supabase
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+
+# Backend de datos: "supabase" (PostgREST real) o "sqlite" (local, para desarrollo y benchmarks)
+# Ejemplo: DATA_BACKEND=sqlite SQLITE_PATH=/tmp/comfortcan.db uvicorn main:app --reload
+DATA_BACKEND = os.getenv("DATA_BACKEND", "supabase").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", ":memory:")
+SQLITE_LATENCIA_MS = float(os.getenv("SQLITE_LATENCIA_MS", "0"))
+if DATA_BACKEND == "sqlite":
+    SUPABASE_URL = SUPABASE_URL or "http://supabase.local"
+    SUPABASE_KEY = SUPABASE_KEY or "local"
+    SUPABASE_ANON_KEY = SUPABASE_ANON_KEY or "local"
+    SUPABASE_JWT_SECRET = SUPABASE_JWT_SECRET or "local-jwt-secret"
 
 # Orígenes permitidos: configura ALLOWED_ORIGINS en .env como lista separada por comas
 # Ejemplo: ALLOWED_ORIGINS=https://comfortcan.vercel.app,http://localhost:3000
 _raw_origins = os.getenv("ALLOWED_ORIGINS", "")
 ALLOWED_ORIGINS = [o.strip() for o in _raw_origins.split(",") if o.strip()] or ["*"]
 
+# Segundos entre recargas completas del índice de ocupación (los cambios locales se aplican al momento)
+OCUPACION_REFRESCO = float(os.getenv("OCUPACION_REFRESCO", "300"))
+
+# Verificación local de JWT: segundos entre recargas del JWKS y tokens verificados en caché
+JWKS_REFRESCO = float(os.getenv("JWKS_REFRESCO", "600"))
+# Mínimo de segundos entre recargas forzadas por un `kid` desconocido (rotación de llaves)
+JWKS_REFRESCO_MINIMO = float(os.getenv("JWKS_REFRESCO_MINIMO", "30"))
+# Claims aud/iss que deben traer los access tokens de Supabase Auth (vacío = no se revisa)
+JWT_AUDIENCIA = os.getenv("JWT_AUDIENCIA", "authenticated")
+JWT_EMISOR = os.getenv("JWT_EMISOR", f"{SUPABASE_URL}/auth/v1" if SUPABASE_URL else "")
+JWT_CACHE_MAX = int(os.getenv("JWT_CACHE_MAX", "1024"))
+
+# Segundos que se reutiliza el payload del dashboard (las tablets lo consultan en intervalos cortos)
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "5"))
+# Segundos que se reutiliza una ventana de /calendario (las escrituras la invalidan antes)
+CALENDARIO_CACHE_TTL = float(os.getenv("CALENDARIO_CACHE_TTL", "60"))
+# Segundos entre recargas completas del índice de vacunas (tarea en segundo plano)
+VACUNAS_REFRESCO = float(os.getenv("VACUNAS_REFRESCO", "300"))
+# Cache-Control de las lecturas: segundos que el navegador reutiliza catálogos sin preguntar
+# y datos operativos (0 = revalida siempre con If-None-Match y recibe 304 si no cambiaron).
+# Con max-age > 0 una edición hecha en otro equipo no se ve hasta que vence la copia.
+CACHE_CATALOGOS_MAX_AGE = int(os.getenv("CACHE_CATALOGOS_MAX_AGE", "0"))
+CACHE_OPERATIVOS_MAX_AGE = int(os.getenv("CACHE_OPERATIVOS_MAX_AGE", "0"))
+# Segundos entre recargas completas del índice de búsqueda (/buscar)
+BUSQUEDA_REFRESCO = float(os.getenv("BUSQUEDA_REFRESCO", "600"))
+
+# Fotos: tamaño máximo aceptado, lado mayor de la versión completa, miniaturas e hilos de Pillow
+FOTO_MAX_MB = float(os.getenv("FOTO_MAX_MB", "15"))
+FOTO_LADO_MAX = int(os.getenv("FOTO_LADO_MAX", "1600"))
+FOTO_MINIATURAS = tuple(int(t) for t in os.getenv("FOTO_MINIATURAS", "160,480").split(",") if t.strip())
+IMAGENES_WORKERS = int(os.getenv("IMAGENES_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Sync por deltas: segundos que se vuelven a pedir antes del watermark (transacciones que
+# confirman tarde) y días que se guardan las lápidas de filas borradas
+SYNC_TRASLAPE = float(os.getenv("SYNC_TRASLAPE", "5"))
+SYNC_RETENCION_DIAS = int(os.getenv("SYNC_RETENCION_DIAS", "30"))
+
+# Eventos en vivo (/eventos): segundos entre heartbeats y eventos pendientes por cliente
+EVENTOS_HEARTBEAT = float(os.getenv("EVENTOS_HEARTBEAT", "20"))
+EVENTOS_MAX_COLA = int(os.getenv("EVENTOS_MAX_COLA", "256"))
+
+# Token que Prometheus manda como Bearer para leer /metrics (vacío = /metrics responde 404)
+METRICAS_TOKEN = os.getenv("METRICAS_TOKEN", "")
+
+# Caché en memoria de catálogos (segundos / número máximo de consultas distintas)
+CATALOGO_CACHE_TTL = float(os.getenv("CATALOGO_CACHE_TTL", "300"))
+CATALOGO_CACHE_MAX = int(os.getenv("CATALOGO_CACHE_MAX", "256"))
+
+# Pool de conexiones hacia Supabase (límites, keep-alive, HTTP/2 opcional y timeouts por fase)
+HTTP_MAX_CONEXIONES = int(os.getenv("HTTP_MAX_CONEXIONES", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRA = float(os.getenv("HTTP_KEEPALIVE_EXPIRA", "30"))
+HTTP2 = os.getenv("HTTP2", "false").lower() in ("1", "true", "si", "yes")
+HTTP_TIMEOUT_CONNECT = float(os.getenv("HTTP_TIMEOUT_CONNECT", "5"))
+HTTP_TIMEOUT_READ = float(os.getenv("HTTP_TIMEOUT_READ", "15"))
+HTTP_TIMEOUT_WRITE = float(os.getenv("HTTP_TIMEOUT_WRITE", "15"))
+HTTP_TIMEOUT_POOL = float(os.getenv("HTTP_TIMEOUT_POOL", "5"))
+
 # Cliente HTTP compartido — se crea una sola vez y reutiliza el pool de conexiones TCP
 http_client: httpx.AsyncClient = None
 
+class TransporteMedido(httpx.AsyncBaseTransport):
+    """Envuelve el transporte del cliente y mide peticiones en vuelo y espera por conexión.
+
+    La espera es el tiempo entre que la petición entra al pool y empieza a conectar o a
+    enviar headers (eventos `trace` de httpcore); incluye la espera por una conexión libre."""
+
+    MUESTRAS = 1000
+
+    def __init__(self, interno: httpx.AsyncBaseTransport, http2: bool = False):
+        self.interno = interno
+        self.http2 = http2
+        self.en_vuelo = 0
+        self.en_vuelo_max = 0
+        self.peticiones = 0
+        self.errores = 0
+        self.conexiones_nuevas = 0
+        self._esperas: deque = deque(maxlen=self.MUESTRAS)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        inicio = time.perf_counter()
+        esperando = True
+        trace_previo = request.extensions.get("trace")
+
+        async def trace(evento: str, info: dict):
+            nonlocal esperando
+            if esperando and evento in ("connection.connect_tcp.started", "http11.send_request_headers.started",
+                                        "http2.send_request_headers.started"):
+                esperando = False
+                self._esperas.append((time.perf_counter() - inicio) * 1000)
+            if evento == "connection.connect_tcp.started":
+                self.conexiones_nuevas += 1
+            if trace_previo is not None:
+                await trace_previo(evento, info)
+
+        request.extensions["trace"] = trace
+        self.peticiones += 1
+        self.en_vuelo += 1
+        self.en_vuelo_max = max(self.en_vuelo_max, self.en_vuelo)
+        try:
+            return await self.interno.handle_async_request(request)
+        except httpx.TransportError:
+            self.errores += 1
+            raise
+        finally:
+            self.en_vuelo -= 1
+
+    async def aclose(self):
+        await self.interno.aclose()
+
+    def conexiones(self) -> dict:
+        # httpcore no expone el pool públicamente; si cambia, se reporta vacío
+        pool = getattr(self.interno, "_pool", None)
+        conexiones = list(getattr(pool, "connections", []) or [])
+        return {
+            "abiertas": len(conexiones),
+            "ociosas": sum(1 for c in conexiones if c.is_idle()),
+            "http2": sum(1 for c in conexiones if "HTTP/2" in repr(c)),
+        }
+
+    def estadisticas(self) -> dict:
+        esperas = sorted(self._esperas)
+
+        def percentil(p: float) -> float:
+            return round(esperas[min(len(esperas) - 1, int(len(esperas) * p))], 3) if esperas else 0.0
+
+        return {
+            "en_vuelo": self.en_vuelo,
+            "en_vuelo_max": self.en_vuelo_max,
+            "peticiones": self.peticiones,
+            "errores_transporte": self.errores,
+            "conexiones_nuevas": self.conexiones_nuevas,
+            "conexiones": self.conexiones(),
+            "espera_pool_ms": {"p50": percentil(0.5), "p95": percentil(0.95), "p99": percentil(0.99),
+                               "max": round(esperas[-1], 3) if esperas else 0.0, "muestras": len(esperas)},
+            "config": {"max_conexiones": HTTP_MAX_CONEXIONES, "max_keepalive": HTTP_MAX_KEEPALIVE,
+                       "keepalive_expira_s": HTTP_KEEPALIVE_EXPIRA, "http2": self.http2,
+                       "timeouts_s": {"connect": HTTP_TIMEOUT_CONNECT, "read": HTTP_TIMEOUT_READ,
+                                      "write": HTTP_TIMEOUT_WRITE, "pool": HTTP_TIMEOUT_POOL}},
+        }
+
+def _http2_disponible() -> bool:
+    try:
+        import h2  # noqa: F401  (requerido por httpx para HTTP/2)
+        return True
+    except ImportError:
+        logger.warning("HTTP2=true pero el paquete h2 no está instalado (pip install 'httpx[http2]'); se usa HTTP/1.1")
+        return False
+
+def crear_cliente_http() -> httpx.AsyncClient:
+    """Con DATA_BACKEND=sqlite las mismas peticiones PostgREST se sirven desde SQLite en proceso."""
+    timeout = httpx.Timeout(connect=HTTP_TIMEOUT_CONNECT, read=HTTP_TIMEOUT_READ,
+                            write=HTTP_TIMEOUT_WRITE, pool=HTTP_TIMEOUT_POOL)
+    if DATA_BACKEND == "sqlite":
+        from sqlite_local import SQLiteTransport
+        interno = SQLiteTransport(SQLITE_PATH, latencia_ms=SQLITE_LATENCIA_MS, jwt_secreto=SUPABASE_JWT_SECRET)
+        return httpx.AsyncClient(transport=TransporteMedido(interno), timeout=timeout)
+    limites = httpx.Limits(max_connections=HTTP_MAX_CONEXIONES,
+                           max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                           keepalive_expiry=HTTP_KEEPALIVE_EXPIRA)
+    http2 = HTTP2 and _http2_disponible()
+    interno = httpx.AsyncHTTPTransport(limits=limites, http2=http2)
+    return httpx.AsyncClient(transport=TransporteMedido(interno, http2=http2), timeout=timeout)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global http_client
-    http_client = httpx.AsyncClient(timeout=30.0)
-    logger.info("ComfortCan API iniciada — cliente HTTP listo")
+    http_client = crear_cliente_http()
+    await verificador_jwt.refrescar_jwks(http_client, forzar=True, headers={"apikey": SUPABASE_ANON_KEY})
+    refresco_vacunas = asyncio.create_task(refrescar_vacunas_periodicamente())
+    refresco_busqueda = asyncio.create_task(refrescar_busqueda_periodicamente())
+    if not PILLOW_DISPONIBLE:
+        logger.warning("Pillow no está instalado (pip install -r requirements.txt): las fotos se "
+                       "suben sin re-codificar ni miniaturas")
+    logger.info("ComfortCan API iniciada — cliente HTTP listo (backend: %s)", DATA_BACKEND)
     yield
+    refresco_vacunas.cancel()
+    refresco_busqueda.cancel()
+    await asyncio.gather(refresco_vacunas, refresco_busqueda, return_exceptions=True)
+    pool_imagenes.shutdown(wait=False, cancel_futures=True)
     await http_client.aclose()
     logger.info("ComfortCan API detenida — cliente HTTP cerrado")
 
@@ -68,6 +273,28 @@ app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 # Tipos de imagen permitidos para uploads
 ALLOWED_IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp", "image/jpg"}
 
+def _cache_control(max_age: int) -> str:
+    return f"private, max-age={max_age}" if max_age > 0 else "private, no-cache"
+
+# ETag y 304 en todos los GET con cuerpo completo; streams, /eventos y /sync (su watermark
+# cambia en cada respuesta) quedan fuera. Las escrituras no pasan por aquí.
+politica_cache = PoliticaCache(
+    reglas=(
+        ("/catalogo-", _cache_control(CACHE_CATALOGOS_MAX_AGE)),
+        ("/grooming/catalogo", _cache_control(CACHE_CATALOGOS_MAX_AGE)),
+        ("/personal", _cache_control(CACHE_CATALOGOS_MAX_AGE)),
+        ("/health", "no-store"),
+        ("/auth/", "no-store"),
+        ("/http/", "no-store"),
+        ("/cache/", "no-store"),
+        ("/storage/", "no-store"),
+    ),
+    por_defecto=_cache_control(CACHE_OPERATIVOS_MAX_AGE),
+    excluir=("/eventos", "/exportar/", "/sync", "/metrics"),
+)
+app.add_middleware(MiddlewareCacheHTTP, politica=politica_cache)
+# Antes que CORS para que el 413 también lleve los headers CORS
+app.add_middleware(LimiteSubida, limite=int(FOTO_MAX_MB * 1024 * 1024))
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
@@ -75,6 +302,13 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# El más externo: también cuenta los 413 del límite de subida y los preflight de CORS
+# (sin /eventos: sus conexiones duran minutos y distorsionarían el histograma de latencia)
+metricas = MetricasApp()
+app.add_middleware(MiddlewareMetricas, metricas=metricas, excluir=("/metrics", "/eventos"))
+
+# Pub/sub en proceso para /eventos: los handlers publican cada escritura relevante
+centro_eventos = CentroEventos(max_cola=EVENTOS_MAX_COLA)
 
 # ============================================
 # HELPERS
@@ -88,21 +322,493 @@ def get_headers(token: str = None):
         "Prefer": "return=representation"
     }
 
-async def supabase_request(method: str, endpoint: str, data: dict = None, token: str = None):
+def tabla_de(endpoint: str) -> str:
+    return endpoint.split("?", 1)[0]
+
+def alcance_token(token: str = None) -> str:
+    """Identificador corto del token para no mezclar resultados entre sesiones (RLS)."""
+    return hashlib.sha256((token or "").encode()).hexdigest()[:16]
+
+_FALTA = object()
+
+class CacheTTL:
+    """LRU acotado con expiración por entrada. Las llaves son (tabla, consulta, alcance)."""
+
+    def __init__(self, ttl: float, max_entradas: int):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._datos: OrderedDict = OrderedDict()
+        self._por_tabla: dict = {}
+        self._generacion: dict = {}
+        self.hits = 0
+        self.misses = 0
+        self.expulsiones = 0
+        self.invalidaciones = 0
+
+    def generacion(self, tabla: str) -> int:
+        return self._generacion.get(tabla, 0)
+
+    def obtener(self, llave: tuple):
+        entrada = self._datos.get(llave)
+        if entrada is None or entrada[0] < time.monotonic():
+            if entrada is not None:
+                self._quitar(llave)
+            self.misses += 1
+            return _FALTA
+        self._datos.move_to_end(llave)
+        self.hits += 1
+        return entrada[1]
+
+    def guardar(self, llave: tuple, valor, generacion: int):
+        # Si hubo una escritura mientras se consultaba, el valor ya está viejo
+        if generacion != self.generacion(llave[0]):
+            return
+        self._datos[llave] = (time.monotonic() + self.ttl, valor)
+        self._datos.move_to_end(llave)
+        self._por_tabla.setdefault(llave[0], set()).add(llave)
+        while len(self._datos) > self.max_entradas:
+            viejo = next(iter(self._datos))
+            self._quitar(viejo)
+            self.expulsiones += 1
+
+    def invalidar(self, tabla: str):
+        self._generacion[tabla] = self.generacion(tabla) + 1
+        llaves = self._por_tabla.pop(tabla, None)
+        if llaves:
+            for llave in llaves:
+                self._datos.pop(llave, None)
+            self.invalidaciones += 1
+
+    def _quitar(self, llave: tuple):
+        self._datos.pop(llave, None)
+        llaves = self._por_tabla.get(llave[0])
+        if llaves:
+            llaves.discard(llave)
+
+    def estadisticas(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entradas": len(self._datos),
+            "max_entradas": self.max_entradas,
+            "ttl_segundos": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "expulsiones": self.expulsiones,
+            "invalidaciones": self.invalidaciones,
+        }
+
+catalogo_cache = CacheTTL(CATALOGO_CACHE_TTL, CATALOGO_CACHE_MAX)
+
+class SingleFlight:
+    """Comparte una sola petición upstream entre llamadas idénticas concurrentes.
+
+    La petición corre en su propia tarea: si el primer llamador se cancela, los demás
+    siguen esperando el mismo resultado."""
+
+    def __init__(self):
+        self._vuelos: dict = {}
+        self.lideres = 0
+        self.coalescidas = 0
+
+    async def ejecutar(self, llave: tuple, funcion):
+        tarea = self._vuelos.get(llave)
+        if tarea is None:
+            tarea = asyncio.ensure_future(funcion())
+            self._vuelos[llave] = tarea
+            tarea.add_done_callback(lambda t: self._terminar(llave, t))
+            self.lideres += 1
+        else:
+            self.coalescidas += 1
+        return await asyncio.shield(tarea)
+
+    def _terminar(self, llave: tuple, tarea: asyncio.Future):
+        if self._vuelos.get(llave) is tarea:
+            del self._vuelos[llave]
+        # Marca la excepción como leída aunque todos los llamadores se hayan cancelado
+        if not tarea.cancelled():
+            tarea.exception()
+
+    def estadisticas(self) -> dict:
+        total = self.lideres + self.coalescidas
+        return {
+            "en_vuelo": len(self._vuelos),
+            "upstream": self.lideres,
+            "coalescidas": self.coalescidas,
+            "ratio_coalescidas": round(self.coalescidas / total, 4) if total else 0.0,
+        }
+
+# ============================================
+# RESILIENCIA: REINTENTOS, CIRCUIT BREAKER Y LECTURAS COBERTURADAS
+# ============================================
+# Reintentos con backoff exponencial y jitter completo para métodos idempotentes (y para
+# cualquier método si la conexión nunca se estableció). Tras BREAKER_UMBRAL fallas seguidas
+# el circuito se abre y las peticiones fallan de inmediato con 503 durante BREAKER_ESPERA s;
+# después pasa una sola petición de prueba. Con HEDGE_MS > 0, un GET que tarda más de eso
+# lanza una segunda petición idéntica y se usa la primera que responda.
+REINTENTOS_MAX = int(os.getenv("REINTENTOS_MAX", "2"))
+REINTENTO_BASE_MS = float(os.getenv("REINTENTO_BASE_MS", "100"))
+REINTENTO_MAX_MS = float(os.getenv("REINTENTO_MAX_MS", "2000"))
+BREAKER_UMBRAL = int(os.getenv("BREAKER_UMBRAL", "5"))
+BREAKER_ESPERA = float(os.getenv("BREAKER_ESPERA", "30"))
+HEDGE_MS = float(os.getenv("HEDGE_MS", "0"))
+
+METODOS_IDEMPOTENTES = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+STATUS_REINTENTABLES = {502, 503, 504}
+# Errores en los que la petición no llegó a enviarse: se pueden reintentar con cualquier método
+ERRORES_SIN_ENVIO = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+class CircuitBreaker:
+    """Estados: cerrado (normal), abierto (falla rápido) y semiabierto (una prueba en curso)."""
+
+    def __init__(self, umbral: int, espera: float):
+        self.umbral = umbral
+        self.espera = espera
+        self.estado = "cerrado"
+        self.fallas_seguidas = 0
+        self.abierto_en = 0.0
+        self._prueba_en_curso = False
+        self.transiciones: dict = {}
+        self.rechazos = 0
+
+    def _cambiar(self, estado: str):
+        if estado != self.estado:
+            logger.warning("Circuit breaker de Supabase: %s -> %s", self.estado, estado)
+            clave = f"{self.estado}->{estado}"
+            self.transiciones[clave] = self.transiciones.get(clave, 0) + 1
+            self.estado = estado
+
+    def permitir(self):
+        if self.estado == "abierto":
+            if time.monotonic() - self.abierto_en < self.espera:
+                self.rechazos += 1
+                raise HTTPException(status_code=503, detail="Supabase no disponible (circuito abierto)")
+            self._cambiar("semiabierto")
+        if self.estado == "semiabierto":
+            if self._prueba_en_curso:
+                self.rechazos += 1
+                raise HTTPException(status_code=503, detail="Supabase no disponible (circuito abierto)")
+            self._prueba_en_curso = True
+
+    def liberar(self):
+        """La petición terminó sin veredicto sobre Supabase (p. ej. se canceló)."""
+        self._prueba_en_curso = False
+
+    def exito(self):
+        self._prueba_en_curso = False
+        self.fallas_seguidas = 0
+        self._cambiar("cerrado")
+
+    def fallo(self):
+        self._prueba_en_curso = False
+        self.fallas_seguidas += 1
+        if self.estado == "semiabierto" or self.fallas_seguidas >= self.umbral:
+            self.abierto_en = time.monotonic()
+            self._cambiar("abierto")
+
+    def estadisticas(self) -> dict:
+        return {"estado": self.estado, "fallas_seguidas": self.fallas_seguidas,
+                "rechazos": self.rechazos, "transiciones": dict(self.transiciones)}
+
+breaker_supabase = CircuitBreaker(BREAKER_UMBRAL, BREAKER_ESPERA)
+metricas_resiliencia = {"reintentos": {}, "agotados": 0, "hedges": 0, "hedges_ganados": 0}
+
+def _contar_reintento(causa: str):
+    reintentos = metricas_resiliencia["reintentos"]
+    reintentos[causa] = reintentos.get(causa, 0) + 1
+
+def _espera_reintento(intento: int, response: Optional[httpx.Response] = None) -> float:
+    espera = random.uniform(0, min(REINTENTO_MAX_MS, REINTENTO_BASE_MS * 2 ** intento)) / 1000
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        espera = max(espera, min(float(retry_after), REINTENTO_MAX_MS / 1000))
+    return espera
+
+async def _con_cobertura(method: str, url: str, **kwargs) -> httpx.Response:
+    """GET cubierto: si la primera petición tarda más de HEDGE_MS se lanza una segunda."""
+    primera = asyncio.ensure_future(http_client.request(method, url, **kwargs))
+    pendientes = {primera}
+    try:
+        hechas, _ = await asyncio.wait(pendientes, timeout=HEDGE_MS / 1000)
+        if not hechas:
+            metricas_resiliencia["hedges"] += 1
+            pendientes.add(asyncio.ensure_future(http_client.request(method, url, **kwargs)))
+        error = None
+        while pendientes:
+            hechas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+            for tarea in hechas:
+                if tarea.exception() is None:
+                    if tarea is not primera:
+                        metricas_resiliencia["hedges_ganados"] += 1
+                    return tarea.result()
+                error = tarea.exception()
+        raise error
+    finally:
+        for tarea in pendientes:
+            tarea.cancel()
+
+async def enviar_resiliente(method: str, url: str, **kwargs) -> httpx.Response:
+    idempotente = method in METODOS_IDEMPOTENTES
+    intento = 0
+    while True:
+        breaker_supabase.permitir()
+        try:
+            if HEDGE_MS > 0 and method in ("GET", "HEAD"):
+                response = await _con_cobertura(method, url, **kwargs)
+            else:
+                response = await http_client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            breaker_supabase.fallo()
+            if intento < REINTENTOS_MAX and (idempotente or isinstance(e, ERRORES_SIN_ENVIO)):
+                _contar_reintento(type(e).__name__)
+                await asyncio.sleep(_espera_reintento(intento))
+                intento += 1
+                continue
+            metricas_resiliencia["agotados"] += 1
+            logger.error("Supabase no respondió (%s %s): %r", method, tabla_de(url), e)
+            status = 504 if isinstance(e, httpx.TimeoutException) else 502
+            raise HTTPException(status_code=status, detail="Supabase no disponible, intenta de nuevo")
+        except BaseException:
+            # Cancelación u otro error local: no cuenta como falla de Supabase
+            breaker_supabase.liberar()
+            raise
+        if response.status_code in STATUS_REINTENTABLES:
+            breaker_supabase.fallo()
+            if idempotente and intento < REINTENTOS_MAX:
+                _contar_reintento(str(response.status_code))
+                await asyncio.sleep(_espera_reintento(intento, response))
+                intento += 1
+                continue
+            metricas_resiliencia["agotados"] += 1
+        else:
+            breaker_supabase.exito()
+        return response
+
+def estadisticas_resiliencia() -> dict:
+    return {**metricas_resiliencia, "reintentos": dict(metricas_resiliencia["reintentos"]),
+            "breaker": breaker_supabase.estadisticas(),
+            "config": {"reintentos_max": REINTENTOS_MAX, "base_ms": REINTENTO_BASE_MS,
+                       "max_ms": REINTENTO_MAX_MS, "breaker_umbral": BREAKER_UMBRAL,
+                       "breaker_espera_s": BREAKER_ESPERA, "hedge_ms": HEDGE_MS}}
+
+# GETs idénticos concurrentes (mismo endpoint, headers y token) comparten una petición a Supabase
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() in ("1", "true", "si", "yes")
+single_flight = SingleFlight()
+
+async def supabase_response(method: str, endpoint: str, data=None, token: str = None,
+                            headers: dict = None) -> httpx.Response:
+    """Petición a PostgREST que regresa la respuesta completa (para leer Content-Range, etc.)."""
+    inicio = time.perf_counter()
+    error = True
+    try:
+        if SINGLE_FLIGHT and method in ("GET", "HEAD"):
+            # El alcance del token separa sesiones (RLS) y la generación de la tabla evita unirse
+            # a una lectura que empezó antes de una escritura hecha por este proceso
+            llave = (method, endpoint, alcance_token(token), tuple(sorted((headers or {}).items())),
+                     catalogo_cache.generacion(tabla_de(endpoint)))
+            response = await single_flight.ejecutar(llave, lambda: _enviar(method, endpoint, data, token, headers))
+        else:
+            response = await _enviar(method, endpoint, data, token, headers)
+        error = False
+        return response
+    finally:
+        # Se mide lo que esperó esta petición (incluida la espera a una lectura compartida)
+        metricas.registrar_supabase(tabla_de(endpoint), method, time.perf_counter() - inicio, error)
+
+async def _enviar(method: str, endpoint: str, data, token: str, headers: dict) -> httpx.Response:
     url = f"{SUPABASE_URL}/rest/v1/{endpoint}"
-    response = await http_client.request(
-        method=method,
-        url=url,
-        headers=get_headers(token),
+    response = await enviar_resiliente(
+        method,
+        url,
+        headers={**get_headers(token), **headers} if headers else get_headers(token),
         json=data if data else None,
     )
     if response.status_code >= 400:
         raise HTTPException(status_code=response.status_code, detail=response.text)
+    if method not in ("GET", "HEAD"):
+        # Cualquier escritura invalida las consultas cacheadas de esa tabla
+        catalogo_cache.invalidar(tabla_de(endpoint))
+    return response
+
+async def supabase_request(method: str, endpoint: str, data: dict = None, token: str = None,
+                           headers: dict = None):
+    response = await supabase_response(method, endpoint, data, token=token, headers=headers)
     try:
         return response.json() if response.text else None
     except Exception:
         return None
 
+def filtro_in(ids) -> str:
+    """Filtro PostgREST `in.("a","b")` para una lista de ids."""
+    return "in.(" + ",".join(f'"{i}"' for i in ids) + ")"
+
+# Funciones SQL (RPC) que no están instaladas en el proyecto de Supabase; se detecta en la primera llamada
+_rpc_faltantes: set = set()
+
+async def supabase_rpc(nombre: str, args: dict, token: str = None, tablas: tuple = ()):
+    """POST /rpc/{nombre}. Regresa _FALTA si la función no existe para usar la ruta alterna.
+    `tablas`: las que escribe la función; _enviar solo invalida la pseudo-tabla rpc/{nombre},
+    así que los caches por generación de esas tablas se invalidan aquí."""
+    if nombre in _rpc_faltantes:
+        return _FALTA
+    try:
+        resultado = await supabase_request("POST", f"rpc/{nombre}", args, token=token)
+    except HTTPException as e:
+        if e.status_code == 404 and "PGRST202" in str(e.detail):
+            _rpc_faltantes.add(nombre)
+            logger.warning("Función RPC %s no instalada en Supabase; usando ruta alterna", nombre)
+            return _FALTA
+        raise
+    for tabla in tablas:
+        catalogo_cache.invalidar(tabla)
+    return resultado
+
+async def contar_filas(endpoint: str, token: str = None) -> int:
+    """Número de filas de una consulta con HEAD + Prefer: count=exact, sin descargarlas."""
+    response = await supabase_response("HEAD", endpoint, token=token, headers={"Prefer": "count=exact"})
+    total = response.headers.get("content-range", "*/0").rsplit("/", 1)[-1]
+    return int(total) if total.isdigit() else 0
+
+# Máximo de ids por filtro in.(...) para no exceder el largo de URL del gateway de Supabase
+MAX_IDS_POR_FILTRO = 100
+
+def lotes(ids: list, tam: int = MAX_IDS_POR_FILTRO) -> list:
+    ids = list(dict.fromkeys(ids))
+    return [ids[i:i + tam] for i in range(0, len(ids), tam)]
+
+async def consulta_por_ids(tabla: str, ids: list, extra: str = "", token: str = None) -> list:
+    """GET de muchas filas por id: un filtro in.(...) por lote, lotes en paralelo."""
+    partes = await asyncio.gather(*(
+        supabase_request("GET", f"{tabla}?id={filtro_in(lote)}{extra}", token=token) for lote in lotes(ids)
+    ))
+    return [fila for parte in partes for fila in (parte or [])]
+
+async def actualizar_por_ids(tabla: str, ids: list, data: dict, token: str = None) -> list:
+    partes = await asyncio.gather(*(
+        supabase_request("PATCH", f"{tabla}?id={filtro_in(lote)}", data, token=token) for lote in lotes(ids)
+    ))
+    return [fila for parte in partes for fila in (parte or [])]
+
+# Máximo de registros por inserción masiva (una ronda de comidas son 30-60 perros)
+MAX_LOTE_INSERCION = 500
+
+async def insertar_lote(tabla: str, modelos: list, token: str, referencias: dict = None) -> dict:
+    """Valida todos los registros y los inserta con un solo POST (arreglo JSON) a PostgREST.
+    El INSERT es todo o nada. `referencias` ({columna: tabla}) se usa para decir qué
+    registros apuntan a ids inexistentes cuando la base rechaza el lote por llave foránea."""
+    if not modelos:
+        raise HTTPException(status_code=400, detail="El lote está vacío")
+    if len(modelos) > MAX_LOTE_INSERCION:
+        raise HTTPException(status_code=413, detail=f"Máximo {MAX_LOTE_INSERCION} registros por lote")
+    # PostgREST exige las mismas llaves en todos los objetos del arreglo: sin exclude_none
+    filas = [m.model_dump() for m in modelos]
+    errores = [{"indice": i, "campo": "fecha", "error": "Fecha inválida (AAAA-MM-DD)"}
+               for i, f in enumerate(filas) if "fecha" in f and parse_fecha(f["fecha"]) is None]
+    if errores:
+        raise HTTPException(status_code=422, detail={"mensaje": "Registros inválidos", "errores": errores})
+    try:
+        creadas = await supabase_request("POST", tabla, filas, token=token) or []
+    except HTTPException as e:
+        if e.status_code == 409 and "23503" in str(e.detail) and referencias:
+            errores = await _referencias_faltantes(filas, referencias, token)
+            if errores:
+                raise HTTPException(status_code=422, detail={"mensaje": "Registros inválidos", "errores": errores})
+        raise
+    return {
+        "insertados": len(creadas),
+        "resultados": [{"indice": i, "id": fila.get("id"), "registro": fila} for i, fila in enumerate(creadas)],
+    }
+
+async def _referencias_faltantes(filas: list, referencias: dict, token: str) -> list:
+    columnas = list(referencias)
+    existentes = await asyncio.gather(*(
+        consulta_por_ids(referencias[col], [f[col] for f in filas if f.get(col)], "&select=id", token=token)
+        for col in columnas
+    ))
+    validos = {col: {r["id"] for r in filas_ok} for col, filas_ok in zip(columnas, existentes)}
+    return [{"indice": i, "campo": col, "error": f"{referencias[col]} {f[col]} no existe"}
+            for i, f in enumerate(filas) for col in columnas
+            if f.get(col) and f[col] not in validos[col]]
+
+async def consulta_catalogo(endpoint: str, token: str = None):
+    """GET cacheado para tablas de catálogo; se invalida con cualquier escritura a la tabla."""
+    tabla = tabla_de(endpoint)
+    llave = (tabla, endpoint, alcance_token(token))
+    valor = catalogo_cache.obtener(llave)
+    if valor is not _FALTA:
+        return valor
+    generacion = catalogo_cache.generacion(tabla)
+    valor = await supabase_request("GET", endpoint, token=token)
+    catalogo_cache.guardar(llave, valor, generacion)
+    return valor
+
+# ============================================
+# PAGINACIÓN POR CURSOR Y PROYECCIÓN DE CAMPOS
+# ============================================
+# Con `limit` los listados regresan {"items": [...], "next_cursor": ...} ordenados por
+# (fecha, id) descendente; sin `limit` siguen regresando la lista completa.
+MAX_LIMIT_PAGINA = 500
+
+def codificar_cursor(fecha, id: str) -> str:
+    crudo = json.dumps([fecha, id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(crudo).decode().rstrip("=")
+
+def decodificar_cursor(cursor: str) -> tuple:
+    try:
+        fecha, id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(fecha), str(id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def select_con_campos(fields: Optional[str], select_default: str, embebidos: dict, requeridos: list) -> str:
+    """Traduce `fields=id,fecha,perros` al `select` de PostgREST. Los nombres de recursos
+    embebidos se expanden con su select habitual; `requeridos` siempre se incluyen."""
+    if not fields:
+        return select_default
+    columnas = []
+    for campo in (c.strip() for c in fields.split(",")):
+        if not campo:
+            continue
+        if campo in embebidos:
+            columnas.append(embebidos[campo])
+        elif campo.isidentifier():
+            columnas.append(campo)
+        else:
+            raise HTTPException(status_code=400, detail=f"Campo inválido: {campo}")
+    for campo in requeridos:
+        if campo not in columnas:
+            columnas.append(campo)
+    return ",".join(columnas)
+
+async def listar_con_cursor(tabla: str, select: str, filtros: str, columna_fecha: str,
+                            limit: int, cursor: Optional[str], token: str) -> dict:
+    """Keyset pagination sobre (columna_fecha, id) descendente: cada página cuesta lo mismo."""
+    limit = max(1, min(limit, MAX_LIMIT_PAGINA))
+    endpoint = f"{tabla}?select={select}{filtros}&order={columna_fecha}.desc,id.desc&limit={limit + 1}"
+    if cursor:
+        fecha, ultimo_id = decodificar_cursor(cursor)
+        f, i = quote(f'"{fecha}"', safe=""), quote(f'"{ultimo_id}"', safe="")
+        endpoint += f"&or=({columna_fecha}.lt.{f},and({columna_fecha}.eq.{f},id.lt.{i}))"
+    filas = await supabase_request("GET", endpoint, token=token) or []
+    siguiente = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        siguiente = codificar_cursor(filas[-1].get(columna_fecha), filas[-1]["id"])
+    return {"items": filas, "next_cursor": siguiente}
+
+verificador_jwt = VerificadorJWT(
+    secreto=SUPABASE_JWT_SECRET,
+    jwks_url=f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json" if SUPABASE_URL else None,
+    refresco=JWKS_REFRESCO,
+    refresco_minimo=JWKS_REFRESCO_MINIMO,
+    max_entradas=JWT_CACHE_MAX,
+    audiencia=JWT_AUDIENCIA or None,
+    emisor=JWT_EMISOR or None,
+)
+
+# Claims del token de la petición en curso (los fija verify_token)
+_claims_actuales: ContextVar = ContextVar("claims_actuales", default=None)
+
 async def verify_token(authorization: str = Header(None)):
     if not authorization:
         raise HTTPException(status_code=401, detail="Token requerido")
@@ -110,8 +816,29 @@ async def verify_token(authorization: str = Header(None)):
     # Validación básica de formato JWT: debe tener exactamente 3 partes (header.payload.signature)
     if not token or token.count(".") != 2:
         raise HTTPException(status_code=401, detail="Token con formato inválido")
+    # Firma, expiración, aud e iss se validan localmente; un token inválido no llega a Supabase.
+    # La recarga periódica del JWKS corre en segundo plano y no retrasa esta petición
+    verificador_jwt.refrescar_en_segundo_plano(http_client, headers={"apikey": SUPABASE_ANON_KEY})
+    try:
+        try:
+            claims = verificador_jwt.verificar(token)
+        except ClaveDesconocida:
+            # Posible rotación de llaves: recargar el JWKS (a lo más una vez cada
+            # JWKS_REFRESCO_MINIMO segundos) y reintentar; si sigue sin aparecer, 401
+            await verificador_jwt.refrescar_jwks(http_client, forzar=True, headers={"apikey": SUPABASE_ANON_KEY})
+            claims = verificador_jwt.verificar(token)
+    except TokenInvalido as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    _claims_actuales.set(claims)
     return token
 
+def usuario_actual() -> Optional[dict]:
+    """Usuario del token verificado en esta petición (None si no se pudo verificar localmente)."""
+    claims = _claims_actuales.get()
+    if not claims:
+        return None
+    return {"id": claims.get("sub"), "email": claims.get("email"), "rol": claims.get("role")}
+
 # ============================================
 # MODELOS PYDANTIC
 # ============================================
@@ -200,6 +927,10 @@ class TicketCreate(BaseModel):
     metodo_pago: Optional[str] = "Efectivo"
     notas: Optional[str] = None
 
+class EnvioCajaLote(BaseModel):
+    paseos_ids: List[str] = []
+    grooming_ids: List[str] = []
+
 class ServicioCreate(BaseModel):
     nombre: str
     precio: float
@@ -246,6 +977,14 @@ async def health():
         logger.error("Health check falló: %s", e)
         return {"status": "unhealthy", "database": "unreachable"}
 
+@app.get("/auth/yo")
+async def yo(authorization: str = Header(None)):
+    await verify_token(authorization)
+    usuario = usuario_actual()
+    if usuario is None:
+        raise HTTPException(status_code=503, detail="Verificación local de JWT no configurada")
+    return usuario
+
 @app.post("/login")
 @limiter.limit("5/minute")
 async def login(http_request: Request, request: LoginRequest):
@@ -266,6 +1005,98 @@ async def login(http_request: Request, request: LoginRequest):
         "email": data["user"]["email"]
     }
 
+# ============================================
+# BORRADO PERMANENTE EN CASCADA
+# ============================================
+# Tablas que referencian a perros, por niveles: las de un mismo nivel se borran en
+# paralelo y cada nivel espera al anterior (notas -> estancias -> perros).
+# Los tickets son comprobantes emitidos y contabilidad: no se borran, se desvinculan
+# (perro_id/propietario_id = NULL) antes de borrar al perro o al propietario.
+CASCADA_PERROS = [
+    ["notas_estancia", "paseos", "grooming_citas", "alimentacion_registro", "medicamentos_log", "cargos",
+     "tickets"],
+    ["estancias"],
+    ["perros"],
+]
+TABLAS_CASCADA = tuple(t for nivel in CASCADA_PERROS for t in nivel) + ("propietarios",)
+
+async def _borrar_tabla(tabla: str, filtro: str, token: str) -> tuple:
+    inicio = time.perf_counter()
+    if tabla == "tickets":
+        columna = filtro.split("=", 1)[0]
+        filas = await supabase_request("PATCH", f"tickets?{filtro}&select=id", {columna: None}, token=token) or []
+    else:
+        filas = await supabase_request("DELETE", f"{tabla}?{filtro}&select=id", token=token) or []
+    return tabla, len(filas), (time.perf_counter() - inicio) * 1000
+
+async def eliminar_en_cascada(perros_ids: List[str], token: str, propietario_id: str = None) -> dict:
+    """Borra los perros, todo lo que los referencia (salvo los tickets, que se desvinculan)
+    y opcionalmente al propietario.
+    Usa la función SQL eliminar_perros_cascada (una transacción) si existe; si no,
+    un DELETE perro_id=in.(...) por tabla, en paralelo dentro de cada nivel."""
+    try:
+        return await _eliminar_en_cascada(perros_ids, token, propietario_id)
+    finally:
+        # Se borran estancias sin conocer sus ids: el índice se recarga en la siguiente consulta
+        indice_ocupacion.invalidar()
+        for perro_id in perros_ids:
+            indice_vacunas.quitar(perro_id)
+            indice_busqueda.quitar_perro(perro_id)
+        if propietario_id:
+            indice_busqueda.quitar_propietario(propietario_id)
+
+async def _eliminar_en_cascada(perros_ids: List[str], token: str, propietario_id: str = None) -> dict:
+    inicio = time.perf_counter()
+    resultado = await supabase_rpc("eliminar_perros_cascada",
+                                   {"p_perros_ids": perros_ids, "p_propietario_id": propietario_id}, token=token,
+                                   tablas=TABLAS_CASCADA)
+    if resultado is not _FALTA:
+        return {"transaccional": True, "tablas": resultado.get("tablas", {}),
+                "total_ms": round((time.perf_counter() - inicio) * 1000, 2)}
+
+    tablas: dict = {}
+    niveles = [list(n) for n in CASCADA_PERROS] if perros_ids else []
+    if propietario_id:
+        niveles = niveles or [[], [], ["perros"]]
+        niveles[0].append("tickets:propietario")
+        niveles.append(["propietarios"])
+
+    estancias_ids = []
+    if perros_ids:
+        estancias = await asyncio.gather(*(
+            supabase_request("GET", f"estancias?perro_id={filtro_in(lote)}&select=id", token=token)
+            for lote in lotes(perros_ids)
+        ))
+        estancias_ids = [e["id"] for parte in estancias for e in (parte or [])]
+
+    def filtros(tabla: str) -> list:
+        if tabla == "notas_estancia":
+            return [f"estancia_id={filtro_in(lote)}" for lote in lotes(estancias_ids)]
+        if tabla == "perros":
+            return [f"id={filtro_in(lote)}" for lote in lotes(perros_ids)] + \
+                ([f"propietario_id=eq.{propietario_id}"] if propietario_id else [])
+        if tabla == "tickets:propietario":
+            return [f"propietario_id=eq.{propietario_id}"]
+        if tabla == "propietarios":
+            return [f"id=eq.{propietario_id}"]
+        return [f"perro_id={filtro_in(lote)}" for lote in lotes(perros_ids)]
+
+    for nivel in niveles:
+        tareas = [_borrar_tabla(t.split(":")[0], f, token) for t in nivel for f in filtros(t)]
+        try:
+            parciales = await asyncio.gather(*tareas)
+        except HTTPException as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error en borrado en cascada (nivel {nivel}): {e.detail}. Eliminado hasta ahora: {tablas}"
+            )
+        for tabla, n, ms in parciales:
+            previo = tablas.get(tabla, {"filas": 0, "ms": 0.0})
+            tablas[tabla] = {"filas": previo["filas"] + n, "ms": round(max(previo["ms"], ms), 2)}
+
+    return {"transaccional": False, "tablas": tablas,
+            "total_ms": round((time.perf_counter() - inicio) * 1000, 2)}
+
 # ============================================
 # ENDPOINTS: PROPIETARIOS
 # ============================================
@@ -290,47 +1121,32 @@ async def obtener_propietario(id: str, authorization: str = Header(None)):
 async def crear_propietario(data: PropietarioCreate, authorization: str = Header(None)):
     token = await verify_token(authorization)
     result = await supabase_request("POST", "propietarios", data.model_dump(exclude_none=True), token=token)
+    if result:
+        indice_busqueda.registrar_propietario(result[0])
     return result[0] if result else None
 
 @app.put("/propietarios/{id}")
 async def actualizar_propietario(id: str, data: PropietarioCreate, authorization: str = Header(None)):
     token = await verify_token(authorization)
     result = await supabase_request("PATCH", f"propietarios?id=eq.{id}", data.model_dump(exclude_none=True), token=token)
+    if result:
+        indice_vacunas.actualizar_propietario(id, result[0])
+        indice_busqueda.registrar_propietario(result[0])
     return result[0] if result else None
 
 @app.delete("/propietarios/{id}")
 async def eliminar_propietario(id: str, authorization: str = Header(None)):
     token = await verify_token(authorization)
     await supabase_request("PATCH", f"propietarios?id=eq.{id}", {"activo": False}, token=token)
+    indice_busqueda.quitar_propietario(id)
     return {"message": "Propietario desactivado"}
 
 @app.delete("/propietarios/{id}/permanente")
 async def eliminar_propietario_permanente(id: str, authorization: str = Header(None)):
     token = await verify_token(authorization)
-    # Obtener perros del propietario
-    perros = await supabase_request("GET", f"perros?propietario_id=eq.{id}&select=id", token=token)
-    # Eliminar datos relacionados de cada perro
-    for perro in perros:
-        pid = perro["id"]
-        try:
-            await supabase_request("DELETE", f"estancias?perro_id=eq.{pid}", token=token)
-            await supabase_request("DELETE", f"cargos?perro_id=eq.{pid}", token=token)
-            await supabase_request("DELETE", f"paseos?perro_id=eq.{pid}", token=token)
-        except HTTPException as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error al eliminar datos del perro {pid}: {e.detail}"
-            )
-    # Eliminar todos los perros del propietario
-    try:
-        await supabase_request("DELETE", f"perros?propietario_id=eq.{id}", token=token)
-        await supabase_request("DELETE", f"propietarios?id=eq.{id}", token=token)
-    except HTTPException as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error al eliminar propietario {id}: {e.detail}"
-        )
-    return {"message": "Propietario y sus perros eliminados permanentemente"}
+    perros = await supabase_request("GET", f"perros?propietario_id=eq.{id}&select=id", token=token) or []
+    reporte = await eliminar_en_cascada([p["id"] for p in perros], token, propietario_id=id)
+    return {"message": "Propietario y sus perros eliminados permanentemente", **reporte}
 
 # ============================================
 # ENDPOINTS: PERROS
@@ -358,35 +1174,88 @@ async def obtener_perro(id: str, authorization: str = Header(None)):
 async def crear_perro(data: PerroCreate, authorization: str = Header(None)):
     token = await verify_token(authorization)
     perro_data = data.model_dump(exclude_none=True)
-    result = await supabase_request("POST", "perros", perro_data, token=token)
+    # El select con propietarios deja la fila lista para el índice de vacunas
+    result = await supabase_request("POST", "perros?select=*,propietarios(nombre,telefono)", perro_data, token=token)
+    if result:
+        indice_vacunas.registrar(result[0])
+        indice_busqueda.registrar_perro(result[0])
     return result[0] if result else None
 
 @app.put("/perros/{id}")
 async def actualizar_perro(id: str, data: PerroCreate, authorization: str = Header(None)):
     token = await verify_token(authorization)
-    result = await supabase_request("PATCH", f"perros?id=eq.{id}", data.model_dump(exclude_none=True), token=token)
+    result = await supabase_request("PATCH", f"perros?id=eq.{id}&select=*,propietarios(nombre,telefono)",
+                                    data.model_dump(exclude_none=True), token=token)
+    if result:
+        indice_vacunas.registrar(result[0])
+        indice_busqueda.registrar_perro(result[0])
     return result[0] if result else None
 
 @app.delete("/perros/{id}")
 async def eliminar_perro(id: str, authorization: str = Header(None)):
     token = await verify_token(authorization)
     await supabase_request("PATCH", f"perros?id=eq.{id}", {"activo": False}, token=token)
+    indice_vacunas.quitar(id)
+    indice_busqueda.quitar_perro(id)
     return {"message": "Perro desactivado"}
 
 @app.delete("/perros/{id}/permanente")
 async def eliminar_perro_permanente(id: str, authorization: str = Header(None)):
     token = await verify_token(authorization)
-    try:
-        await supabase_request("DELETE", f"estancias?perro_id=eq.{id}", token=token)
-        await supabase_request("DELETE", f"cargos?perro_id=eq.{id}", token=token)
-        await supabase_request("DELETE", f"paseos?perro_id=eq.{id}", token=token)
-        await supabase_request("DELETE", f"perros?id=eq.{id}", token=token)
-    except HTTPException as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error al eliminar perro {id}: {e.detail}"
-        )
-    return {"message": "Perro eliminado permanentemente"}
+    reporte = await eliminar_en_cascada([id], token)
+    return {"message": "Perro eliminado permanentemente", **reporte}
+
+# ============================================
+# ENDPOINTS: CACHÉ
+# ============================================
+
+@app.get("/metrics", include_in_schema=False)
+async def metricas_prometheus(authorization: str = Header(None)):
+    """Métricas en formato de texto de Prometheus (0.0.4)."""
+    if not METRICAS_TOKEN:
+        # Sin token configurado no se exponen rutas, errores ni contadores internos
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(authorization or "", f"Bearer {METRICAS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Token de métricas inválido")
+    transporte = http_client._transport.estadisticas()
+    cache = catalogo_cache.estadisticas()
+    vuelos = single_flight.estadisticas()
+    extra = [
+        ("comfortcan_supabase_in_flight", "Peticiones a Supabase en vuelo", "gauge", transporte["en_vuelo"]),
+        ("comfortcan_supabase_new_connections_total", "Conexiones nuevas abiertas a Supabase", "counter",
+         transporte["conexiones_nuevas"]),
+        ("comfortcan_supabase_breaker_open", "1 si el circuit breaker de Supabase está abierto", "gauge",
+         int(breaker_supabase.estado == "abierto")),
+        ("comfortcan_supabase_retries_total", "Reintentos hacia Supabase", "counter",
+         sum(metricas_resiliencia["reintentos"].values())),
+        ("comfortcan_cache_hits_total", "Aciertos de la caché de catálogos", "counter", cache["hits"]),
+        ("comfortcan_cache_misses_total", "Fallos de la caché de catálogos", "counter", cache["misses"]),
+        ("comfortcan_single_flight_coalesced_total", "Lecturas que compartieron una petición en vuelo",
+         "counter", vuelos["coalescidas"]),
+        ("comfortcan_event_subscribers", "Clientes conectados a /eventos", "gauge",
+         len(centro_eventos.suscriptores)),
+        ("comfortcan_events_published_total", "Eventos publicados a /eventos", "counter", centro_eventos.publicados),
+        ("comfortcan_http_not_modified_total", "Lecturas respondidas con 304 por ETag", "counter",
+         politica_cache.no_modificadas),
+        ("comfortcan_http_not_modified_bytes_total", "Bytes de cuerpo que no se enviaron gracias a un 304",
+         "counter", politica_cache.bytes_ahorrados),
+    ]
+    return PlainTextResponse(metricas.exponer(extra), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/http/estadisticas")
+async def estadisticas_http(authorization: str = Header(None)):
+    await verify_token(authorization)
+    return {**http_client._transport.estadisticas(), "resiliencia": estadisticas_resiliencia()}
+
+@app.get("/cache/estadisticas")
+async def estadisticas_cache(authorization: str = Header(None)):
+    await verify_token(authorization)
+    return {"catalogos": catalogo_cache.estadisticas(), "dashboard": dashboard_cache.estadisticas(),
+            "calendario": calendario_cache.estadisticas(),
+            "vacunas": indice_vacunas.estadisticas(), "busqueda": indice_busqueda.estadisticas(),
+            "single_flight": single_flight.estadisticas(),
+            "jwt": verificador_jwt.estadisticas(), "eventos": centro_eventos.estadisticas(),
+            "http_304": politica_cache.estadisticas()}
 
 # ============================================
 # ENDPOINTS: CATÁLOGO SERVICIOS
@@ -395,7 +1264,7 @@ async def eliminar_perro_permanente(id: str, authorization: str = Header(None)):
 @app.get("/catalogo-servicios")
 async def listar_servicios(authorization: str = Header(None)):
     token = await verify_token(authorization)
-    return await supabase_request("GET", "catalogo_servicios?select=*&activo=eq.true&order=nombre", token=token)
+    return await consulta_catalogo("catalogo_servicios?select=*&activo=eq.true&order=nombre", token=token)
 
 @app.post("/catalogo-servicios")
 async def crear_servicio(data: ServicioCreate, authorization: str = Header(None)):
@@ -422,7 +1291,7 @@ async def eliminar_servicio(id: str, authorization: str = Header(None)):
 @app.get("/catalogo-paseos")
 async def listar_catalogo_paseos(authorization: str = Header(None)):
     token = await verify_token(authorization)
-    return await supabase_request("GET", "catalogo_paseos?select=*&activo=eq.true&order=precio", token=token)
+    return await consulta_catalogo("catalogo_paseos?select=*&activo=eq.true&order=precio", token=token)
 
 @app.post("/catalogo-paseos")
 async def crear_tipo_paseo(data: TipoPaseoCreate, authorization: str = Header(None)):
@@ -449,7 +1318,7 @@ async def eliminar_tipo_paseo(id: str, authorization: str = Header(None)):
 @app.get("/catalogo-habitaciones")
 async def listar_habitaciones(authorization: str = Header(None)):
     token = await verify_token(authorization)
-    return await supabase_request("GET", "catalogo_habitaciones?select=*&activo=eq.true&order=nombre", token=token)
+    return await consulta_catalogo("catalogo_habitaciones?select=*&activo=eq.true&order=nombre", token=token)
 
 @app.post("/catalogo-habitaciones")
 async def crear_habitacion(data: HabitacionCreate, authorization: str = Header(None)):
@@ -476,7 +1345,7 @@ async def eliminar_habitacion(id: str, authorization: str = Header(None)):
 @app.get("/catalogo-colores")
 async def listar_colores(authorization: str = Header(None)):
     token = await verify_token(authorization)
-    return await supabase_request("GET", "catalogo_colores?select=*&activo=eq.true&order=orden", token=token)
+    return await consulta_catalogo("catalogo_colores?select=*&activo=eq.true&order=orden", token=token)
 
 @app.post("/catalogo-colores")
 async def crear_color(data: ColorEtiquetaCreate, authorization: str = Header(None)):
@@ -496,17 +1365,241 @@ async def eliminar_color(id: str, authorization: str = Header(None)):
     await supabase_request("PATCH", f"catalogo_colores?id=eq.{id}", {"activo": False}, token=token)
     return {"message": "Color desactivado"}
 
+# ============================================
+# MINIATURAS DE FOTOS (COLUMNAS OPCIONALES)
+# foto_perro_miniaturas y foto_cartilla_miniaturas solo existen si se corrió su DDL
+# (bloque "TABLAS NUEVAS"). La primera consulta que falla por ellas lo deja anotado y
+# a partir de ahí se quitan de los selects y de las escrituras.
+# ============================================
+
+# None: aún no se sabe; True: las columnas existen; False: no existen
+_columnas_miniaturas: Optional[bool] = None
+
+def _falta_columna_miniaturas(e: HTTPException) -> bool:
+    detalle = str(e.detail)
+    return e.status_code == 400 and "_miniaturas" in detalle and any(c in detalle for c in ("42703", "PGRST204"))
+
+def sin_miniaturas(select: str) -> str:
+    """`select` sin foto_perro_miniaturas si la columna no existe."""
+    return select.replace(",foto_perro_miniaturas", "") if _columnas_miniaturas is False else select
+
+async def con_miniaturas_opcionales(consulta):
+    """Ejecuta `consulta()` (que arma su select con sin_miniaturas()); si falla porque faltan
+    las columnas de miniaturas lo anota y la repite sin ellas."""
+    global _columnas_miniaturas
+    incluidas = _columnas_miniaturas is not False
+    try:
+        resultado = await consulta()
+    except HTTPException as e:
+        if not incluidas or not _falta_columna_miniaturas(e):
+            raise
+        _columnas_miniaturas = False
+        logger.warning("Supabase sin columnas foto_*_miniaturas; se omiten de selects y escrituras")
+        return await consulta()
+    if incluidas:
+        _columnas_miniaturas = True
+    return resultado
+
 # ============================================
 # ENDPOINTS: ESTANCIAS (CHECK-IN)
 # ============================================
 
+EMBEBIDOS_ESTANCIAS = {"perros": "perros(id,nombre,foto_perro_url,foto_perro_miniaturas,propietarios(nombre,telefono))"}
+
 @app.get("/estancias")
-async def listar_estancias(estado: Optional[str] = None, authorization: str = Header(None)):
+async def listar_estancias(
+    estado: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    authorization: str = Header(None)
+):
     token = await verify_token(authorization)
-    endpoint = "estancias?select=*,perros(id,nombre,foto_perro_url,propietarios(nombre,telefono))&order=fecha_entrada.desc"
-    if estado:
-        endpoint += f"&estado=eq.{estado}"
-    return await supabase_request("GET", endpoint, token=token)
+    filtros = f"&estado=eq.{estado}" if estado else ""
+
+    async def consulta():
+        perros = sin_miniaturas(EMBEBIDOS_ESTANCIAS["perros"])
+        select = select_con_campos(fields, "*," + perros, {"perros": perros}, ["id", "fecha_entrada"])
+        if limit:
+            return await listar_con_cursor("estancias", select, filtros, "fecha_entrada", limit, cursor, token)
+        return await supabase_request("GET", f"estancias?select={select}&order=fecha_entrada.desc{filtros}",
+                                      token=token)
+
+    return await con_miniaturas_opcionales(consulta)
+
+# Los índices en memoria (ocupación, vacunas, búsqueda) son de todo el proceso: se
+# cargan siempre con la llave de servicio (SUPABASE_KEY), nunca con el token del
+# usuario que pidió primero, para que su contenido no dependa de quién llegó antes.
+# Cada endpoint que los consulta sigue exigiendo un token válido con verify_token.
+indice_ocupacion = IndiceOcupacion()
+_carga_ocupacion = asyncio.Lock()
+
+async def asegurar_indice_ocupacion():
+    """Carga (o recarga tras OCUPACION_REFRESCO) las estancias que ocupan habitación."""
+    if indice_ocupacion.vigente(OCUPACION_REFRESCO):
+        return
+    async with _carga_ocupacion:
+        if indice_ocupacion.vigente(OCUPACION_REFRESCO):
+            return
+        indice_ocupacion.iniciar_carga()
+        try:
+            filas = await supabase_request("GET",
+                "estancias?estado=not.in.(Completada,Cancelada)&select=id,perro_id,habitacion,fecha_entrada,fecha_salida,estado")
+        except BaseException:
+            indice_ocupacion.cancelar_carga()
+            raise
+        indice_ocupacion.cargar(filas or [])
+
+async def capacidades_habitaciones(token: str) -> dict:
+    habitaciones = await consulta_catalogo("catalogo_habitaciones?select=*&activo=eq.true&order=nombre", token=token)
+    return {h["nombre"]: h.get("capacidad") or 1 for h in (habitaciones or [])}
+
+def _rango_fechas(fecha_entrada: str, fecha_salida: str) -> tuple:
+    desde, hasta = parse_fecha(fecha_entrada), parse_fecha(fecha_salida)
+    if not desde or not hasta or hasta <= desde:
+        raise HTTPException(status_code=400, detail="Rango de fechas inválido (fecha_salida debe ser posterior a fecha_entrada)")
+    return desde, hasta
+
+@app.get("/estancias/disponibilidad")
+async def verificar_disponibilidad(
+    fecha_entrada: str,
+    fecha_salida: str,
+    habitacion: Optional[str] = None,
+    authorization: str = Header(None)
+):
+    """Pico de ocupación por noche en [fecha_entrada, fecha_salida). Sin `habitacion`, todas las habitaciones."""
+    token = await verify_token(authorization)
+    desde, hasta = _rango_fechas(fecha_entrada, fecha_salida)
+    _, capacidades = await asyncio.gather(asegurar_indice_ocupacion(), capacidades_habitaciones(token))
+
+    if habitacion:
+        capacidad = capacidades.get(habitacion, 1)
+        resultado = indice_ocupacion.disponibilidad({habitacion: capacidad}, desde, hasta)[0]
+        resultado["estancias_actuales"] = indice_ocupacion.solapadas(habitacion, desde, hasta)
+        return resultado
+
+    habitaciones = indice_ocupacion.disponibilidad(capacidades, desde, hasta)
+    return {
+        "fecha_entrada": fecha_entrada,
+        "fecha_salida": fecha_salida,
+        "habitaciones": habitaciones,
+        "libres": [h["habitacion"] for h in habitaciones if h["disponible"]],
+    }
+
+@app.get("/estancias/ocupacion")
+async def matriz_ocupacion(desde: Optional[str] = None, dias: int = 60, authorization: str = Header(None)):
+    """Perros por noche y habitación para `dias` días (por omisión los próximos 60)."""
+    token = await verify_token(authorization)
+    inicio = parse_fecha(desde) or date.today()
+    dias = max(1, min(dias, 366))
+    _, capacidades = await asyncio.gather(asegurar_indice_ocupacion(), capacidades_habitaciones(token))
+    filas = indice_ocupacion.matriz(inicio, dias, list(capacidades))
+    for fila in filas:
+        fila["capacidad"] = capacidades[fila["habitacion"]]
+    return {
+        "desde": inicio.isoformat(),
+        "dias": dias,
+        "fechas": [(inicio + timedelta(days=i)).isoformat() for i in range(dias)],
+        "habitaciones": filas,
+    }
+
+# Tablas de las que depende /calendario: una escritura en cualquiera cambia la llave de caché
+TABLAS_CALENDARIO = ("estancias", "perros", "catalogo_habitaciones")
+calendario_cache = CacheTTL(CALENDARIO_CACHE_TTL, 64)
+
+def _miniatura(perro: dict, tam: int = 160) -> Optional[str]:
+    """Misma elección que fotoMiniatura() del frontend: la menor miniatura >= tam."""
+    miniaturas = perro.get("foto_perro_miniaturas") or {}
+    tamanos = sorted(int(t) for t in miniaturas)
+    if tamanos:
+        return miniaturas[str(next((t for t in tamanos if t >= tam), tamanos[-1]))]
+    return perro.get("foto_perro_url")
+
+async def armar_calendario(inicio: date, dias: int, token: str) -> dict:
+    """Estancias no completadas que tocan [inicio, inicio + dias), con carril y cortes
+    por habitación ya calculados, en columnas (una lista por campo)."""
+    d0, d1 = inicio.isoformat(), (inicio + timedelta(days=dias - 1)).isoformat()
+    filas, capacidades = await asyncio.gather(
+        con_miniaturas_opcionales(lambda: supabase_request("GET", sin_miniaturas(
+            "estancias?select=id,perro_id,habitacion,fecha_entrada,fecha_salida,color_etiqueta,"
+            "perros(nombre,foto_perro_url,foto_perro_miniaturas)"
+            f"&estado=neq.Completada&fecha_entrada=lte.{d1}"
+            f"&or=(fecha_salida.gte.{d0},and(fecha_salida.is.null,fecha_entrada.gte.{d0}))"),
+            token=token)),
+        capacidades_habitaciones(token),
+    )
+    habitaciones = sorted(capacidades, key=orden_natural)
+    tramos_por_habitacion: dict = {h: [] for h in habitaciones}
+    for fila in filas or []:
+        tramos = tramos_por_habitacion.get(fila.get("habitacion"))
+        entrada = parse_fecha(fila.get("fecha_entrada"))
+        if tramos is None or entrada is None:
+            continue
+        salida = max(parse_fecha(fila.get("fecha_salida")) or entrada, entrada)
+        # El día de salida se pinta (inclusivo), igual que antes en el frontend
+        tramos.append({"id": fila["id"], "fila": fila,
+                       "inicio": (entrada - inicio).days, "fin": (salida - inicio).days})
+
+    estancias = {c: [] for c in ("id", "perro", "habitacion", "inicio", "fin", "carril", "cortes",
+                                 "color", "fecha_entrada", "fecha_salida")}
+    perros = {"id": [], "nombre": [], "foto": []}
+    indice_perro: dict = {}
+    carriles = []
+    for h, habitacion in enumerate(habitaciones):
+        tramos = tramos_por_habitacion[habitacion]
+        carriles.append(max(1, asignar_carriles(tramos)))
+        for tramo in sorted(tramos, key=lambda t: (t["carril"], t["inicio"])):
+            fila = tramo["fila"]
+            perro_id = fila.get("perro_id")
+            if perro_id not in indice_perro:
+                perro = fila.get("perros") or {}
+                indice_perro[perro_id] = len(perros["id"])
+                perros["id"].append(perro_id)
+                perros["nombre"].append(perro.get("nombre"))
+                perros["foto"].append(_miniatura(perro))
+            estancias["id"].append(fila["id"])
+            estancias["perro"].append(indice_perro[perro_id])
+            estancias["habitacion"].append(h)
+            estancias["inicio"].append(max(0, tramo["inicio"]))
+            estancias["fin"].append(min(dias - 1, tramo["fin"]))
+            estancias["carril"].append(tramo["carril"])
+            # Bits: 1 = corte diagonal al entrar, 2 = al salir (día de cambio compartido)
+            estancias["cortes"].append(int(tramo["corte_inicio"]) | 2 * int(tramo["corte_fin"]))
+            estancias["color"].append(fila.get("color_etiqueta"))
+            estancias["fecha_entrada"].append(str(fila.get("fecha_entrada") or "")[:10])
+            estancias["fecha_salida"].append(str(fila.get("fecha_salida") or "")[:10] or None)
+
+    return {
+        "desde": d0,
+        "dias": dias,
+        "habitaciones": {"nombre": habitaciones, "capacidad": [capacidades[h] for h in habitaciones],
+                         "carriles": carriles},
+        "estancias": estancias,
+        "perros": perros,
+    }
+
+@app.get("/calendario")
+async def calendario(
+    desde: Optional[str] = None,
+    dias: int = 60,
+    authorization: str = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    """Ventana del calendario de ocupación lista para pintar. Cada ventana es una petición
+    chica con ETag: navegar entre meses revalida con 304 si nada cambió."""
+    token = await verify_token(authorization)
+    inicio = parse_fecha(desde) or date.today()
+    dias = max(1, min(dias, 366))
+    llave = ("calendario", inicio.isoformat(), dias, alcance_token(token),
+             tuple(catalogo_cache.generacion(t) for t in TABLAS_CALENDARIO))
+    cuerpo = calendario_cache.obtener(llave)
+    if cuerpo is _FALTA:
+        generacion = calendario_cache.generacion("calendario")
+        cuerpo = json.dumps(await armar_calendario(inicio, dias, token), default=str,
+                            ensure_ascii=False, separators=(",", ":")).encode()
+        calendario_cache.guardar(llave, cuerpo, generacion)
+    # max-age=0: el navegador guarda la respuesta pero revalida (304) en cada navegación
+    return respuesta_con_etag(cuerpo, if_none_match, 0)
 
 @app.get("/estancias/{id}")
 async def obtener_estancia(id: str, authorization: str = Header(None)):
@@ -520,55 +1613,80 @@ async def obtener_estancia(id: str, authorization: str = Header(None)):
 async def crear_estancia(data: EstanciaCreate, authorization: str = Header(None)):
     token = await verify_token(authorization)
     result = await supabase_request("POST", "estancias", data.model_dump(exclude_none=True), token=token)
+    if result:
+        indice_ocupacion.registrar(result[0])
+        centro_eventos.publicar("estancia", "creada", {"estancia": result[0]})
     return result[0] if result else None
 
 @app.put("/estancias/{id}")
 async def actualizar_estancia(id: str, data: EstanciaCreate, authorization: str = Header(None)):
     token = await verify_token(authorization)
     result = await supabase_request("PATCH", f"estancias?id=eq.{id}", data.model_dump(exclude_none=True), token=token)
+    if result:
+        indice_ocupacion.registrar(result[0])
+        centro_eventos.publicar("estancia", "actualizada", {"estancia": result[0]})
     return result[0] if result else None
 
 @app.put("/estancias/{id}/completar")
 async def completar_estancia(id: str, authorization: str = Header(None)):
     token = await verify_token(authorization)
     result = await supabase_request("PATCH", f"estancias?id=eq.{id}", {"estado": "Completada"}, token=token)
+    if result:
+        indice_ocupacion.registrar(result[0])
+        centro_eventos.publicar("estancia", "completada", {"estancia": result[0]})
     return result[0] if result else None
 
 @app.patch("/estancias/{id}/color")
 async def actualizar_color_estancia(id: str, data: EstanciaColorUpdate, authorization: str = Header(None)):
     token = await verify_token(authorization)
     result = await supabase_request("PATCH", f"estancias?id=eq.{id}", {"color_etiqueta": data.color_etiqueta}, token=token)
+    if result:
+        centro_eventos.publicar("estancia", "color", {"estancia": result[0]})
     return result[0] if result else None
 
 @app.delete("/estancias/{id}")
 async def eliminar_estancia(id: str, authorization: str = Header(None)):
     token = await verify_token(authorization)
     await supabase_request("DELETE", f"estancias?id=eq.{id}", token=token)
+    indice_ocupacion.quitar(id)
+    centro_eventos.publicar("estancia", "eliminada", {"id": id})
     return {"message": "Estancia eliminada"}
 
 # ============================================
 # ENDPOINTS: PASEOS
 # ============================================
 
+EMBEBIDOS_PASEOS = {
+    "perros": "perros(id,nombre,propietarios(nombre,telefono))",
+    "catalogo_paseos": "catalogo_paseos(nombre)",
+}
+
 @app.get("/paseos")
 async def listar_paseos(
     perro_id: Optional[str] = None,
     fecha_inicio: Optional[str] = None,
     fecha_fin: Optional[str] = None,
     pagado: Optional[bool] = None,
+    fields: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
     authorization: str = Header(None)
 ):
     token = await verify_token(authorization)
-    endpoint = "paseos?select=*,perros(id,nombre,propietarios(nombre,telefono)),catalogo_paseos(nombre)&order=fecha.desc"
+    select = select_con_campos(fields, "*," + ",".join(EMBEBIDOS_PASEOS.values()), EMBEBIDOS_PASEOS,
+                               ["id", "fecha"])
+    filtros = ""
     if perro_id:
-        endpoint += f"&perro_id=eq.{perro_id}"
+        filtros += f"&perro_id=eq.{perro_id}"
     if fecha_inicio:
-        endpoint += f"&fecha=gte.{fecha_inicio}"
+        filtros += f"&fecha=gte.{fecha_inicio}"
     if fecha_fin:
-        endpoint += f"&fecha=lte.{fecha_fin}"
+        filtros += f"&fecha=lte.{fecha_fin}"
     if pagado is not None:
-        endpoint += f"&pagado=eq.{str(pagado).lower()}"
-    return await supabase_request("GET", endpoint, token=token)
+        filtros += f"&pagado=eq.{str(pagado).lower()}"
+    if limit:
+        return await listar_con_cursor("paseos", select, filtros, "fecha", limit, cursor, token)
+    return await supabase_request("GET", f"paseos?select={select}&order=fecha.desc{filtros}", token=token)
 
 @app.get("/paseos/pendientes")
 async def listar_paseos_pendientes(authorization: str = Header(None)):
@@ -580,61 +1698,150 @@ async def listar_paseos_pendientes(authorization: str = Header(None)):
 async def crear_paseo(data: PaseoCreate, authorization: str = Header(None)):
     token = await verify_token(authorization)
     result = await supabase_request("POST", "paseos", data.model_dump(exclude_none=True), token=token)
+    if result:
+        centro_eventos.publicar("paseo", "creado", {"paseo": result[0]})
     return result[0] if result else None
 
 @app.put("/paseos/{id}")
 async def actualizar_paseo(id: str, data: PaseoCreate, authorization: str = Header(None)):
     token = await verify_token(authorization)
     result = await supabase_request("PATCH", f"paseos?id=eq.{id}", data.model_dump(exclude_none=True), token=token)
+    if result:
+        centro_eventos.publicar("paseo", "actualizado", {"paseo": result[0]})
     return result[0] if result else None
 
 @app.put("/paseos/{id}/pagar")
 async def marcar_paseo_pagado(id: str, authorization: str = Header(None)):
     token = await verify_token(authorization)
     result = await supabase_request("PATCH", f"paseos?id=eq.{id}", {"pagado": True}, token=token)
+    if result:
+        centro_eventos.publicar("paseo", "actualizado", {"paseo": result[0]})
     return result[0] if result else None
 
 @app.delete("/paseos/{id}")
 async def eliminar_paseo(id: str, authorization: str = Header(None)):
     token = await verify_token(authorization)
     await supabase_request("DELETE", f"paseos?id=eq.{id}", token=token)
+    centro_eventos.publicar("paseo", "eliminado", {"id": id})
     return {"message": "Paseo eliminado"}
 
 @app.post("/paseos/enviar-caja")
 async def enviar_paseos_a_caja(paseos_ids: List[str], authorization: str = Header(None)):
     token = await verify_token(authorization)
-    # Obtener paseos
-    ids_str = ",".join([f'"{id}"' for id in paseos_ids])
-    paseos = await supabase_request("GET", f"paseos?id=in.({ids_str})&select=*,perros(id,nombre)", token=token)
-    
-    # Crear cargos por cada paseo
-    for paseo in paseos:
-        cargo = {
-            "perro_id": paseo["perro_id"],
-            "fecha_cargo": datetime.now().strftime("%Y-%m-%d"),
-            "fecha_servicio": paseo["fecha"],
-            "concepto": paseo["tipo_paseo"],
-            "monto": paseo["precio"]
-        }
-        await supabase_request("POST", "cargos", cargo, token=token)
-        # Marcar paseo como enviado a caja
-        await supabase_request("PATCH", f"paseos?id=eq.{paseo['id']}", {"enviado_caja": True}, token=token)
-    
-    return {"message": f"{len(paseos)} paseos enviados a caja"}
+    resultado = await enviar_a_caja(paseos_ids, [], token)
+    return {"message": f"{resultado['paseos']} paseos enviados a caja"}
+
+# ============================================
+# ENDPOINTS: ENVÍO A CAJA (PASEOS Y GROOMING)
+# ============================================
+
+async def _apartar_para_caja(tabla: str, ids: List[str], token: str) -> tuple:
+    """PATCH condicional enviado_caja=true por lote. Regresa (filas apartadas, primer error):
+    los lotes que sí se aplicaron cuentan aunque otro falle, para poder liberarlos."""
+    if not ids:
+        return [], None
+    partes = await asyncio.gather(*(
+        supabase_request("PATCH", f"{tabla}?id={filtro_in(lote)}&enviado_caja=not.is.true&select=*",
+                         {"enviado_caja": True}, token=token)
+        for lote in lotes(ids)
+    ), return_exceptions=True)
+    filas = [fila for parte in partes if not isinstance(parte, BaseException) for fila in (parte or [])]
+    return filas, next((parte for parte in partes if isinstance(parte, BaseException)), None)
+
+async def _liberar_de_caja(paseos: list, citas: list, token: str):
+    """Regresa a enviado_caja=false las filas apartadas por este llamado (best effort)."""
+    resultados = await asyncio.gather(
+        actualizar_por_ids("paseos", [p["id"] for p in paseos], {"enviado_caja": False}, token)
+        if paseos else asyncio.sleep(0),
+        actualizar_por_ids("grooming_citas", [c["id"] for c in citas], {"enviado_caja": False}, token)
+        if citas else asyncio.sleep(0),
+        return_exceptions=True,
+    )
+    for r in resultados:
+        if isinstance(r, BaseException):
+            logger.error("No se pudieron liberar filas apartadas para caja: %s", r)
+
+async def enviar_a_caja(paseos_ids: List[str], grooming_ids: List[str], token: str) -> dict:
+    """Convierte paseos y citas de grooming en cargos con un número fijo de round trips.
+    Primero se apartan las filas con un PATCH condicional (enviado_caja=not.is.true): solo
+    las que este llamado marcó generan cargos, así que un reintento o dos envíos simultáneos
+    no cobran dos veces. Si algún apartado o el POST de cargos falla, las filas apartadas
+    se liberan antes de propagar el error."""
+    (paseos, error_paseos), (citas, error_citas) = await asyncio.gather(
+        _apartar_para_caja("paseos", paseos_ids, token),
+        _apartar_para_caja("grooming_citas", grooming_ids, token),
+    )
+    if error_paseos or error_citas:
+        await _liberar_de_caja(paseos, citas, token)
+        raise error_paseos or error_citas
+    hoy = datetime.now().strftime("%Y-%m-%d")
+    cargos = [{
+        "perro_id": p["perro_id"],
+        "fecha_cargo": hoy,
+        "fecha_servicio": p["fecha"],
+        "concepto": p["tipo_paseo"],
+        "monto": p["precio"],
+    } for p in paseos] + [{
+        "perro_id": c["perro_id"],
+        "fecha_cargo": hoy,
+        "fecha_servicio": c["fecha"],
+        "concepto": f"Grooming: {c['tipo_grooming']}",
+        "monto": c["precio"],
+    } for c in citas]
+    if not cargos:
+        return {"paseos": 0, "grooming": 0, "cargos": []}
+
+    try:
+        creados = await supabase_request("POST", "cargos", cargos, token=token) or []
+    except Exception:
+        # Sin cargos no hay envío: se liberan las filas apartadas para poder reintentar
+        await _liberar_de_caja(paseos, citas, token)
+        raise
+    if citas:
+        # Los cargos ya existen: si el estado no se actualiza, el envío sigue siendo válido
+        try:
+            await actualizar_por_ids("grooming_citas", [c["id"] for c in citas], {"estado": "Completado"}, token)
+        except HTTPException as e:
+            logger.error("Citas enviadas a caja sin marcar como Completado: %s", e.detail)
+    if creados:
+        centro_eventos.publicar("cargo", "creados", {"cargos": creados})
+    return {"paseos": len(paseos), "grooming": len(citas), "cargos": creados}
+
+@app.post("/caja/enviar")
+async def enviar_lote_a_caja(data: EnvioCajaLote, authorization: str = Header(None)):
+    token = await verify_token(authorization)
+    resultado = await enviar_a_caja(data.paseos_ids, data.grooming_ids, token)
+    return {
+        "message": f"{resultado['paseos']} paseos y {resultado['grooming']} citas de grooming enviados a caja",
+        **resultado,
+    }
 
 # ============================================
 # ENDPOINTS: CARGOS
 # ============================================
 
+EMBEBIDOS_CARGOS = {"perros": "perros(id,nombre,propietarios(id,nombre,telefono))"}
+
 @app.get("/cargos")
-async def listar_cargos(perro_id: Optional[str] = None, pagado: Optional[bool] = None, authorization: str = Header(None)):
+async def listar_cargos(
+    perro_id: Optional[str] = None,
+    pagado: Optional[bool] = None,
+    fields: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    authorization: str = Header(None)
+):
     token = await verify_token(authorization)
-    endpoint = "cargos?select=*,perros(id,nombre,propietarios(id,nombre,telefono))&order=created_at.desc"
+    select = select_con_campos(fields, "*," + EMBEBIDOS_CARGOS["perros"], EMBEBIDOS_CARGOS,
+                               ["id", "fecha_cargo"])
+    filtros = ""
     if perro_id:
-        endpoint += f"&perro_id=eq.{perro_id}"
+        filtros += f"&perro_id=eq.{perro_id}"
     if pagado is not None:
-        endpoint += f"&pagado=eq.{str(pagado).lower()}"
-    return await supabase_request("GET", endpoint, token=token)
+        filtros += f"&pagado=eq.{str(pagado).lower()}"
+    if limit:
+        return await listar_con_cursor("cargos", select, filtros, "fecha_cargo", limit, cursor, token)
+    return await supabase_request("GET", f"cargos?select={select}&order=created_at.desc{filtros}", token=token)
 
 @app.get("/cargos/pendientes/{perro_id}")
 async def listar_cargos_pendientes(perro_id: str, authorization: str = Header(None)):
@@ -649,31 +1856,46 @@ async def crear_cargo(data: CargoCreate, authorization: str = Header(None)):
     if "fecha_cargo" not in cargo_data or not cargo_data["fecha_cargo"]:
         cargo_data["fecha_cargo"] = datetime.now().strftime("%Y-%m-%d")
     result = await supabase_request("POST", "cargos", cargo_data, token=token)
+    if result:
+        centro_eventos.publicar("cargo", "creados", {"cargos": result})
     return result[0] if result else None
 
 @app.put("/cargos/{id}")
 async def actualizar_cargo(id: str, data: CargoCreate, authorization: str = Header(None)):
     token = await verify_token(authorization)
     result = await supabase_request("PATCH", f"cargos?id=eq.{id}", data.model_dump(exclude_none=True), token=token)
+    if result:
+        centro_eventos.publicar("cargo", "actualizados", {"cargos": result})
     return result[0] if result else None
 
 @app.delete("/cargos/{id}")
 async def eliminar_cargo(id: str, authorization: str = Header(None)):
     token = await verify_token(authorization)
     await supabase_request("DELETE", f"cargos?id=eq.{id}", token=token)
+    centro_eventos.publicar("cargo", "eliminados", {"ids": [id]})
     return {"message": "Cargo eliminado"}
 
 # ============================================
 # ENDPOINTS: TICKETS
 # ============================================
 
+EMBEBIDOS_TICKETS = {"perros": "perros(nombre)", "propietarios": "propietarios(nombre,telefono)"}
+
 @app.get("/tickets")
-async def listar_tickets(perro_id: Optional[str] = None, authorization: str = Header(None)):
+async def listar_tickets(
+    perro_id: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    authorization: str = Header(None)
+):
     token = await verify_token(authorization)
-    endpoint = "tickets?select=*,perros(nombre),propietarios(nombre,telefono)&order=created_at.desc"
-    if perro_id:
-        endpoint += f"&perro_id=eq.{perro_id}"
-    return await supabase_request("GET", endpoint, token=token)
+    select = select_con_campos(fields, "*," + ",".join(EMBEBIDOS_TICKETS.values()), EMBEBIDOS_TICKETS,
+                               ["id", "fecha"])
+    filtros = f"&perro_id=eq.{perro_id}" if perro_id else ""
+    if limit:
+        return await listar_con_cursor("tickets", select, filtros, "fecha", limit, cursor, token)
+    return await supabase_request("GET", f"tickets?select={select}&order=created_at.desc{filtros}", token=token)
 
 @app.get("/tickets/{id}")
 async def obtener_ticket(id: str, authorization: str = Header(None)):
@@ -683,21 +1905,48 @@ async def obtener_ticket(id: str, authorization: str = Header(None)):
         raise HTTPException(status_code=404, detail="No encontrado")
     return result[0]
 
+def publicar_ticket(ticket: dict, cargos_ids: List[str]):
+    """Evento compacto: datos del ticket y los cargos que quedaron pagados."""
+    resumen = {k: ticket.get(k) for k in ("id", "perro_id", "propietario_id", "total", "metodo_pago", "fecha")}
+    centro_eventos.publicar("ticket", "emitido", {"ticket": resumen, "cargos_ids": cargos_ids})
+
 @app.post("/tickets")
 async def crear_ticket(data: TicketCreate, authorization: str = Header(None)):
     token = await verify_token(authorization)
     ticket_data = data.model_dump(exclude_none=True)
     ticket_data["fecha"] = datetime.now().strftime("%Y-%m-%d")
-    
-    # Crear ticket
+    cargos_ids = list(dict.fromkeys(data.cargos_ids))
+    ticket_data["cargos_ids"] = cargos_ids
+
+    # Ruta atómica: ticket + cargos en una sola transacción del lado de la base
+    resultado = await supabase_rpc("crear_ticket_checkout",
+                                   {"p_ticket": ticket_data, "p_cargos_ids": cargos_ids}, token=token,
+                                   tablas=("tickets", "cargos"))
+    if resultado is not _FALTA:
+        publicar_ticket(resultado, cargos_ids)
+        return resultado
+
+    # Ruta alterna (sin la función SQL): 2 round trips sin importar cuántos cargos, con compensación
     result = await supabase_request("POST", "tickets", ticket_data, token=token)
     ticket = result[0] if result else None
-    
-    if ticket:
-        # Marcar cargos como pagados
-        for cargo_id in data.cargos_ids:
-            await supabase_request("PATCH", f"cargos?id=eq.{cargo_id}", {"pagado": True, "ticket_id": ticket["id"]}, token=token)
-    
+    if not ticket:
+        return None
+    cargos = []
+    if cargos_ids:
+        try:
+            cargos = await supabase_request("PATCH",
+                f"cargos?id={filtro_in(cargos_ids)}&pagado=eq.false",
+                {"pagado": True, "ticket_id": ticket["id"]}, token=token) or []
+        except HTTPException:
+            await supabase_request("DELETE", f"tickets?id=eq.{ticket['id']}", token=token)
+            raise
+        if len(cargos) != len(cargos_ids):
+            await supabase_request("PATCH", f"cargos?ticket_id=eq.{ticket['id']}",
+                                   {"pagado": False, "ticket_id": None}, token=token)
+            await supabase_request("DELETE", f"tickets?id=eq.{ticket['id']}", token=token)
+            raise HTTPException(status_code=409, detail="Algunos cargos ya estaban pagados o no existen")
+    ticket["cargos"] = cargos
+    publicar_ticket(ticket, cargos_ids)
     return ticket
 
 # ============================================
@@ -717,10 +1966,24 @@ async def crear_ticket(data: TicketCreate, authorization: str = Header(None)):
 #    - Target roles: authenticated
 #    - Policy definition: true
 
-@app.post("/upload/foto-perro/{perro_id}")
-async def upload_foto_perro(perro_id: str, file: UploadFile = File(...), authorization: str = Header(None)):
-    token = await verify_token(authorization)
+# Re-codificación WebP y miniaturas fuera del event loop
+pool_imagenes = ThreadPoolExecutor(max_workers=IMAGENES_WORKERS, thread_name_prefix="imagenes")
 
+async def subir_a_storage(ruta: str, contenido, tipo: str, largo: Optional[int] = None):
+    headers = {
+        "apikey": SUPABASE_KEY,
+        "Authorization": f"Bearer {SUPABASE_KEY}",
+        "Content-Type": tipo,
+        "x-upsert": "true",  # Sobrescribir si existe
+        "Cache-Control": "max-age=31536000",  # Cada subida usa un nombre nuevo
+    }
+    if largo is not None:
+        headers["Content-Length"] = str(largo)
+    return await http_client.post(f"{SUPABASE_URL}/storage/v1/object/fotos/{ruta}", headers=headers, content=contenido)
+
+async def subir_foto(perro_id: str, file: UploadFile, carpeta: str, etiqueta: str) -> dict:
+    """Procesa la foto en el pool (WebP + miniaturas) y sube todas las variantes en paralelo.
+    Sin Pillow sube el archivo original en bloques. Regresa {"url", "miniaturas"}."""
     # Validar tipo de archivo
     if file.content_type not in ALLOWED_IMAGE_TYPES:
         raise HTTPException(
@@ -728,92 +1991,66 @@ async def upload_foto_perro(perro_id: str, file: UploadFile = File(...), authori
             detail=f"Tipo de archivo no permitido: '{file.content_type}'. Solo se aceptan imágenes JPEG, PNG y WebP."
         )
 
-    # Leer archivo
-    contents = await file.read()
-
-    # Nombre único - usar extensión del archivo original
-    extension = file.filename.split('.')[-1].lower() if '.' in file.filename else 'jpg'
-    filename = f"perros/{perro_id}_{int(datetime.now().timestamp())}.{extension}"
-
-    # Subir a Supabase Storage
-    storage_url = f"{SUPABASE_URL}/storage/v1/object/fotos/{filename}"
+    base = f"{carpeta}/{perro_id}_{int(datetime.now().timestamp())}"
+    try:
+        variantes = await asyncio.get_running_loop().run_in_executor(
+            pool_imagenes, procesar_imagen, file.file, FOTO_LADO_MAX, FOTO_MINIATURAS)
+    except ImagenInvalida:
+        raise HTTPException(status_code=400, detail="El archivo no es una imagen válida")
+
+    if variantes is None:
+        # Nombre único - usar extensión del archivo original
+        extension = file.filename.split('.')[-1].lower() if file.filename and '.' in file.filename else 'jpg'
+        rutas = {"original": f"{base}.{extension}"}
+        respuestas = [await subir_a_storage(rutas["original"], leer_en_bloques(file),
+                                            file.content_type or "image/jpeg", file.size)]
+    else:
+        rutas = {nombre: f"{base}.webp" if nombre == "original" else f"{base}_{nombre}.webp" for nombre in variantes}
+        respuestas = await asyncio.gather(*(subir_a_storage(rutas[nombre], datos, "image/webp")
+                                            for nombre, datos in variantes.items()))
+
+    for response in respuestas:
+        if response.status_code >= 400:
+            error_detail = response.text
+            logger.error("Error subiendo %s perro %s: %s - %s", etiqueta, perro_id, response.status_code, error_detail)
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Error subiendo {etiqueta}: {error_detail}. Verifica que el bucket 'fotos' exista y tenga políticas correctas."
+            )
 
-    response = await http_client.post(
-        storage_url,
-        headers={
-            "apikey": SUPABASE_KEY,
-            "Authorization": f"Bearer {SUPABASE_KEY}",
-            "Content-Type": file.content_type or "image/jpeg",
-            "x-upsert": "true"  # Sobrescribir si existe
-        },
-        content=contents,
-    )
+    urls = {nombre: f"{SUPABASE_URL}/storage/v1/object/public/fotos/{ruta}" for nombre, ruta in rutas.items()}
+    return {"url": urls.pop("original"), "miniaturas": urls}
 
-    if response.status_code >= 400:
-        error_detail = response.text
-        logger.error("Error subiendo foto perro %s: %s - %s", perro_id, response.status_code, error_detail)
-        raise HTTPException(
-            status_code=response.status_code,
-            detail=f"Error subiendo foto: {error_detail}. Verifica que el bucket 'fotos' exista y tenga políticas correctas."
-        )
-
-    foto_url = f"{SUPABASE_URL}/storage/v1/object/public/fotos/{filename}"
+async def guardar_foto(perro_id: str, campo: str, foto: dict, token: str):
+    """Guarda la URL en perros.<campo>_url y, si hay miniaturas y su columna existe, en
+    <campo>_miniaturas. Sin miniaturas se limpia la columna solo si ya se sabe que existe
+    (para no dejar las de una foto anterior)."""
+    async def actualizar():
+        datos = {f"{campo}_url": foto["url"]}
+        if foto["miniaturas"] and _columnas_miniaturas is not False:
+            datos[f"{campo}_miniaturas"] = foto["miniaturas"]
+        elif _columnas_miniaturas:
+            datos[f"{campo}_miniaturas"] = None
+        return await supabase_request("PATCH", f"perros?id=eq.{perro_id}", datos, token=token)
 
-    try:
-        await supabase_request(
-            "PATCH",
-            f"perros?id=eq.{perro_id}",
-            {"foto_perro_url": foto_url},
-            token=token
-        )
-        logger.info("Foto de perro subida para perro %s", perro_id)
-    except Exception as e:
-        logger.error("Error actualizando foto_url del perro %s: %s", perro_id, e)
+    return await con_miniaturas_opcionales(actualizar)
 
-    return {"url": foto_url, "message": "Foto subida correctamente"}
+@app.post("/upload/foto-perro/{perro_id}")
+async def upload_foto_perro(perro_id: str, file: UploadFile = File(...), authorization: str = Header(None)):
+    token = await verify_token(authorization)
+    foto = await subir_foto(perro_id, file, "perros", "foto")
+    await guardar_foto(perro_id, "foto_perro", foto, token)
+    logger.info("Foto de perro subida para perro %s", perro_id)
+    return {**foto, "message": "Foto subida correctamente"}
 
 @app.post("/upload/foto-cartilla/{perro_id}")
 async def upload_foto_cartilla(perro_id: str, file: UploadFile = File(...), authorization: str = Header(None)):
     token = await verify_token(authorization)
-
-    # Validar tipo de archivo
-    if file.content_type not in ALLOWED_IMAGE_TYPES:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Tipo de archivo no permitido: '{file.content_type}'. Solo se aceptan imágenes JPEG, PNG y WebP."
-        )
-
-    contents = await file.read()
-
-    extension = file.filename.split('.')[-1].lower() if '.' in file.filename else 'jpg'
-    filename = f"cartillas/{perro_id}_{int(datetime.now().timestamp())}.{extension}"
-
-    storage_url = f"{SUPABASE_URL}/storage/v1/object/fotos/{filename}"
-
-    response = await http_client.post(
-        storage_url,
-        headers={
-            "apikey": SUPABASE_KEY,
-            "Authorization": f"Bearer {SUPABASE_KEY}",
-            "Content-Type": file.content_type or "image/jpeg",
-            "x-upsert": "true"
-        },
-        content=contents,
-    )
-
-    if response.status_code >= 400:
-        error_detail = response.text
-        logger.error("Error subiendo cartilla perro %s: %s - %s", perro_id, response.status_code, error_detail)
-        raise HTTPException(
-            status_code=response.status_code,
-            detail=f"Error subiendo cartilla: {error_detail}. Verifica que el bucket 'fotos' exista y tenga políticas correctas."
-        )
-
-    foto_url = f"{SUPABASE_URL}/storage/v1/object/public/fotos/{filename}"
-    await supabase_request("PATCH", f"perros?id=eq.{perro_id}", {"foto_cartilla_url": foto_url}, token=SUPABASE_KEY)
+    foto = await subir_foto(perro_id, file, "cartillas", "cartilla")
+    await guardar_foto(perro_id, "foto_cartilla", foto, SUPABASE_KEY)
 
     logger.info("Cartilla subida para perro %s", perro_id)
-    return {"url": foto_url, "message": "Cartilla subida correctamente"}
+    return {**foto, "message": "Cartilla subida correctamente"}
 
 # ============================================
 # ENDPOINTS: DIAGNÓSTICO STORAGE
@@ -870,22 +2107,31 @@ async def resumen(authorization: str = Header(None)):
 
     primer_dia = datetime.now().replace(day=1).strftime("%Y-%m-%d")
 
-    # Lanzar las 5 queries en paralelo en lugar de secuencial
-    propietarios, perros, estancias_activas, cargos_pendientes, tickets_mes = await asyncio.gather(
-        supabase_request("GET", "propietarios?activo=eq.true&select=id", token=token),
-        supabase_request("GET", "perros?activo=eq.true&select=id", token=token),
-        supabase_request("GET", "estancias?estado=eq.Activa&select=id", token=token),
-        supabase_request("GET", "cargos?pagado=eq.false&select=monto", token=token),
-        supabase_request("GET", f"tickets?fecha=gte.{primer_dia}&select=total", token=token),
+    # Conteos con HEAD (count=exact) y sumas en SQL: no se descargan filas
+    propietarios, perros, estancias_activas, cargos_pendientes, montos = await asyncio.gather(
+        contar_filas("propietarios?activo=eq.true", token=token),
+        contar_filas("perros?activo=eq.true", token=token),
+        contar_filas("estancias?estado=eq.Activa", token=token),
+        contar_filas("cargos?pagado=eq.false", token=token),
+        supabase_rpc("resumen_montos", {"p_desde": primer_dia}, token=token),
     )
+    if montos is _FALTA:
+        pendientes, tickets_mes = await asyncio.gather(
+            supabase_request("GET", "cargos?pagado=eq.false&select=monto", token=token),
+            supabase_request("GET", f"tickets?fecha=gte.{primer_dia}&select=total", token=token),
+        )
+        montos = {
+            "monto_pendiente": sum(float(c["monto"]) for c in pendientes) if pendientes else 0,
+            "ingresos_mes": sum(float(t["total"]) for t in tickets_mes) if tickets_mes else 0,
+        }
 
     return {
-        "total_propietarios": len(propietarios) if propietarios else 0,
-        "total_perros": len(perros) if perros else 0,
-        "estancias_activas": len(estancias_activas) if estancias_activas else 0,
-        "cargos_pendientes": len(cargos_pendientes) if cargos_pendientes else 0,
-        "monto_pendiente": sum(float(c["monto"]) for c in cargos_pendientes) if cargos_pendientes else 0,
-        "ingresos_mes": sum(float(t["total"]) for t in tickets_mes) if tickets_mes else 0
+        "total_propietarios": propietarios,
+        "total_perros": perros,
+        "estancias_activas": estancias_activas,
+        "cargos_pendientes": cargos_pendientes,
+        "monto_pendiente": montos["monto_pendiente"] or 0,
+        "ingresos_mes": montos["ingresos_mes"] or 0,
     }
 
 # ============================================================
@@ -946,6 +2192,273 @@ async def resumen(authorization: str = Header(None)):
 #
 # ALTER TABLE cargos ADD COLUMN IF NOT EXISTS descuento DECIMAL(10,2) DEFAULT 0;
 # ALTER TABLE cargos ADD COLUMN IF NOT EXISTS descuento_motivo VARCHAR(200);
+#
+# -- Control de concurrencia optimista del stock (ruta sin la función registrar_movimientos_inventario)
+# ALTER TABLE inventario_items ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 0;
+#
+# -- URLs de las miniaturas WebP por tamaño: {"160": "https://...", "480": "https://..."}
+# ALTER TABLE perros ADD COLUMN IF NOT EXISTS foto_perro_miniaturas JSONB;
+# ALTER TABLE perros ADD COLUMN IF NOT EXISTS foto_cartilla_miniaturas JSONB;
+#
+# -- Sync por deltas (GET /sync): updated_at en cada cambio y lápidas de las filas borradas
+# ALTER TABLE propietarios ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+# ALTER TABLE perros ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+# ALTER TABLE estancias ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+# CREATE INDEX IF NOT EXISTS ix_propietarios_updated_at ON propietarios (updated_at);
+# CREATE INDEX IF NOT EXISTS ix_perros_updated_at ON perros (updated_at);
+# CREATE INDEX IF NOT EXISTS ix_estancias_updated_at ON estancias (updated_at);
+#
+# CREATE TABLE sync_eliminaciones (
+#   tabla VARCHAR(50) NOT NULL, fila_id UUID NOT NULL,
+#   eliminado_en TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp());
+# CREATE INDEX ix_sync_eliminaciones_eliminado_en ON sync_eliminaciones (eliminado_en);
+#
+# CREATE OR REPLACE FUNCTION tocar_updated_at() RETURNS TRIGGER LANGUAGE plpgsql AS $$
+# BEGIN NEW.updated_at := clock_timestamp(); RETURN NEW; END $$;
+#
+# CREATE OR REPLACE FUNCTION registrar_eliminacion() RETURNS TRIGGER LANGUAGE plpgsql AS $$
+# BEGIN INSERT INTO sync_eliminaciones (tabla, fila_id) VALUES (TG_TABLE_NAME, OLD.id); RETURN OLD; END $$;
+#
+# CREATE TRIGGER tr_updated_at BEFORE UPDATE ON propietarios FOR EACH ROW EXECUTE FUNCTION tocar_updated_at();
+# CREATE TRIGGER tr_updated_at BEFORE UPDATE ON perros FOR EACH ROW EXECUTE FUNCTION tocar_updated_at();
+# CREATE TRIGGER tr_updated_at BEFORE UPDATE ON estancias FOR EACH ROW EXECUTE FUNCTION tocar_updated_at();
+# CREATE TRIGGER tr_sync_eliminacion AFTER DELETE ON propietarios FOR EACH ROW EXECUTE FUNCTION registrar_eliminacion();
+# CREATE TRIGGER tr_sync_eliminacion AFTER DELETE ON perros FOR EACH ROW EXECUTE FUNCTION registrar_eliminacion();
+# CREATE TRIGGER tr_sync_eliminacion AFTER DELETE ON estancias FOR EACH ROW EXECUTE FUNCTION registrar_eliminacion();
+#
+# -- Limpieza periódica (pg_cron): las lápidas solo hacen falta dentro de SYNC_RETENCION_DIAS
+# DELETE FROM sync_eliminaciones WHERE eliminado_en < NOW() - INTERVAL '30 days';
+#
+# -- Índices para la paginación por cursor (fecha, id)
+# CREATE INDEX IF NOT EXISTS ix_estancias_fecha_id ON estancias (fecha_entrada DESC, id DESC);
+# CREATE INDEX IF NOT EXISTS ix_paseos_fecha_id ON paseos (fecha DESC, id DESC);
+# CREATE INDEX IF NOT EXISTS ix_cargos_fecha_id ON cargos (fecha_cargo DESC, id DESC);
+# CREATE INDEX IF NOT EXISTS ix_tickets_fecha_id ON tickets (fecha DESC, id DESC);
+# ============================================================
+
+# ============================================================
+# FUNCIONES RPC — opcionales; sin ellas la API usa una ruta alterna
+# ------------------------------------------------------------
+# -- Borrado permanente de perros (y opcionalmente su propietario) en una transacción
+# CREATE OR REPLACE FUNCTION eliminar_perros_cascada(p_perros_ids UUID[], p_propietario_id UUID DEFAULT NULL)
+# RETURNS JSONB LANGUAGE plpgsql AS $$
+# DECLARE r JSONB := '{}'::jsonb; t TEXT; n INT; t0 TIMESTAMPTZ;
+# BEGIN
+#   t0 := clock_timestamp();
+#   DELETE FROM notas_estancia WHERE estancia_id IN (SELECT id FROM estancias WHERE perro_id = ANY(p_perros_ids));
+#   GET DIAGNOSTICS n = ROW_COUNT;
+#   r := r || jsonb_build_object('notas_estancia', jsonb_build_object('filas', n,
+#        'ms', extract(epoch FROM clock_timestamp() - t0) * 1000));
+#   FOREACH t IN ARRAY ARRAY['paseos','grooming_citas','alimentacion_registro','medicamentos_log',
+#                            'cargos','estancias'] LOOP
+#     t0 := clock_timestamp();
+#     EXECUTE format('DELETE FROM %I WHERE perro_id = ANY($1)', t) USING p_perros_ids;
+#     GET DIAGNOSTICS n = ROW_COUNT;
+#     r := r || jsonb_build_object(t, jsonb_build_object('filas', n,
+#          'ms', extract(epoch FROM clock_timestamp() - t0) * 1000));
+#   END LOOP;
+#   -- Los tickets se conservan (comprobantes y contabilidad), solo se desvinculan
+#   UPDATE tickets SET perro_id = NULL WHERE perro_id = ANY(p_perros_ids);
+#   GET DIAGNOSTICS n = ROW_COUNT;
+#   r := r || jsonb_build_object('tickets', jsonb_build_object('filas', n, 'ms', 0));
+#   DELETE FROM perros WHERE id = ANY(p_perros_ids) OR propietario_id = p_propietario_id;
+#   GET DIAGNOSTICS n = ROW_COUNT;
+#   r := r || jsonb_build_object('perros', jsonb_build_object('filas', n, 'ms', 0));
+#   IF p_propietario_id IS NOT NULL THEN
+#     UPDATE tickets SET propietario_id = NULL WHERE propietario_id = p_propietario_id;
+#     DELETE FROM propietarios WHERE id = p_propietario_id;
+#     GET DIAGNOSTICS n = ROW_COUNT;
+#     r := r || jsonb_build_object('propietarios', jsonb_build_object('filas', n, 'ms', 0));
+#   END IF;
+#   RETURN jsonb_build_object('tablas', r);
+# END $$;
+#
+# -- Checkout atómico: crea el ticket y marca sus cargos en una transacción
+# CREATE OR REPLACE FUNCTION crear_ticket_checkout(p_ticket JSONB, p_cargos_ids UUID[])
+# RETURNS JSONB LANGUAGE plpgsql AS $$
+# DECLARE t tickets; n INT;
+# BEGIN
+#   INSERT INTO tickets (perro_id, propietario_id, cargos_ids, subtotal, total, metodo_pago, notas, fecha)
+#   VALUES ((p_ticket->>'perro_id')::uuid, (p_ticket->>'propietario_id')::uuid, p_cargos_ids,
+#           (p_ticket->>'subtotal')::numeric, (p_ticket->>'total')::numeric,
+#           COALESCE(p_ticket->>'metodo_pago', 'Efectivo'), p_ticket->>'notas', (p_ticket->>'fecha')::date)
+#   RETURNING * INTO t;
+#   UPDATE cargos SET pagado = TRUE, ticket_id = t.id
+#    WHERE id = ANY(p_cargos_ids) AND pagado = FALSE;
+#   GET DIAGNOSTICS n = ROW_COUNT;
+#   IF n <> COALESCE(cardinality(p_cargos_ids), 0) THEN
+#     RAISE EXCEPTION 'Cargos ya pagados o inexistentes' USING ERRCODE = 'PT409';
+#   END IF;
+#   RETURN to_jsonb(t) || jsonb_build_object('cargos',
+#     COALESCE((SELECT jsonb_agg(c) FROM cargos c WHERE c.ticket_id = t.id), '[]'::jsonb));
+# END $$;
+#
+# -- Movimientos de inventario: stock actualizado con un UPDATE atómico por movimiento
+# CREATE OR REPLACE FUNCTION registrar_movimientos_inventario(p_movimientos JSONB)
+# RETURNS JSONB LANGUAGE plpgsql AS $$
+# DECLARE m JSONB; n INT;
+# BEGIN
+#   -- Bloquea los ítems en orden de id para que dos lotes concurrentes no se interbloqueen
+#   PERFORM 1 FROM inventario_items
+#    WHERE id IN (SELECT (x->>'item_id')::uuid FROM jsonb_array_elements(p_movimientos) x)
+#    ORDER BY id FOR UPDATE;
+#   FOR m IN SELECT * FROM jsonb_array_elements(p_movimientos) LOOP
+#     UPDATE inventario_items
+#        SET stock_actual = GREATEST(0, stock_actual + (m->>'cantidad')::numeric
+#                              * CASE WHEN m->>'tipo' = 'entrada' THEN 1 ELSE -1 END),
+#            version = version + 1
+#      WHERE id = (m->>'item_id')::uuid;
+#     GET DIAGNOSTICS n = ROW_COUNT;
+#     IF n = 0 THEN
+#       RAISE EXCEPTION 'Ítem % no existe', m->>'item_id' USING ERRCODE = 'PT404';
+#     END IF;
+#   END LOOP;
+#   INSERT INTO inventario_movimientos (item_id, tipo, cantidad, motivo)
+#   SELECT (x->>'item_id')::uuid, x->>'tipo', (x->>'cantidad')::numeric, x->>'motivo'
+#     FROM jsonb_array_elements(p_movimientos) x;
+#   RETURN jsonb_build_object('registrados', jsonb_array_length(p_movimientos), 'items',
+#     (SELECT COALESCE(jsonb_agg(jsonb_build_object('id', i.id, 'stock_actual', i.stock_actual)), '[]'::jsonb)
+#        FROM inventario_items i
+#       WHERE i.id IN (SELECT (x->>'item_id')::uuid FROM jsonb_array_elements(p_movimientos) x)));
+# END $$;
+#
+# -- Agregaciones de reportes (sin ellas se suman las filas en Python)
+# CREATE OR REPLACE FUNCTION resumen_montos(p_desde DATE)
+# RETURNS JSONB LANGUAGE sql STABLE AS $$
+#   SELECT jsonb_build_object(
+#     'monto_pendiente', (SELECT COALESCE(round(sum(monto), 2), 0) FROM cargos WHERE NOT pagado),
+#     'ingresos_mes', (SELECT COALESCE(round(sum(total), 2), 0) FROM tickets WHERE fecha >= p_desde));
+# $$;
+#
+# CREATE OR REPLACE FUNCTION reporte_ingresos(p_desde DATE, p_hasta DATE)
+# RETURNS JSONB LANGUAGE sql STABLE AS $$
+#   WITH t AS (SELECT fecha, COALESCE(metodo_pago, 'Otro') AS metodo, total
+#                FROM tickets WHERE fecha BETWEEN p_desde AND p_hasta)
+#   SELECT jsonb_build_object(
+#     'total', (SELECT COALESCE(round(sum(total), 2), 0) FROM t),
+#     'num_tickets', (SELECT count(*) FROM t),
+#     'por_dia', COALESCE((SELECT jsonb_agg(d ORDER BY d.fecha) FROM
+#        (SELECT fecha::text AS fecha, round(sum(total), 2) AS total FROM t GROUP BY fecha) d), '[]'),
+#     'por_metodo', COALESCE((SELECT jsonb_agg(m ORDER BY m.total DESC) FROM
+#        (SELECT metodo, round(sum(total), 2) AS total FROM t GROUP BY metodo) m), '[]'));
+# $$;
+#
+# CREATE OR REPLACE FUNCTION reporte_cargos_concepto(p_desde DATE, p_hasta DATE)
+# RETURNS TABLE (concepto TEXT, total NUMERIC, pagado NUMERIC, pendiente NUMERIC)
+# LANGUAGE sql STABLE AS $$
+#   SELECT COALESCE(c.concepto, 'Otro'), round(sum(c.monto), 2),
+#          COALESCE(round(sum(c.monto) FILTER (WHERE c.pagado), 2), 0),
+#          COALESCE(round(sum(c.monto) FILTER (WHERE NOT c.pagado), 2), 0)
+#     FROM cargos c WHERE c.fecha_cargo BETWEEN p_desde AND p_hasta
+#    GROUP BY 1 ORDER BY 2 DESC;
+# $$;
+#
+# CREATE OR REPLACE FUNCTION reporte_ocupacion(p_desde DATE, p_hasta DATE)
+# RETURNS TABLE (habitacion TEXT, estancias BIGINT) LANGUAGE sql STABLE AS $$
+#   SELECT COALESCE(NULLIF(e.habitacion, ''), 'Sin asignar'), count(*)
+#     FROM estancias e WHERE e.fecha_entrada <= p_hasta AND e.fecha_salida >= p_desde
+#    GROUP BY 1 ORDER BY 2 DESC;
+# $$;
+#
+# CREATE OR REPLACE FUNCTION reporte_clientes_frecuentes(p_limite INT DEFAULT 20)
+# RETURNS TABLE (perro_id UUID, nombre TEXT, propietario TEXT, telefono TEXT, visitas BIGINT)
+# LANGUAGE sql STABLE AS $$
+#   SELECT p.id, p.nombre, COALESCE(o.nombre, ''), COALESCE(o.telefono, ''), count(*) AS visitas
+#     FROM estancias e JOIN perros p ON p.id = e.perro_id
+#     LEFT JOIN propietarios o ON o.id = p.propietario_id
+#    GROUP BY p.id, o.id ORDER BY visitas DESC, max(e.created_at) DESC LIMIT p_limite;
+# $$;
+#
+# -- Resúmenes diarios (rollups) mantenidos por triggers; los reportes por rango leen
+# -- unas cuantas filas por día en lugar de recorrer tickets, cargos y estancias.
+# CREATE TABLE rollup_ingresos_dia (fecha DATE, metodo_pago TEXT, total NUMERIC DEFAULT 0,
+#   tickets INT DEFAULT 0, PRIMARY KEY (fecha, metodo_pago));
+# CREATE TABLE rollup_cargos_dia (fecha DATE, concepto TEXT, total NUMERIC DEFAULT 0,
+#   pagado NUMERIC DEFAULT 0, pendiente NUMERIC DEFAULT 0, PRIMARY KEY (fecha, concepto));
+# CREATE TABLE rollup_ocupacion_dia (fecha DATE, habitacion TEXT, noches INT DEFAULT 0,
+#   PRIMARY KEY (fecha, habitacion));
+#
+# CREATE OR REPLACE FUNCTION rollup_tickets() RETURNS TRIGGER LANGUAGE plpgsql AS $$
+# BEGIN
+#   IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.fecha IS NOT NULL THEN
+#     INSERT INTO rollup_ingresos_dia VALUES (OLD.fecha, COALESCE(OLD.metodo_pago, 'Otro'), -COALESCE(OLD.total, 0), -1)
+#     ON CONFLICT (fecha, metodo_pago) DO UPDATE SET total = rollup_ingresos_dia.total + EXCLUDED.total,
+#                                                    tickets = rollup_ingresos_dia.tickets + EXCLUDED.tickets;
+#   END IF;
+#   IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.fecha IS NOT NULL THEN
+#     INSERT INTO rollup_ingresos_dia VALUES (NEW.fecha, COALESCE(NEW.metodo_pago, 'Otro'), COALESCE(NEW.total, 0), 1)
+#     ON CONFLICT (fecha, metodo_pago) DO UPDATE SET total = rollup_ingresos_dia.total + EXCLUDED.total,
+#                                                    tickets = rollup_ingresos_dia.tickets + EXCLUDED.tickets;
+#   END IF;
+#   RETURN NULL;
+# END $$;
+# CREATE TRIGGER tr_rollup_tickets AFTER INSERT OR DELETE OR UPDATE OF fecha, metodo_pago, total ON tickets
+#   FOR EACH ROW EXECUTE FUNCTION rollup_tickets();
+#
+# CREATE OR REPLACE FUNCTION rollup_cargos() RETURNS TRIGGER LANGUAGE plpgsql AS $$
+# DECLARE r cargos; s INT;
+# BEGIN
+#   FOREACH s IN ARRAY ARRAY[-1, 1] LOOP
+#     IF (s = -1 AND TG_OP = 'INSERT') OR (s = 1 AND TG_OP = 'DELETE') THEN CONTINUE; END IF;
+#     r := CASE WHEN s = -1 THEN OLD ELSE NEW END;
+#     CONTINUE WHEN r.fecha_cargo IS NULL;
+#     INSERT INTO rollup_cargos_dia VALUES (r.fecha_cargo, COALESCE(r.concepto, 'Otro'), s * COALESCE(r.monto, 0),
+#       s * CASE WHEN r.pagado THEN COALESCE(r.monto, 0) ELSE 0 END,
+#       s * CASE WHEN r.pagado THEN 0 ELSE COALESCE(r.monto, 0) END)
+#     ON CONFLICT (fecha, concepto) DO UPDATE SET total = rollup_cargos_dia.total + EXCLUDED.total,
+#       pagado = rollup_cargos_dia.pagado + EXCLUDED.pagado, pendiente = rollup_cargos_dia.pendiente + EXCLUDED.pendiente;
+#   END LOOP;
+#   RETURN NULL;
+# END $$;
+# CREATE TRIGGER tr_rollup_cargos AFTER INSERT OR DELETE OR UPDATE OF fecha_cargo, concepto, monto, pagado ON cargos
+#   FOR EACH ROW EXECUTE FUNCTION rollup_cargos();
+#
+# -- Cada estancia no cancelada aporta una noche por día de [fecha_entrada, fecha_salida) (mínimo una)
+# CREATE OR REPLACE FUNCTION rollup_estancias() RETURNS TRIGGER LANGUAGE plpgsql AS $$
+# DECLARE r estancias; s INT;
+# BEGIN
+#   FOREACH s IN ARRAY ARRAY[-1, 1] LOOP
+#     IF (s = -1 AND TG_OP = 'INSERT') OR (s = 1 AND TG_OP = 'DELETE') THEN CONTINUE; END IF;
+#     r := CASE WHEN s = -1 THEN OLD ELSE NEW END;
+#     CONTINUE WHEN r.fecha_entrada IS NULL OR COALESCE(r.estado, '') = 'Cancelada';
+#     INSERT INTO rollup_ocupacion_dia
+#     SELECT d::date, COALESCE(NULLIF(r.habitacion, ''), 'Sin asignar'), s
+#       FROM generate_series(r.fecha_entrada,
+#              GREATEST(COALESCE(r.fecha_salida, r.fecha_entrada + 1), r.fecha_entrada + 1) - 1, '1 day') d
+#     ON CONFLICT (fecha, habitacion) DO UPDATE SET noches = rollup_ocupacion_dia.noches + EXCLUDED.noches;
+#   END LOOP;
+#   RETURN NULL;
+# END $$;
+# CREATE TRIGGER tr_rollup_estancias AFTER INSERT OR DELETE
+#   OR UPDATE OF fecha_entrada, fecha_salida, habitacion, estado ON estancias
+#   FOR EACH ROW EXECUTE FUNCTION rollup_estancias();
+#
+# -- Reconstrucción de un rango (carga inicial): POST /reportes/rollups/refrescar
+# CREATE OR REPLACE FUNCTION refrescar_rollups(p_desde DATE, p_hasta DATE)
+# RETURNS JSONB LANGUAGE plpgsql AS $$
+# BEGIN
+#   DELETE FROM rollup_ingresos_dia WHERE fecha BETWEEN p_desde AND p_hasta;
+#   DELETE FROM rollup_cargos_dia WHERE fecha BETWEEN p_desde AND p_hasta;
+#   DELETE FROM rollup_ocupacion_dia WHERE fecha BETWEEN p_desde AND p_hasta;
+#   INSERT INTO rollup_ingresos_dia
+#   SELECT fecha, COALESCE(metodo_pago, 'Otro'), sum(COALESCE(total, 0)), count(*)
+#     FROM tickets WHERE fecha BETWEEN p_desde AND p_hasta GROUP BY 1, 2;
+#   INSERT INTO rollup_cargos_dia
+#   SELECT fecha_cargo, COALESCE(concepto, 'Otro'), sum(COALESCE(monto, 0)),
+#          COALESCE(sum(monto) FILTER (WHERE pagado), 0), COALESCE(sum(monto) FILTER (WHERE NOT pagado), 0)
+#     FROM cargos WHERE fecha_cargo BETWEEN p_desde AND p_hasta GROUP BY 1, 2;
+#   INSERT INTO rollup_ocupacion_dia
+#   SELECT d::date, COALESCE(NULLIF(e.habitacion, ''), 'Sin asignar'), count(*)
+#     FROM estancias e, generate_series(e.fecha_entrada,
+#            GREATEST(COALESCE(e.fecha_salida, e.fecha_entrada + 1), e.fecha_entrada + 1) - 1, '1 day') d
+#    WHERE COALESCE(e.estado, '') <> 'Cancelada' AND e.fecha_entrada <= p_hasta
+#      AND d::date BETWEEN p_desde AND p_hasta
+#    GROUP BY 1, 2;
+#   RETURN jsonb_build_object('tablas', jsonb_build_object(
+#     'rollup_ingresos_dia', (SELECT count(*) FROM rollup_ingresos_dia WHERE fecha BETWEEN p_desde AND p_hasta),
+#     'rollup_cargos_dia', (SELECT count(*) FROM rollup_cargos_dia WHERE fecha BETWEEN p_desde AND p_hasta),
+#     'rollup_ocupacion_dia', (SELECT count(*) FROM rollup_ocupacion_dia WHERE fecha BETWEEN p_desde AND p_hasta)));
+# END $$;
 # ============================================================
 
 # ============================================
@@ -1009,85 +2522,389 @@ class InventarioMovimientoCreate(BaseModel):
     cantidad: float
     motivo: Optional[str] = None
 
+class InventarioMovimientosLote(BaseModel):
+    movimientos: List[InventarioMovimientoCreate]
+
 # ============================================
 # ENDPOINTS: DASHBOARD OPERATIVO
 # ============================================
 
-@app.get("/dashboard/resumen-dia")
-async def dashboard_resumen_dia(authorization: str = Header(None)):
-    token = await verify_token(authorization)
-    hoy = datetime.now().strftime("%Y-%m-%d")
+indice_vacunas = IndiceVacunas()
+_carga_vacunas = asyncio.Lock()
+
+async def _cargar_indice_vacunas():
+    """Foto completa con la llave de servicio (ver indice_ocupacion)."""
+    indice_vacunas.iniciar_carga()
+    try:
+        filas = await supabase_request("GET", f"perros?activo=eq.true&select={SELECT_PERROS}")
+    except BaseException:
+        indice_vacunas.cancelar_carga()
+        raise
+    indice_vacunas.cargar(filas or [])
+
+async def asegurar_indice_vacunas():
+    """Carga el índice si aún no existe o si el refresco en segundo plano dejó de correr."""
+    if indice_vacunas.vigente(2 * VACUNAS_REFRESCO):
+        return
+    async with _carga_vacunas:
+        if indice_vacunas.vigente(2 * VACUNAS_REFRESCO):
+            return
+        await _cargar_indice_vacunas()
+
+async def refrescar_vacunas_periodicamente():
+    """Recarga completa cada VACUNAS_REFRESCO segundos (cambios hechos por otros procesos);
+    los cambios de este proceso se aplican al momento con registrar/quitar."""
+    while True:
+        try:
+            async with _carga_vacunas:
+                await _cargar_indice_vacunas()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("No se pudo recargar el índice de vacunas: %s", e)
+        await asyncio.sleep(VACUNAS_REFRESCO)
+
+def respuesta_con_etag(cuerpo: bytes, if_none_match: Optional[str], max_age: float = 0) -> Response:
+    """JSON ya serializado con ETag; 304 sin cuerpo si el cliente ya tiene esa versión."""
+    etag = calcular_etag(cuerpo)
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={int(max_age)}"}
+    if coincide_etag(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cuerpo, media_type="application/json", headers=headers)
+
+# Tablas de las que depende el dashboard: una escritura en cualquiera cambia la llave de caché
+TABLAS_DASHBOARD = ("estancias", "paseos", "cargos", "perros", "propietarios")
+dashboard_cache = CacheTTL(DASHBOARD_CACHE_TTL, 64)
+
+async def armar_dashboard(hoy: str, token: str) -> dict:
     fecha_alerta = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d")
 
-    estancias_activas, checkouts_hoy, paseos_hoy, cargos_pend = await asyncio.gather(
-        supabase_request("GET",
-            "estancias?estado=eq.Activa&select=*,perros(id,nombre,foto_perro_url,propietarios(nombre,telefono))",
-            token=token),
-        supabase_request("GET",
-            f"estancias?estado=eq.Activa&fecha_salida=lte.{hoy}&select=*,perros(id,nombre,propietarios(nombre,telefono))",
-            token=token),
+    # Todo en un solo gather: las salidas del día salen de las estancias activas y las
+    # alertas de vacunas del índice precalculado
+    estancias_activas, paseos_hoy, cargos_pend, _ = await asyncio.gather(
+        con_miniaturas_opcionales(lambda: supabase_request("GET", sin_miniaturas(
+            "estancias?estado=eq.Activa&select=*,perros(id,nombre,foto_perro_url,foto_perro_miniaturas,propietarios(nombre,telefono))"),
+            token=token)),
         supabase_request("GET",
             f"paseos?fecha=eq.{hoy}&select=*,perros(id,nombre,propietarios(nombre,telefono))",
             token=token),
         supabase_request("GET",
-            "cargos?pagado=eq.false&select=monto,perro_id,concepto,perros(nombre)",
+            "cargos?pagado=eq.false&select=id,monto,perro_id,concepto,perros(nombre)",
             token=token),
+        asegurar_indice_vacunas(),
     )
-
-    # Alertas de vacunas (vencidas o vencen en 30 días)
-    vacunas_alertas = await supabase_request("GET",
-        f"perros?activo=eq.true&or=(vacuna_rabia_vence.lte.{fecha_alerta},vacuna_sextuple_vence.lte.{fecha_alerta},vacuna_bordetella_vence.lte.{fecha_alerta})&select=id,nombre,propietarios(nombre,telefono),vacuna_rabia_vence,vacuna_sextuple_vence,vacuna_bordetella_vence,vacuna_giardia_vence",
-        token=token)
+    estancias_activas = estancias_activas or []
+    checkouts_hoy = [e for e in estancias_activas if e.get("fecha_salida") and str(e["fecha_salida"])[:10] <= hoy]
 
     return {
         "fecha": hoy,
-        "estancias_activas": estancias_activas or [],
-        "checkouts_pendientes": checkouts_hoy or [],
+        "estancias_activas": estancias_activas,
+        "checkouts_pendientes": checkouts_hoy,
         "paseos_hoy": paseos_hoy or [],
         "cargos_pendientes": cargos_pend or [],
         "monto_pendiente": sum(float(c.get("monto", 0)) for c in (cargos_pend or [])),
-        "vacunas_alertas": vacunas_alertas or [],
+        "vacunas_alertas": indice_vacunas.proximas(fecha_alerta),
     }
 
+@app.get("/dashboard/resumen-dia")
+async def dashboard_resumen_dia(
+    authorization: str = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    token = await verify_token(authorization)
+    hoy = datetime.now().strftime("%Y-%m-%d")
+    llave = ("dashboard", hoy, alcance_token(token),
+             tuple(catalogo_cache.generacion(t) for t in TABLAS_DASHBOARD))
+    cuerpo = dashboard_cache.obtener(llave)
+    if cuerpo is _FALTA:
+        generacion = dashboard_cache.generacion("dashboard")
+        cuerpo = json.dumps(await armar_dashboard(hoy, token), default=str, ensure_ascii=False).encode()
+        dashboard_cache.guardar(llave, cuerpo, generacion)
+    return respuesta_con_etag(cuerpo, if_none_match, DASHBOARD_CACHE_TTL)
+
+# ============================================
+# SYNC POR DELTAS
+# ============================================
+# El frontend guarda propietarios, perros y estancias en IndexedDB y en cada
+# arranque pide solo lo que cambió desde su watermark: filas con updated_at
+# posterior (altas, ediciones y bajas lógicas con activo=false) y las lápidas de
+# sync_eliminaciones (borrados permanentes). Las filas van sin embebidos; el
+# cliente arma los joins con su copia local.
+
+TABLAS_SYNC = ["propietarios", "perros", "estancias"]
+
+# True si el proyecto de Supabase no tiene updated_at / sync_eliminaciones: solo foto completa
+_sync_sin_deltas = False
+
+def _parse_watermark(valor: str) -> datetime:
+    try:
+        marca = datetime.fromisoformat(valor.strip().replace(" ", "+").replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since debe ser un timestamp ISO 8601")
+    return marca if marca.tzinfo else marca.replace(tzinfo=timezone.utc)
+
+def _iso_watermark(marca: datetime) -> str:
+    return marca.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+async def leer_todo(endpoint: str, token: str) -> list:
+    return [fila async for fila in leer_por_bloques(endpoint, token)]
+
+async def _sync_deltas(desde: datetime, token: str) -> tuple:
+    """(filas por tabla, ids borrados por tabla, lápidas) con cambios posteriores a `desde`."""
+    marca = quote(_iso_watermark(desde))
+    consultas = [leer_todo(f"{t}?select=*&updated_at=gt.{marca}&order=updated_at.asc", token) for t in TABLAS_SYNC]
+    consultas.append(leer_todo(
+        f"sync_eliminaciones?select=tabla,fila_id,eliminado_en&eliminado_en=gt.{marca}"
+        f"&tabla={filtro_in(TABLAS_SYNC)}&order=eliminado_en.asc", token))
+    *partes, lapidas = await asyncio.gather(*consultas)
+    eliminados: dict = {t: [] for t in TABLAS_SYNC}
+    for lapida in lapidas:
+        eliminados[lapida["tabla"]].append(lapida["fila_id"])
+    return dict(zip(TABLAS_SYNC, partes)), eliminados, lapidas
+
+@app.get("/sync")
+async def sincronizar(since: Optional[str] = None, authorization: str = Header(None)):
+    """Cambios de propietarios, perros y estancias desde `since` (el watermark de la
+    respuesta anterior). Sin `since`, o si es más viejo que la retención de lápidas,
+    regresa la foto completa con `completo: true` y el cliente reemplaza su copia."""
+    global _sync_sin_deltas
+    token = await verify_token(authorization)
+    desde = _parse_watermark(since) if since else None
+    ahora = datetime.now(timezone.utc)
+    completo = (desde is None or _sync_sin_deltas
+                or desde < ahora - timedelta(days=SYNC_RETENCION_DIAS))
+
+    lapidas: list = []
+    if not completo:
+        try:
+            cambios, eliminados, lapidas = await _sync_deltas(desde - timedelta(seconds=SYNC_TRASLAPE), token)
+        except HTTPException as e:
+            detalle = str(e.detail)
+            if e.status_code in (400, 404) and any(c in detalle for c in ("42703", "42P01", "PGRST205")):
+                _sync_sin_deltas = True
+                logger.warning("Supabase sin updated_at/sync_eliminaciones; /sync regresa la foto completa")
+                completo = True
+            else:
+                raise
+    if completo:
+        partes = await asyncio.gather(*(leer_todo(f"{t}?select=*&order=id.asc", token) for t in TABLAS_SYNC))
+        cambios, eliminados = dict(zip(TABLAS_SYNC, partes)), {t: [] for t in TABLAS_SYNC}
+
+    # Nuevo watermark: el timestamp más reciente visto (nunca retrocede respecto a `since`)
+    marcas = [_parse_watermark(f["updated_at"]) for filas in cambios.values() for f in filas if f.get("updated_at")]
+    marcas.extend(_parse_watermark(l["eliminado_en"]) for l in lapidas)
+    if desde is not None and not completo:
+        marcas.append(desde)
+    watermark = _iso_watermark(max(marcas)) if marcas else (since if not completo else None)
+
+    return {
+        "completo": completo,
+        "watermark": watermark,
+        "cambios": cambios,
+        "eliminados": eliminados,
+    }
+
+# ============================================
+# EVENTOS EN VIVO (SSE)
+# ============================================
+# Recepción, grooming y paseos ven los cambios de los demás sin recargar: cada
+# escritura de estancias, paseos, cargos y tickets publica un evento con la fila
+# cambiada y el frontend parcha su estado (calendario y dashboard) en memoria.
+
+@app.get("/eventos")
+async def eventos_en_vivo(
+    authorization: str = Header(None),
+    last_event_id: Optional[str] = Header(None),
+):
+    """Stream text/event-stream. Con Last-Event-ID reenvía lo que se perdió durante la
+    reconexión; si ya no está en el historial manda `resync` para que el cliente recargue."""
+    await verify_token(authorization)
+    return StreamingResponse(
+        centro_eventos.transmitir(last_event_id, EVENTOS_HEARTBEAT),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # ============================================
 # ENDPOINTS: REPORTES MEJORADOS
 # ============================================
 
+# Cada reporte lee primero los resúmenes diarios (rollup_*_dia, mantenidos por
+# triggers: a lo más unas cuantas filas por día del rango). Si no existen pide la
+# agregación a una función SQL, y si tampoco está instalada descarga las filas y
+# las agrega con las funciones agregar_* (ruta alterna).
+
+# Tabla de resumen -> segunda columna de su llave (la primera es fecha)
+ROLLUPS = {
+    "rollup_ingresos_dia": "metodo_pago",
+    "rollup_cargos_dia": "concepto",
+    "rollup_ocupacion_dia": "habitacion",
+}
+
+# Tablas de resumen que no existen en el proyecto de Supabase; se detecta en la primera lectura
+_rollups_faltantes: set = set()
+
+async def leer_rollup(tabla: str, desde: str, hasta: str, token: str):
+    """Filas de un resumen diario para [desde, hasta]. Regresa _FALTA si la tabla no existe."""
+    if tabla in _rollups_faltantes:
+        return _FALTA
+    endpoint = f"{tabla}?fecha=gte.{desde}&fecha=lte.{hasta}&order=fecha.asc,{ROLLUPS[tabla]}.asc"
+    try:
+        # Un año con varios métodos de pago puede pasar el max-rows de PostgREST: se lee por bloques
+        return [fila async for fila in leer_por_bloques(endpoint, token)]
+    except HTTPException as e:
+        if e.status_code == 404 and ("PGRST205" in str(e.detail) or "42P01" in str(e.detail)):
+            _rollups_faltantes.add(tabla)
+            logger.warning("Tabla %s no existe en Supabase; reportes sin resumen diario", tabla)
+            return _FALTA
+        raise
+
+def ingresos_desde_rollup(filas: list) -> dict:
+    por_dia: dict = {}
+    por_metodo: dict = {}
+    num_tickets = 0
+    for f in filas:
+        if not f.get("tickets"):
+            continue
+        total = float(f.get("total") or 0)
+        num_tickets += f["tickets"]
+        por_dia[f["fecha"]] = por_dia.get(f["fecha"], 0) + total
+        por_metodo[f["metodo_pago"]] = por_metodo.get(f["metodo_pago"], 0) + total
+    return {
+        "total": round(sum(por_dia.values()), 2),
+        "num_tickets": num_tickets,
+        "por_dia": [{"fecha": k, "total": round(v, 2)} for k, v in sorted(por_dia.items())],
+        "por_metodo": [{"metodo": k, "total": round(v, 2)}
+                       for k, v in sorted(por_metodo.items(), key=lambda x: -x[1])],
+    }
+
+def cargos_desde_rollup(filas: list) -> list:
+    por_concepto: dict = {}
+    for f in filas:
+        actual = por_concepto.setdefault(f["concepto"], {"concepto": f["concepto"], "total": 0, "pagado": 0, "pendiente": 0})
+        for campo in ("total", "pagado", "pendiente"):
+            actual[campo] += float(f.get(campo) or 0)
+    return sorted(
+        ({**c, **{k: round(c[k], 2) for k in ("total", "pagado", "pendiente")}}
+         for c in por_concepto.values() if any(round(c[k], 2) for k in ("total", "pagado", "pendiente"))),
+        key=lambda x: -x["total"])
+
+def noches_desde_rollup(filas: list) -> dict:
+    noches: dict = {}
+    for f in filas:
+        if f.get("noches"):
+            noches[f["habitacion"]] = noches.get(f["habitacion"], 0) + f["noches"]
+    return noches
+
+async def ingresos_agregados(desde: str, hasta: str, token: str):
+    filas = await leer_rollup("rollup_ingresos_dia", desde, hasta, token)
+    if filas is not _FALTA:
+        return ingresos_desde_rollup(filas)
+    return await supabase_rpc("reporte_ingresos", {"p_desde": desde, "p_hasta": hasta}, token=token)
+
+async def cargos_agregados(desde: str, hasta: str, token: str):
+    filas = await leer_rollup("rollup_cargos_dia", desde, hasta, token)
+    if filas is not _FALTA:
+        return cargos_desde_rollup(filas)
+    return await supabase_rpc("reporte_cargos_concepto", {"p_desde": desde, "p_hasta": hasta}, token=token)
+
+def agregar_ingresos(tickets: list) -> dict:
+    por_dia: dict = {}
+    por_metodo: dict = {}
+    for t in tickets:
+        dia = str(t.get("fecha", ""))[:10]
+        metodo = t.get("metodo_pago", "Otro")
+        por_dia[dia] = round(por_dia.get(dia, 0) + float(t.get("total", 0)), 2)
+        por_metodo[metodo] = round(por_metodo.get(metodo, 0) + float(t.get("total", 0)), 2)
+    return {
+        "total": round(sum(float(t.get("total", 0)) for t in tickets), 2),
+        "num_tickets": len(tickets),
+        "por_dia": [{"fecha": k, "total": v} for k, v in sorted(por_dia.items())],
+        "por_metodo": [{"metodo": k, "total": v} for k, v in sorted(por_metodo.items(), key=lambda x: -x[1])],
+    }
+
+def agregar_cargos_concepto(cargos: list) -> list:
+    por_concepto: dict = {}
+    for c in cargos:
+        key = c.get("concepto", "Otro")
+        if key not in por_concepto:
+            por_concepto[key] = {"concepto": key, "total": 0, "pagado": 0, "pendiente": 0}
+        monto = float(c.get("monto", 0))
+        por_concepto[key]["total"] = round(por_concepto[key]["total"] + monto, 2)
+        if c.get("pagado"):
+            por_concepto[key]["pagado"] = round(por_concepto[key]["pagado"] + monto, 2)
+        else:
+            por_concepto[key]["pendiente"] = round(por_concepto[key]["pendiente"] + monto, 2)
+    return sorted(por_concepto.values(), key=lambda x: -x["total"])
+
+def agregar_ocupacion(estancias: list) -> list:
+    por_habitacion: dict = {}
+    for e in estancias:
+        hab = e.get("habitacion") or "Sin asignar"
+        por_habitacion[hab] = por_habitacion.get(hab, 0) + 1
+    return [{"habitacion": k, "estancias": v} for k, v in sorted(por_habitacion.items(), key=lambda x: -x[1])]
+
+def agregar_clientes_frecuentes(estancias: list, limite: int = 20) -> list:
+    conteo: dict = {}
+    for e in estancias:
+        perro = e.get("perros") or {}
+        pid = perro.get("id", "")
+        if not pid:
+            continue
+        if pid not in conteo:
+            conteo[pid] = {
+                "perro_id": pid,
+                "nombre": perro.get("nombre", ""),
+                "propietario": (perro.get("propietarios") or {}).get("nombre", ""),
+                "telefono": (perro.get("propietarios") or {}).get("telefono", ""),
+                "visitas": 0
+            }
+        conteo[pid]["visitas"] += 1
+    return sorted(conteo.values(), key=lambda x: -x["visitas"])[:limite]
+
 @app.get("/reportes/ingresos")
 async def reporte_ingresos(
     fecha_inicio: Optional[str] = None,
     fecha_fin: Optional[str] = None,
+    formato: Optional[str] = None,
+    incluir_tickets: bool = False,
+    limite_tickets: int = 100,
     authorization: str = Header(None)
 ):
+    """Totales del rango (agregados en la base). Con incluir_tickets=true agrega los
+    `limite_tickets` tickets más recientes (máximo 1000); el listado completo es /exportar/tickets."""
     token = await verify_token(authorization)
     if not fecha_inicio:
         fecha_inicio = datetime.now().replace(day=1).strftime("%Y-%m-%d")
     if not fecha_fin:
         fecha_fin = datetime.now().strftime("%Y-%m-%d")
-
-    tickets = await supabase_request("GET",
-        f"tickets?fecha=gte.{fecha_inicio}&fecha=lte.{fecha_fin}&select=*,perros(nombre),propietarios(nombre)&order=fecha.desc",
-        token=token)
-
-    tickets = tickets or []
-    total = sum(float(t.get("total", 0)) for t in tickets)
-
-    por_dia: dict = {}
-    por_metodo: dict = {}
-    for t in tickets:
-        dia = str(t.get("fecha", ""))[:10]
-        metodo = t.get("metodo_pago", "Otro")
-        por_dia[dia] = round(por_dia.get(dia, 0) + float(t.get("total", 0)), 2)
-        por_metodo[metodo] = round(por_metodo.get(metodo, 0) + float(t.get("total", 0)), 2)
+    if formato:
+        # Exportación para contabilidad: se transmite por bloques en lugar de armar el JSON completo
+        return respuesta_exportacion("tickets", fecha_inicio, fecha_fin, formato, token)
+
+    rango = f"tickets?fecha=gte.{fecha_inicio}&fecha=lte.{fecha_fin}"
+    agregado = ingresos_agregados(fecha_inicio, fecha_fin, token)
+    tickets = []
+    if incluir_tickets:
+        limite = max(1, min(limite_tickets, 1000))
+        agregado, tickets = await asyncio.gather(agregado, supabase_request("GET",
+            f"{rango}&select=*,perros(nombre),propietarios(nombre)&order=fecha.desc,id.desc&limit={limite}",
+            token=token))
+        tickets = tickets or []
+    else:
+        agregado = await agregado
+    if agregado is _FALTA:
+        filas = await leer_todo(f"{rango}&select=fecha,metodo_pago,total&order=fecha.asc,id.asc", token)
+        agregado = agregar_ingresos(filas)
 
     return {
         "fecha_inicio": fecha_inicio,
         "fecha_fin": fecha_fin,
-        "total": round(total, 2),
-        "num_tickets": len(tickets),
+        "total": agregado["total"],
+        "num_tickets": agregado["num_tickets"],
         "tickets": tickets,
-        "por_dia": [{"fecha": k, "total": v} for k, v in sorted(por_dia.items())],
-        "por_metodo": [{"metodo": k, "total": v} for k, v in sorted(por_metodo.items(), key=lambda x: -x[1])],
+        "por_dia": agregado["por_dia"],
+        "por_metodo": agregado["por_metodo"],
     }
 
 @app.get("/reportes/cargos-por-concepto")
@@ -1102,26 +2919,17 @@ async def reporte_cargos_concepto(
     if not fecha_fin:
         fecha_fin = datetime.now().strftime("%Y-%m-%d")
 
-    cargos = await supabase_request("GET",
-        f"cargos?fecha_cargo=gte.{fecha_inicio}&fecha_cargo=lte.{fecha_fin}&select=concepto,monto,pagado",
-        token=token)
-
-    por_concepto: dict = {}
-    for c in (cargos or []):
-        key = c.get("concepto", "Otro")
-        if key not in por_concepto:
-            por_concepto[key] = {"concepto": key, "total": 0, "pagado": 0, "pendiente": 0}
-        monto = float(c.get("monto", 0))
-        por_concepto[key]["total"] = round(por_concepto[key]["total"] + monto, 2)
-        if c.get("pagado"):
-            por_concepto[key]["pagado"] = round(por_concepto[key]["pagado"] + monto, 2)
-        else:
-            por_concepto[key]["pendiente"] = round(por_concepto[key]["pendiente"] + monto, 2)
+    por_concepto = await cargos_agregados(fecha_inicio, fecha_fin, token)
+    if por_concepto is _FALTA:
+        cargos = await supabase_request("GET",
+            f"cargos?fecha_cargo=gte.{fecha_inicio}&fecha_cargo=lte.{fecha_fin}&select=concepto,monto,pagado",
+            token=token)
+        por_concepto = agregar_cargos_concepto(cargos or [])
 
     return {
         "fecha_inicio": fecha_inicio,
         "fecha_fin": fecha_fin,
-        "por_concepto": sorted(por_concepto.values(), key=lambda x: -x["total"]),
+        "por_concepto": por_concepto or [],
     }
 
 @app.get("/reportes/ocupacion")
@@ -1136,52 +2944,185 @@ async def reporte_ocupacion(
     if not fecha_fin:
         fecha_fin = datetime.now().strftime("%Y-%m-%d")
 
-    estancias, habitaciones = await asyncio.gather(
-        supabase_request("GET",
-            f"estancias?fecha_entrada=lte.{fecha_fin}&fecha_salida=gte.{fecha_inicio}&select=habitacion,fecha_entrada,fecha_salida,estado",
-            token=token),
+    por_habitacion, habitaciones, noches = await asyncio.gather(
+        supabase_rpc("reporte_ocupacion", {"p_desde": fecha_inicio, "p_hasta": fecha_fin}, token=token),
         supabase_request("GET", "catalogo_habitaciones?activo=eq.true&select=nombre,capacidad", token=token),
+        leer_rollup("rollup_ocupacion_dia", fecha_inicio, fecha_fin, token),
     )
-
-    por_habitacion: dict = {}
-    for e in (estancias or []):
-        hab = e.get("habitacion") or "Sin asignar"
-        por_habitacion[hab] = por_habitacion.get(hab, 0) + 1
+    if por_habitacion is _FALTA:
+        estancias = await supabase_request("GET",
+            f"estancias?fecha_entrada=lte.{fecha_fin}&fecha_salida=gte.{fecha_inicio}&select=habitacion",
+            token=token)
+        por_habitacion = agregar_ocupacion(estancias or [])
+    por_habitacion = por_habitacion or []
+    if noches is not _FALTA:
+        # Noches-habitación del periodo (solo con los resúmenes diarios instalados)
+        noches = noches_desde_rollup(noches)
+        por_habitacion = [{**h, "noches": noches.get(h["habitacion"], 0)} for h in por_habitacion]
 
     return {
         "fecha_inicio": fecha_inicio,
         "fecha_fin": fecha_fin,
-        "total_estancias": len(estancias or []),
+        "total_estancias": sum(h["estancias"] for h in por_habitacion),
         "habitaciones": habitaciones or [],
-        "por_habitacion": [{"habitacion": k, "estancias": v}
-                           for k, v in sorted(por_habitacion.items(), key=lambda x: -x[1])],
+        "por_habitacion": por_habitacion,
     }
 
+@app.post("/reportes/rollups/refrescar")
+async def refrescar_rollups(
+    fecha_inicio: str,
+    fecha_fin: str,
+    authorization: str = Header(None)
+):
+    """Reconstruye los resúmenes diarios de un rango (carga inicial o corrección manual)."""
+    token = await verify_token(authorization)
+    resultado = await supabase_rpc("refrescar_rollups", {"p_desde": fecha_inicio, "p_hasta": fecha_fin}, token=token,
+                                   tablas=("rollup_ingresos_dia", "rollup_cargos_dia", "rollup_ocupacion_dia"))
+    if resultado is _FALTA:
+        raise HTTPException(status_code=501, detail="La función refrescar_rollups no está instalada en Supabase")
+    _rollups_faltantes.clear()
+    return resultado
+
 @app.get("/reportes/clientes-frecuentes")
 async def reporte_clientes_frecuentes(authorization: str = Header(None)):
     token = await verify_token(authorization)
-    estancias = await supabase_request("GET",
-        "estancias?select=perro_id,perros(id,nombre,propietarios(id,nombre,telefono))&order=created_at.desc",
-        token=token)
+    ranking = await supabase_rpc("reporte_clientes_frecuentes", {"p_limite": 20}, token=token)
+    if ranking is _FALTA:
+        estancias = await supabase_request("GET",
+            "estancias?select=perro_id,perros(id,nombre,propietarios(id,nombre,telefono))&order=created_at.desc",
+            token=token)
+        ranking = agregar_clientes_frecuentes(estancias or [])
+    return {"clientes": ranking or []}
 
-    conteo: dict = {}
-    for e in (estancias or []):
-        perro = e.get("perros") or {}
-        pid = perro.get("id", "")
-        if not pid:
-            continue
-        if pid not in conteo:
-            conteo[pid] = {
-                "perro_id": pid,
-                "nombre": perro.get("nombre", ""),
-                "propietario": (perro.get("propietarios") or {}).get("nombre", ""),
-                "telefono": (perro.get("propietarios") or {}).get("telefono", ""),
-                "visitas": 0
-            }
-        conteo[pid]["visitas"] += 1
+# ============================================
+# ENDPOINTS: EXPORTACIÓN (NDJSON / CSV)
+# ============================================
+# Las filas se leen de PostgREST por bloques con el header Range y se escriben en
+# cuanto llegan: la memoria no depende del rango de fechas exportado.
+EXPORT_BLOQUE = int(os.getenv("EXPORT_BLOQUE", "1000"))
+
+def _perro(f: dict) -> str:
+    return (f.get("perros") or {}).get("nombre", "")
+
+def _propietario(f: dict) -> str:
+    return (f.get("propietarios") or (f.get("perros") or {}).get("propietarios") or {}).get("nombre", "")
+
+# recurso -> (tabla, select, columna de fecha, columnas de salida)
+EXPORTACIONES = {
+    "tickets": ("tickets", "*,perros(nombre),propietarios(nombre)", "fecha", [
+        ("id", lambda f: f.get("id")), ("fecha", lambda f: f.get("fecha")),
+        ("perro", _perro), ("propietario", _propietario),
+        ("subtotal", lambda f: f.get("subtotal")), ("total", lambda f: f.get("total")),
+        ("metodo_pago", lambda f: f.get("metodo_pago")), ("notas", lambda f: f.get("notas")),
+    ]),
+    "cargos": ("cargos", "*,perros(nombre,propietarios(nombre))", "fecha_cargo", [
+        ("id", lambda f: f.get("id")), ("fecha_cargo", lambda f: f.get("fecha_cargo")),
+        ("fecha_servicio", lambda f: f.get("fecha_servicio")),
+        ("perro", _perro), ("propietario", _propietario),
+        ("concepto", lambda f: f.get("concepto")), ("monto", lambda f: f.get("monto")),
+        ("descuento", lambda f: f.get("descuento")), ("pagado", lambda f: f.get("pagado")),
+        ("ticket_id", lambda f: f.get("ticket_id")),
+    ]),
+    "estancias": ("estancias", "*,perros(nombre,propietarios(nombre))", "fecha_entrada", [
+        ("id", lambda f: f.get("id")), ("fecha_entrada", lambda f: f.get("fecha_entrada")),
+        ("fecha_salida", lambda f: f.get("fecha_salida")),
+        ("perro", _perro), ("propietario", _propietario),
+        ("habitacion", lambda f: f.get("habitacion")), ("estado", lambda f: f.get("estado")),
+        ("total_estimado", lambda f: f.get("total_estimado")),
+    ]),
+}
+
+async def leer_por_bloques(endpoint: str, token: str, tam: int = EXPORT_BLOQUE):
+    """Itera las filas de `endpoint` pidiendo `tam` a la vez; el siguiente bloque se
+    descarga mientras se transmite el actual. Avanza según el Content-Range de cada
+    respuesta: PostgREST recorta los bloques a su max-rows, así que un bloque corto no
+    indica el final; se termina al llegar al total contado o con un bloque vacío."""
+    async def bloque(inicio: int, contar: bool = False):
+        headers = {"Range-Unit": "items", "Range": f"{inicio}-{inicio + tam - 1}"}
+        if contar:
+            headers["Prefer"] = "count=exact"
+        response = await supabase_response("GET", endpoint, token=token, headers=headers)
+        return (response.json() if response.text else None) or [], response.headers.get("content-range", "")
+
+    siguiente = asyncio.ensure_future(bloque(0, contar=True))
+    total = None
+    try:
+        while siguiente is not None:
+            filas, content_range = await siguiente
+            rango, _, cuenta = content_range.partition("/")
+            if total is None and cuenta.isdigit():
+                total = int(cuenta)
+            inicio = int(rango.split("-")[1]) + 1 if "-" in rango else None
+            if not filas or inicio is None or (total is not None and inicio >= total):
+                siguiente = None
+            else:
+                siguiente = asyncio.ensure_future(bloque(inicio))
+            for fila in filas:
+                yield fila
+    finally:
+        if siguiente is not None and not siguiente.done():
+            siguiente.cancel()
+
+async def _exportar(recurso: str, fecha_inicio: str, fecha_fin: str, formato: str, token: str):
+    tabla, select, columna_fecha, columnas = EXPORTACIONES[recurso]
+    endpoint = (f"{tabla}?select={select}&{columna_fecha}=gte.{fecha_inicio}&{columna_fecha}=lte.{fecha_fin}"
+                f"&order={columna_fecha}.asc,id.asc")
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    if formato == "csv":
+        escritor.writerow([nombre for nombre, _ in columnas])
+    n = 0
+    try:
+        async for fila in leer_por_bloques(endpoint, token):
+            valores = [(nombre, obtener(fila)) for nombre, obtener in columnas]
+            if formato == "csv":
+                escritor.writerow([v if v is not None else "" for _, v in valores])
+            else:
+                buffer.write(json.dumps(dict(valores), ensure_ascii=False, default=str) + "\n")
+            n += 1
+            if n % 200 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    except Exception as e:
+        # El 200 ya se envió: una última línea marca la exportación como incompleta
+        detalle = e.detail if isinstance(e, HTTPException) else str(e)
+        logger.error("Exportación de %s interrumpida tras %d filas: %s", recurso, n, detalle)
+        if formato == "csv":
+            escritor.writerow([f"#ERROR: exportación incompleta tras {n} filas: {detalle}"])
+        else:
+            buffer.write(json.dumps({"error": "exportación incompleta", "filas": n, "detalle": str(detalle)},
+                                    ensure_ascii=False) + "\n")
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def respuesta_exportacion(recurso: str, fecha_inicio: str, fecha_fin: str, formato: str, token: str):
+    if recurso not in EXPORTACIONES:
+        raise HTTPException(status_code=404, detail=f"Recurso no exportable: {recurso}")
+    if formato not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Formato no soportado: usa ndjson o csv")
+    media_type = "text/csv; charset=utf-8" if formato == "csv" else "application/x-ndjson"
+    archivo = f"{recurso}_{fecha_inicio}_{fecha_fin}.{formato}"
+    return StreamingResponse(
+        _exportar(recurso, fecha_inicio, fecha_fin, formato, token),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{archivo}"'},
+    )
 
-    ranking = sorted(conteo.values(), key=lambda x: -x["visitas"])
-    return {"clientes": ranking[:20]}
+@app.get("/exportar/{recurso}")
+async def exportar(
+    recurso: str,
+    fecha_inicio: Optional[str] = None,
+    fecha_fin: Optional[str] = None,
+    formato: str = "ndjson",
+    authorization: str = Header(None)
+):
+    token = await verify_token(authorization)
+    if not fecha_inicio:
+        fecha_inicio = datetime.now().replace(month=1, day=1).strftime("%Y-%m-%d")
+    if not fecha_fin:
+        fecha_fin = datetime.now().strftime("%Y-%m-%d")
+    return respuesta_exportacion(recurso, fecha_inicio, fecha_fin, formato, token)
 
 # ============================================
 # ENDPOINTS: ALERTAS DE VACUNAS
@@ -1189,40 +3130,72 @@ async def reporte_clientes_frecuentes(authorization: str = Header(None)):
 
 @app.get("/alertas/vacunas")
 async def alertas_vacunas(dias: int = 30, authorization: str = Header(None)):
+    """Perros con vacunas vencidas o que vencen en los próximos `dias` (búsqueda binaria en el índice)."""
     token = await verify_token(authorization)
     hoy = datetime.now().strftime("%Y-%m-%d")
     limite = (datetime.now() + timedelta(days=dias)).strftime("%Y-%m-%d")
+    await asegurar_indice_vacunas()
+    alertas = indice_vacunas.alertas(limite, hoy)
+    return {"alertas": alertas, "total": len(alertas)}
 
-    perros = await supabase_request("GET",
-        f"perros?activo=eq.true&select=id,nombre,propietarios(nombre,telefono),vacuna_rabia_vence,vacuna_sextuple_vence,vacuna_bordetella_vence,vacuna_giardia_vence",
-        token=token)
-
-    alertas = []
-    for p in (perros or []):
-        vacunas_problema = []
-        for campo, nombre_vac in [
-            ("vacuna_rabia_vence", "Rabia"),
-            ("vacuna_sextuple_vence", "Séxtuple"),
-            ("vacuna_bordetella_vence", "Bordetella"),
-            ("vacuna_giardia_vence", "Giardia"),
-        ]:
-            vence = p.get(campo)
-            if vence and vence <= limite:
-                vacunas_problema.append({
-                    "vacuna": nombre_vac,
-                    "vence": vence,
-                    "vencida": vence < hoy
-                })
-        if vacunas_problema:
-            alertas.append({
-                "perro_id": p["id"],
-                "nombre": p["nombre"],
-                "propietario": (p.get("propietarios") or {}).get("nombre", ""),
-                "telefono": (p.get("propietarios") or {}).get("telefono", ""),
-                "vacunas": vacunas_problema
-            })
+# ============================================
+# ENDPOINTS: BÚSQUEDA
+# Índice invertido en memoria (busqueda.py) sobre perros y propietarios activos:
+# sin acentos, por prefijo y con tolerancia a errores de dedo por trigramas. Las
+# escrituras de esta API lo actualizan al momento; una recarga completa periódica
+# recoge los cambios hechos por otros procesos.
+# ============================================
 
-    return {"alertas": alertas, "total": len(alertas)}
+indice_busqueda = IndiceBusqueda()
+_carga_busqueda = asyncio.Lock()
+
+async def _cargar_indice_busqueda():
+    """Foto completa con la llave de servicio (ver indice_ocupacion)."""
+    indice_busqueda.iniciar_carga()
+    try:
+        propietarios, perros = await asyncio.gather(
+            leer_todo("propietarios?select=id,nombre,telefono,email&activo=eq.true&order=id", None),
+            leer_todo("perros?select=id,nombre,raza,propietario_id&activo=eq.true&order=id", None),
+        )
+    except BaseException:
+        indice_busqueda.cancelar_carga()
+        raise
+    indice_busqueda.cargar(propietarios, perros)
+
+async def asegurar_indice_busqueda():
+    """Carga el índice si aún no existe o si el refresco en segundo plano dejó de correr."""
+    if indice_busqueda.vigente(2 * BUSQUEDA_REFRESCO):
+        return
+    async with _carga_busqueda:
+        if indice_busqueda.vigente(2 * BUSQUEDA_REFRESCO):
+            return
+        await _cargar_indice_busqueda()
+
+async def refrescar_busqueda_periodicamente():
+    """Recarga completa cada BUSQUEDA_REFRESCO segundos."""
+    while True:
+        try:
+            async with _carga_busqueda:
+                await _cargar_indice_busqueda()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("No se pudo recargar el índice de búsqueda: %s", e)
+        await asyncio.sleep(BUSQUEDA_REFRESCO)
+
+@app.get("/buscar")
+async def buscar(q: str = "", limite: int = 20, tipo: Optional[str] = None, authorization: str = Header(None)):
+    """Perros y propietarios que coinciden con `q` (nombre, raza, dueño, teléfono o correo),
+    del mejor al peor puntaje. `tipo` = perro | propietario filtra el resultado."""
+    token = await verify_token(authorization)
+    if tipo not in (None, "perro", "propietario"):
+        raise HTTPException(status_code=400, detail="tipo debe ser perro o propietario")
+    limite = max(1, min(limite, 100))
+    await asegurar_indice_busqueda()
+    inicio = time.perf_counter()
+    resultados = indice_busqueda.buscar(q, limite, tipo) if q.strip() else []
+    return {"resultados": resultados, "total": len(resultados),
+            "ms": round((time.perf_counter() - inicio) * 1000, 3)}
 
 # ============================================
 # ENDPOINTS: HISTORIAL POR PERRO
@@ -1261,43 +3234,6 @@ async def historial_perro(perro_id: str, authorization: str = Header(None)):
         "num_visitas": len(estancias_h or []),
     }
 
-# ============================================
-# ENDPOINTS: VALIDAR CAPACIDAD HABITACIÓN
-# ============================================
-
-@app.get("/estancias/disponibilidad")
-async def verificar_disponibilidad(
-    habitacion: str,
-    fecha_entrada: str,
-    fecha_salida: str,
-    authorization: str = Header(None)
-):
-    token = await verify_token(authorization)
-
-    # Buscar estancias activas que se traslapen en esa habitación
-    estancias_solapadas = await supabase_request("GET",
-        f"estancias?habitacion=eq.{habitacion}&estado=eq.Activa&fecha_entrada=lt.{fecha_salida}&fecha_salida=gt.{fecha_entrada}&select=id,perros(nombre)",
-        token=token)
-
-    habitacion_info = await supabase_request("GET",
-        f"catalogo_habitaciones?nombre=eq.{habitacion}&select=capacidad",
-        token=token)
-
-    capacidad = 1
-    if habitacion_info:
-        capacidad = habitacion_info[0].get("capacidad", 1)
-
-    ocupadas = len(estancias_solapadas or [])
-    disponible = ocupadas < capacidad
-
-    return {
-        "habitacion": habitacion,
-        "capacidad": capacidad,
-        "ocupadas": ocupadas,
-        "disponible": disponible,
-        "estancias_actuales": estancias_solapadas or [],
-    }
-
 # ============================================
 # ENDPOINTS: NOTAS POR ESTANCIA
 # ============================================
@@ -1315,6 +3251,11 @@ async def crear_nota_estancia(data: NotaEstanciaCreate, authorization: str = Hea
     result = await supabase_request("POST", "notas_estancia", data.model_dump(exclude_none=True), token=token)
     return result[0] if result else None
 
+@app.post("/notas-estancia/lote")
+async def crear_notas_estancia_lote(data: List[NotaEstanciaCreate], authorization: str = Header(None)):
+    token = await verify_token(authorization)
+    return await insertar_lote("notas_estancia", data, token, {"estancia_id": "estancias"})
+
 @app.delete("/notas-estancia/{nota_id}")
 async def eliminar_nota_estancia(nota_id: str, authorization: str = Header(None)):
     token = await verify_token(authorization)
@@ -1328,7 +3269,7 @@ async def eliminar_nota_estancia(nota_id: str, authorization: str = Header(None)
 @app.get("/grooming/catalogo")
 async def listar_catalogo_grooming(authorization: str = Header(None)):
     token = await verify_token(authorization)
-    return await supabase_request("GET",
+    return await consulta_catalogo(
         "catalogo_grooming?activo=eq.true&select=*&order=nombre",
         token=token) or []
 
@@ -1385,19 +3326,9 @@ async def actualizar_estado_grooming(id: str, estado: str, authorization: str =
 @app.post("/grooming/citas/{id}/enviar-caja")
 async def enviar_grooming_caja(id: str, authorization: str = Header(None)):
     token = await verify_token(authorization)
-    cita = await supabase_request("GET", f"grooming_citas?id=eq.{id}&select=*", token=token)
-    if not cita:
-        raise HTTPException(status_code=404, detail="Cita no encontrada")
-    c = cita[0]
-    cargo = {
-        "perro_id": c["perro_id"],
-        "fecha_cargo": datetime.now().strftime("%Y-%m-%d"),
-        "fecha_servicio": c["fecha"],
-        "concepto": f"Grooming: {c['tipo_grooming']}",
-        "monto": c["precio"]
-    }
-    await supabase_request("POST", "cargos", cargo, token=token)
-    await supabase_request("PATCH", f"grooming_citas?id=eq.{id}", {"enviado_caja": True, "estado": "Completado"}, token=token)
+    resultado = await enviar_a_caja([], [id], token)
+    if not resultado["grooming"]:
+        raise HTTPException(status_code=404, detail="Cita no encontrada o ya enviada a caja")
     return {"message": "Grooming enviado a caja"}
 
 @app.delete("/grooming/citas/{id}")
@@ -1433,6 +3364,12 @@ async def crear_alimentacion(data: AlimentacionCreate, authorization: str = Head
     result = await supabase_request("POST", "alimentacion_registro", data.model_dump(exclude_none=True), token=token)
     return result[0] if result else None
 
+@app.post("/alimentacion/lote")
+async def crear_alimentacion_lote(data: List[AlimentacionCreate], authorization: str = Header(None)):
+    """Ronda de comida completa en una petición: un registro por perro."""
+    token = await verify_token(authorization)
+    return await insertar_lote("alimentacion_registro", data, token, {"perro_id": "perros"})
+
 @app.delete("/alimentacion/{id}")
 async def eliminar_alimentacion(id: str, authorization: str = Header(None)):
     token = await verify_token(authorization)
@@ -1463,6 +3400,11 @@ async def crear_medicamento_log(data: MedicamentoLogCreate, authorization: str =
     result = await supabase_request("POST", "medicamentos_log", data.model_dump(exclude_none=True), token=token)
     return result[0] if result else None
 
+@app.post("/medicamentos-log/lote")
+async def crear_medicamentos_log_lote(data: List[MedicamentoLogCreate], authorization: str = Header(None)):
+    token = await verify_token(authorization)
+    return await insertar_lote("medicamentos_log", data, token, {"perro_id": "perros"})
+
 @app.delete("/medicamentos-log/{id}")
 async def eliminar_medicamento_log(id: str, authorization: str = Header(None)):
     token = await verify_token(authorization)
@@ -1527,25 +3469,136 @@ async def desactivar_inventario_item(id: str, authorization: str = Header(None))
     await supabase_request("PATCH", f"inventario_items?id=eq.{id}", {"activo": False}, token=token)
     return {"message": "Ítem desactivado"}
 
+TIPOS_MOVIMIENTO = {"entrada": 1, "salida": -1}
+# Intentos de la ruta optimista (sin la función SQL) antes de responder 409
+INVENTARIO_REINTENTOS = 100
+
+# True si inventario_items no tiene la columna version (DDL opcional): el compare-and-swap
+# se hace entonces sobre el stock leído
+_inventario_sin_version = False
+
+def _validar_movimientos(movimientos: List[InventarioMovimientoCreate]) -> list:
+    if not movimientos:
+        raise HTTPException(status_code=400, detail="No hay movimientos que registrar")
+    for m in movimientos:
+        if m.tipo not in TIPOS_MOVIMIENTO:
+            raise HTTPException(status_code=400, detail=f"Tipo de movimiento inválido: '{m.tipo}' (entrada o salida)")
+        if m.cantidad <= 0:
+            raise HTTPException(status_code=400, detail="La cantidad debe ser mayor a 0")
+    # PostgREST exige las mismas llaves en todos los objetos del arreglo: sin exclude_none
+    return [m.model_dump() for m in movimientos]
+
+def _aplicar_a_stock(stock: float, movimientos: list) -> float:
+    # Cada salida se recorta en 0 por separado, igual que la función SQL
+    for m in movimientos:
+        stock = max(0, round(stock + TIPOS_MOVIMIENTO[m["tipo"]] * m["cantidad"], 2))
+    return stock
+
+async def _leer_items_inventario(filtro: str, token: str) -> list:
+    """Filas id, stock_actual (y version si la columna existe) de inventario_items."""
+    global _inventario_sin_version
+    if not _inventario_sin_version:
+        try:
+            return await supabase_request("GET", f"inventario_items?{filtro}&select=id,stock_actual,version",
+                                          token=token) or []
+        except HTTPException as e:
+            detalle = str(e.detail)
+            if e.status_code != 400 or "42703" not in detalle or "version" not in detalle:
+                raise
+            _inventario_sin_version = True
+            logger.warning("inventario_items sin columna version; compare-and-swap sobre stock_actual")
+    return await supabase_request("GET", f"inventario_items?{filtro}&select=id,stock_actual", token=token) or []
+
+async def _actualizar_stock_optimista(item: dict, movimientos: list, token: str) -> tuple:
+    """Compare-and-swap: el PATCH solo aplica si nadie escribió el ítem desde la lectura
+    (misma version o, sin esa columna, mismo stock_actual); si no, se relee y se reintenta
+    con espera aleatoria. Regresa (fila actualizada, cambio aplicado al stock)."""
+    for intento in range(INVENTARIO_REINTENTOS):
+        leido = item.get("stock_actual")
+        stock = _aplicar_a_stock(float(leido or 0), movimientos)
+        if "version" in item:
+            version = item.get("version") or 0
+            condicion, datos = f"version=eq.{version}", {"stock_actual": stock, "version": version + 1}
+        else:
+            condicion = f"stock_actual=eq.{leido}" if leido is not None else "stock_actual=is.null"
+            datos = {"stock_actual": stock}
+        actualizado = await supabase_request("PATCH",
+            f"inventario_items?id=eq.{item['id']}&{condicion}&select=id,stock_actual", datos, token=token)
+        if actualizado:
+            return actualizado[0], round(stock - float(leido or 0), 2)
+        await asyncio.sleep(random.uniform(0, min(0.05, 0.001 * 2 ** intento)))
+        releido = await _leer_items_inventario(f"id=eq.{item['id']}", token)
+        if not releido:
+            raise HTTPException(status_code=404, detail=f"Ítem {item['id']} no existe")
+        item = releido[0]
+    raise HTTPException(status_code=409, detail="El ítem se está modificando; intenta de nuevo")
+
+async def _revertir_stock(item_id: str, cambio: float, token: str):
+    """Deshace un cambio ya aplicado con otro compare-and-swap (sin pisar escrituras
+    posteriores). Solo registra el error: quien llama propaga el error original."""
+    if not cambio:
+        return
+    try:
+        actuales = await _leer_items_inventario(f"id=eq.{item_id}", token)
+        if actuales:
+            inverso = {"tipo": "salida" if cambio > 0 else "entrada", "cantidad": abs(cambio)}
+            await _actualizar_stock_optimista(actuales[0], [inverso], token)
+    except Exception as e:
+        logger.error("No se pudo revertir el stock del ítem %s (%+.2f): %s", item_id, cambio, e)
+
+async def registrar_movimientos(movimientos: list, token: str) -> dict:
+    """Aplica los movimientos al stock sin perder actualizaciones concurrentes.
+    Con la función SQL registrar_movimientos_inventario todo es un UPDATE atómico en una
+    transacción; sin ella, compare-and-swap por ítem y después un solo INSERT de los
+    movimientos con ids generados aquí. Si un ítem o el INSERT fallan, los cambios de
+    stock ya aplicados se revierten y se propaga el error original."""
+    resultado = await supabase_rpc("registrar_movimientos_inventario", {"p_movimientos": movimientos}, token=token,
+                                   tablas=("inventario_items", "inventario_movimientos"))
+    if resultado is not _FALTA:
+        return resultado
+
+    por_item: dict = {}
+    for m in movimientos:
+        por_item.setdefault(m["item_id"], []).append(m)
+    # Todos los ítems se leen en una consulta y se validan antes de escribir cualquiera
+    actuales = await _leer_items_inventario(f"id={filtro_in(por_item)}", token)
+    faltantes = set(por_item) - {i["id"] for i in actuales}
+    if faltantes:
+        raise HTTPException(status_code=404, detail=f"Ítem {sorted(faltantes)[0]} no existe")
+
+    resultados = await asyncio.gather(*(_actualizar_stock_optimista(item, por_item[item["id"]], token)
+                                        for item in actuales), return_exceptions=True)
+    aplicados = [(item["id"], r[1]) for item, r in zip(actuales, resultados) if not isinstance(r, BaseException)]
+    error = next((r for r in resultados if isinstance(r, BaseException)), None)
+    if error is None:
+        # Ids propios: si el INSERT falla con resultado incierto (timeout) se borra por id
+        filas = [{**m, "id": str(uuid.uuid4())} for m in movimientos]
+        try:
+            await supabase_request("POST", "inventario_movimientos", filas, token=token)
+        except Exception as e:
+            error = e
+            try:
+                for lote in lotes([f["id"] for f in filas]):
+                    await supabase_request("DELETE", f"inventario_movimientos?id={filtro_in(lote)}", token=token)
+            except Exception as e_borrado:
+                logger.error("No se pudieron borrar movimientos de un INSERT fallido: %s", e_borrado)
+    if error is not None:
+        await asyncio.gather(*(_revertir_stock(item_id, cambio, token) for item_id, cambio in aplicados))
+        raise error
+    return {"registrados": len(movimientos), "items": [r[0] for r in resultados]}
+
 @app.post("/inventario/movimiento")
 async def registrar_movimiento_inventario(data: InventarioMovimientoCreate, authorization: str = Header(None)):
     token = await verify_token(authorization)
+    resultado = await registrar_movimientos(_validar_movimientos([data]), token)
+    stock = resultado["items"][0]["stock_actual"] if resultado.get("items") else None
+    return {"message": f"Movimiento de {data.tipo} registrado", "stock_actual": stock}
 
-    # Registrar movimiento
-    await supabase_request("POST", "inventario_movimientos", data.model_dump(exclude_none=True), token=token)
-
-    # Actualizar stock actual
-    item = await supabase_request("GET", f"inventario_items?id=eq.{data.item_id}&select=stock_actual", token=token)
-    if item:
-        stock = float(item[0].get("stock_actual", 0))
-        if data.tipo == "entrada":
-            nuevo_stock = stock + data.cantidad
-        else:
-            nuevo_stock = max(0, stock - data.cantidad)
-        await supabase_request("PATCH", f"inventario_items?id=eq.{data.item_id}",
-                               {"stock_actual": nuevo_stock}, token=token)
-
-    return {"message": f"Movimiento de {data.tipo} registrado"}
+@app.post("/inventario/movimientos")
+async def registrar_movimientos_inventario(data: InventarioMovimientosLote, authorization: str = Header(None)):
+    """Lote de movimientos en una sola petición (conteos de inventario, recepción de pedidos)."""
+    token = await verify_token(authorization)
+    return await registrar_movimientos(_validar_movimientos(data.movimientos), token)
 
 @app.get("/inventario/{id}/movimientos")
 async def listar_movimientos_item(id: str, authorization: str = Header(None)):
@@ -0,0 +1,159 @@
+"""
+ComfortCan México - Métricas en formato de texto de Prometheus
+
+Contadores e histogramas en memoria, sin dependencias: por ruta (conteo,
+status y latencia) y por llamada a Supabase (tabla y método). El middleware
+es ASGI puro y en el camino caliente solo hace un bisect y un par de sumas
+sobre dicts; el texto se arma únicamente cuando se consulta /metrics.
+
+La ruta se etiqueta con su plantilla (`/perros/{id}`), no con la URL real,
+para que el número de series no crezca con los ids.
+"""
+
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Optional
+
+# Segundos; cubren desde un acierto de caché hasta un reporte pesado
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SIN_RUTA = "(sin_ruta)"
+
+# Acumulador del tiempo esperando a Supabase en la petición en curso (suma de las llamadas:
+# con consultas en paralelo puede ser mayor que la latencia de la petición)
+_espera_supabase: ContextVar[Optional[list]] = ContextVar("espera_supabase", default=None)
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres: tuple, valores: tuple, extra: str = "") -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _numero(valor: float) -> str:
+    return str(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+
+class Contador:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, etiquetas
+        self.valores: dict = {}
+
+    def sumar(self, llave: tuple, n: float = 1):
+        self.valores[llave] = self.valores.get(llave, 0) + n
+
+    def exponer(self) -> list:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        for llave, valor in sorted(self.valores.items()):
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, llave)} {_numero(valor)}")
+        return lineas
+
+
+class Histograma:
+    """Conteos por bucket (no acumulados; se acumulan al exponer), suma y total por serie."""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple, buckets: tuple = BUCKETS_LATENCIA):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, etiquetas
+        self.buckets = buckets
+        self.series: dict = {}
+
+    def observar(self, llave: tuple, valor: float):
+        serie = self.series.get(llave)
+        if serie is None:
+            # [conteos por bucket + desbordamiento, suma]
+            serie = self.series[llave] = [[0] * (len(self.buckets) + 1), 0.0]
+        serie[0][bisect_left(self.buckets, valor)] += 1
+        serie[1] += valor
+
+    def exponer(self) -> list:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for llave, (conteos, suma) in sorted(self.series.items()):
+            acumulado = 0
+            for limite, n in zip(self.buckets + ("+Inf",), conteos):
+                acumulado += n
+                le = 'le="%s"' % limite
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, llave, le)} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, llave)} {repr(round(suma, 6))}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, llave)} {acumulado}")
+        return lineas
+
+
+class MetricasApp:
+    def __init__(self):
+        self.peticiones = Contador("comfortcan_http_requests_total",
+                                   "Peticiones HTTP atendidas por ruta y status", ("method", "route", "status"))
+        self.latencia = Histograma("comfortcan_http_request_duration_seconds",
+                                   "Latencia de las peticiones HTTP por ruta", ("method", "route"))
+        self.espera_supabase = Histograma("comfortcan_http_request_supabase_seconds",
+                                          "Tiempo de cada petición HTTP esperando a Supabase", ("method", "route"))
+        self.supabase = Histograma("comfortcan_supabase_request_duration_seconds",
+                                   "Latencia de las llamadas a Supabase por tabla y método", ("table", "method"))
+        self.supabase_errores = Contador("comfortcan_supabase_errors_total",
+                                         "Llamadas a Supabase que terminaron en error", ("table", "method"))
+        self.en_curso = 0
+
+    # -- Supabase -----------------------------------------------------------
+
+    def registrar_supabase(self, tabla: str, metodo: str, segundos: float, error: bool = False):
+        self.supabase.observar((tabla, metodo), segundos)
+        if error:
+            self.supabase_errores.sumar((tabla, metodo))
+        acumulador = _espera_supabase.get()
+        if acumulador is not None:
+            acumulador[0] += segundos
+
+    # -- exposición ---------------------------------------------------------
+
+    def exponer(self, extra: Optional[list] = None) -> str:
+        lineas = [
+            "# HELP comfortcan_http_requests_in_progress Peticiones HTTP en curso",
+            "# TYPE comfortcan_http_requests_in_progress gauge",
+            f"comfortcan_http_requests_in_progress {self.en_curso}",
+        ]
+        for metrica in (self.peticiones, self.latencia, self.espera_supabase, self.supabase, self.supabase_errores):
+            lineas.extend(metrica.exponer())
+        for nombre, ayuda, tipo, valor in extra or []:
+            lineas.extend([f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}", f"{nombre} {_numero(valor)}"])
+        return "\n".join(lineas) + "\n"
+
+
+class MiddlewareMetricas:
+    """ASGI: mide cada petición HTTP y la etiqueta con la plantilla de su ruta."""
+
+    def __init__(self, app, metricas: MetricasApp, excluir: tuple = ("/metrics",)):
+        self.app = app
+        self.metricas = metricas
+        self.excluir = excluir
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.excluir:
+            return await self.app(scope, receive, send)
+        inicio = time.perf_counter()
+        status = [500]
+        espera = [0.0]
+        marca = _espera_supabase.set(espera)
+        self.metricas.en_curso += 1
+
+        async def send_medido(mensaje):
+            if mensaje["type"] == "http.response.start":
+                status[0] = mensaje["status"]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, send_medido)
+        finally:
+            self.metricas.en_curso -= 1
+            _espera_supabase.reset(marca)
+            # El router de FastAPI deja la ruta resuelta en el scope
+            ruta = getattr(scope.get("route"), "path", SIN_RUTA)
+            metodo = scope["method"]
+            duracion = time.perf_counter() - inicio
+            self.metricas.peticiones.sumar((metodo, ruta, str(status[0])))
+            self.metricas.latencia.observar((metodo, ruta), duracion)
+            self.metricas.espera_supabase.observar((metodo, ruta), espera[0])
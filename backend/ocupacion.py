@@ -0,0 +1,191 @@
+"""
+ComfortCan México - Índice de ocupación de habitaciones
+
+Mantiene, por habitación, un arreglo con el número de perros hospedados cada
+día. Cada estancia ocupa las noches [fecha_entrada, fecha_salida). El índice
+se actualiza de forma incremental cuando se crea, edita, completa o elimina
+una estancia, y responde disponibilidad de todas las habitaciones sin ir a
+la base de datos.
+"""
+
+import re
+from array import array
+from datetime import date, timedelta
+from typing import Optional
+
+from indice_base import IndiceRecargable
+
+# Estados de estancia que ya no ocupan habitación
+ESTADOS_LIBRES = {"Completada", "Cancelada"}
+
+SIN_HABITACION = "Sin asignar"
+
+
+def parse_fecha(valor) -> Optional[date]:
+    if not valor:
+        return None
+    if isinstance(valor, date):
+        return valor
+    try:
+        return date.fromisoformat(str(valor)[:10])
+    except ValueError:
+        return None
+
+
+def orden_natural(nombre: str) -> list:
+    """Llave de orden "H2" < "H10" (como localeCompare con numeric: true en el frontend)."""
+    return [int(p) if p.isdigit() else p.lower() for p in re.split(r"(\d+)", nombre or "")]
+
+
+def asignar_carriles(tramos: list) -> int:
+    """Barrido por día de inicio sobre los tramos de una habitación ({"inicio", "fin"}: días
+    inclusivos). Cada tramo queda en el primer carril cuyo último tramo ya terminó; dos
+    estancias que comparten solo el día de cambio van en el mismo carril con corte diagonal
+    (`corte_fin` en la que sale, `corte_inicio` en la que entra). Regresa cuántos carriles hay."""
+    ultimos: list = []
+    for tramo in sorted(tramos, key=lambda t: (t["inicio"], t["fin"], t["id"])):
+        tramo["corte_inicio"] = tramo["corte_fin"] = False
+        for carril, ultimo in enumerate(ultimos):
+            cambio = (ultimo["fin"] == tramo["inicio"]
+                      and ultimo["inicio"] < ultimo["fin"] and tramo["inicio"] < tramo["fin"])
+            if ultimo["fin"] < tramo["inicio"] or cambio:
+                if cambio:
+                    ultimo["corte_fin"] = tramo["corte_inicio"] = True
+                ultimos[carril] = tramo
+                break
+        else:
+            carril = len(ultimos)
+            ultimos.append(tramo)
+        tramo["carril"] = carril
+    return len(ultimos)
+
+
+class IndiceOcupacion(IndiceRecargable):
+    """Arreglos día a día por habitación, con origen común `origen`."""
+
+    def __init__(self):
+        super().__init__()
+        self.origen: Optional[date] = None
+        self.dias = 0
+        self.por_habitacion: dict = {}
+        self.estancias: dict = {}
+        self.ids_por_habitacion: dict = {}
+
+    # -- carga --------------------------------------------------------------
+
+    def _reconstruir(self, filas: list):
+        self.origen, self.dias = None, 0
+        self.por_habitacion, self.estancias, self.ids_por_habitacion = {}, {}, {}
+        for fila in filas:
+            self.registrar(fila)
+
+    # -- escritura incremental ---------------------------------------------
+
+    def registrar(self, fila: dict):
+        """Alta o reemplazo de una estancia (tal como la regresa PostgREST)."""
+        self._anotar("registrar", fila)
+        self._quitar(fila["id"])
+        if fila.get("estado") in ESTADOS_LIBRES:
+            return
+        entrada = parse_fecha(fila.get("fecha_entrada"))
+        if entrada is None:
+            return
+        salida = parse_fecha(fila.get("fecha_salida"))
+        if salida is None or salida <= entrada:
+            salida = entrada + timedelta(days=1)
+        habitacion = fila.get("habitacion") or SIN_HABITACION
+        self._sumar(habitacion, entrada, salida, 1)
+        self.estancias[fila["id"]] = {
+            "id": fila["id"],
+            "perro_id": fila.get("perro_id"),
+            "habitacion": habitacion,
+            "fecha_entrada": entrada.isoformat(),
+            "fecha_salida": salida.isoformat(),
+        }
+        self.ids_por_habitacion.setdefault(habitacion, set()).add(fila["id"])
+
+    def quitar(self, estancia_id: str):
+        self._anotar("quitar", estancia_id)
+        self._quitar(estancia_id)
+
+    def _quitar(self, estancia_id: str):
+        previa = self.estancias.pop(estancia_id, None)
+        if previa is None:
+            return
+        self._sumar(previa["habitacion"], parse_fecha(previa["fecha_entrada"]),
+                    parse_fecha(previa["fecha_salida"]), -1)
+        self.ids_por_habitacion.get(previa["habitacion"], set()).discard(estancia_id)
+
+    def _asegurar_rango(self, desde: date, hasta: date):
+        if self.origen is None:
+            self.origen = desde
+        if desde < self.origen:
+            extra = (self.origen - desde).days
+            for hab, dias in self.por_habitacion.items():
+                self.por_habitacion[hab] = array("i", bytes(4 * extra)) + dias
+            self.origen = desde
+            self.dias += extra
+        fin = (hasta - self.origen).days
+        if fin > self.dias:
+            extra = fin - self.dias
+            for dias in self.por_habitacion.values():
+                dias.extend(array("i", bytes(4 * extra)))
+            self.dias = fin
+
+    def _sumar(self, habitacion: str, desde: date, hasta: date, delta: int):
+        self._asegurar_rango(desde, hasta)
+        dias = self.por_habitacion.get(habitacion)
+        if dias is None:
+            dias = self.por_habitacion[habitacion] = array("i", bytes(4 * self.dias))
+        for i in range((desde - self.origen).days, (hasta - self.origen).days):
+            dias[i] += delta
+
+    # -- consultas ----------------------------------------------------------
+
+    def _rebanada(self, habitacion: str, desde: date, hasta: date) -> list:
+        dias = self.por_habitacion.get(habitacion)
+        if dias is None or self.origen is None:
+            return []
+        i0 = max(0, (desde - self.origen).days)
+        i1 = min(self.dias, (hasta - self.origen).days)
+        return dias[i0:i1] if i1 > i0 else []
+
+    def pico(self, habitacion: str, desde: date, hasta: date) -> int:
+        """Máximo de perros simultáneos en la habitación durante [desde, hasta)."""
+        rebanada = self._rebanada(habitacion, desde, hasta)
+        return max(rebanada) if len(rebanada) else 0
+
+    def disponibilidad(self, capacidades: dict, desde: date, hasta: date) -> list:
+        """Pico de ocupación y disponibilidad de todas las habitaciones para [desde, hasta)."""
+        resultado = []
+        for habitacion, capacidad in capacidades.items():
+            pico = self.pico(habitacion, desde, hasta)
+            resultado.append({
+                "habitacion": habitacion,
+                "capacidad": capacidad,
+                "ocupadas": pico,
+                "disponible": pico < capacidad,
+            })
+        return resultado
+
+    def solapadas(self, habitacion: str, desde: date, hasta: date) -> list:
+        d0, d1 = desde.isoformat(), hasta.isoformat()
+        return sorted(
+            (e for e in (self.estancias[i] for i in self.ids_por_habitacion.get(habitacion, ()))
+             if e["fecha_entrada"] < d1 and e["fecha_salida"] > d0),
+            key=lambda e: e["fecha_entrada"],
+        )
+
+    def matriz(self, desde: date, dias: int, habitaciones: list) -> list:
+        """Ocupación diaria de cada habitación para `dias` días a partir de `desde`."""
+        hasta = desde + timedelta(days=dias)
+        filas = []
+        for habitacion in habitaciones:
+            ocupacion = [0] * dias
+            if self.origen is not None and habitacion in self.por_habitacion:
+                offset = (desde - self.origen).days
+                rebanada = self._rebanada(habitacion, desde, hasta)
+                inicio = max(0, -offset)
+                ocupacion[inicio:inicio + len(rebanada)] = rebanada
+            filas.append({"habitacion": habitacion, "ocupacion": ocupacion})
+        return filas
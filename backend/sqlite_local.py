@@ -0,0 +1,941 @@
+"""
+ComfortCan México - Backend de datos local (SQLite)
+
+Transporte httpx que imita la API de Supabase (PostgREST, Storage y Auth)
+sobre una base SQLite en proceso. Permite correr la API completa y los
+benchmarks sin red: `supabase_request` sigue construyendo las mismas URLs
+(`eq.`, `gte.`, `in.(...)`, `or=(...)`, selects embebidos) y este transporte
+las traduce a SQL.
+"""
+
+import asyncio
+import json
+import re
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.parse import parse_qsl, unquote
+
+import httpx
+
+from jwt_local import firmar_hs256
+
+# ============================================
+# ESQUEMA
+# ============================================
+# Tipos: text, num, int, bool, date, ts, json
+
+_BASE = {"id": "text", "created_at": "ts"}
+# Tablas que descarga /sync por deltas: llevan updated_at y sus borrados dejan rastro
+_SYNC = {"updated_at": "ts"}
+_VACUNAS = {
+    f"vacuna_{v}_{c}": ("date" if c == "vence" else "text")
+    for v in ("rabia", "sextuple", "bordetella", "giardia", "extra")
+    for c in ("estado", "vence")
+}
+
+ESQUEMA = {
+    "propietarios": {**_BASE, "nombre": "text", "telefono": "text", "direccion": "text",
+                     "email": "text", "notas": "text", "activo": "bool", **_SYNC},
+    "perros": {**_BASE, "propietario_id": "text", "nombre": "text", "raza": "text", "edad": "text",
+               "genero": "text", "peso_kg": "num", "fecha_pesaje": "date", "medicamentos": "text",
+               "esterilizado": "bool", "alergias": "text", "veterinario": "text",
+               "desparasitacion_tipo": "text", "desparasitacion_fecha": "date", **_VACUNAS, **_SYNC,
+               "vacuna_extra_nombre": "text", "foto_perro_url": "text", "foto_cartilla_url": "text",
+               "foto_perro_miniaturas": "json", "foto_cartilla_miniaturas": "json",
+               "desparasitacion_producto_int": "text", "desparasitacion_fecha_int": "date",
+               "desparasitacion_producto_ext": "text", "desparasitacion_fecha_ext": "date",
+               "activo": "bool"},
+    "estancias": {**_BASE, "perro_id": "text", "habitacion": "text", "fecha_entrada": "date",
+                  "fecha_salida": "date", "servicios_ids": "json", "servicios_nombres": "json",
+                  "total_estimado": "num", "color_etiqueta": "text", "notas": "text", "estado": "text",
+                  **_SYNC},
+    "paseos": {**_BASE, "perro_id": "text", "catalogo_paseo_id": "text", "fecha": "date",
+               "tipo_paseo": "text", "hora_salida": "text", "hora_regreso": "text", "precio": "num",
+               "notas": "text", "pagado": "bool", "enviado_caja": "bool"},
+    "tickets": {**_BASE, "perro_id": "text", "propietario_id": "text", "cargos_ids": "json",
+                "subtotal": "num", "total": "num", "metodo_pago": "text", "notas": "text", "fecha": "date"},
+    "cargos": {**_BASE, "perro_id": "text", "fecha_cargo": "date", "fecha_servicio": "date",
+               "concepto": "text", "monto": "num", "pagado": "bool", "ticket_id": "text",
+               "descuento": "num", "descuento_motivo": "text"},
+    "catalogo_servicios": {**_BASE, "nombre": "text", "precio": "num", "tipo_cobro": "text", "activo": "bool"},
+    "catalogo_paseos": {**_BASE, "nombre": "text", "duracion_minutos": "int", "precio": "num", "activo": "bool"},
+    "catalogo_habitaciones": {**_BASE, "nombre": "text", "capacidad": "int", "descripcion": "text", "activo": "bool"},
+    "catalogo_colores": {**_BASE, "color": "text", "texto": "text", "orden": "int", "activo": "bool"},
+    "notas_estancia": {**_BASE, "estancia_id": "text", "nota": "text", "autor": "text"},
+    "catalogo_grooming": {**_BASE, "nombre": "text", "precio_base": "num", "duracion_minutos": "int",
+                          "descripcion": "text", "activo": "bool"},
+    "grooming_citas": {**_BASE, "perro_id": "text", "catalogo_grooming_id": "text", "fecha": "date",
+                       "hora": "text", "tipo_grooming": "text", "precio": "num", "estado": "text",
+                       "notas": "text", "enviado_caja": "bool"},
+    "alimentacion_registro": {**_BASE, "estancia_id": "text", "perro_id": "text", "fecha": "date",
+                              "hora": "text", "comio": "bool", "cantidad_g": "num", "notas": "text"},
+    "medicamentos_log": {**_BASE, "estancia_id": "text", "perro_id": "text", "fecha": "date", "hora": "text",
+                         "medicamento": "text", "dosis": "text", "administrado_por": "text"},
+    "personal": {**_BASE, "nombre": "text", "cargo": "text", "telefono": "text", "activo": "bool"},
+    "inventario_items": {**_BASE, "nombre": "text", "categoria": "text", "unidad": "text",
+                         "stock_actual": "num", "stock_minimo": "num", "version": "int", "activo": "bool"},
+    "inventario_movimientos": {**_BASE, "item_id": "text", "tipo": "text", "cantidad": "num", "motivo": "text"},
+    # Resúmenes diarios mantenidos por triggers (ver ROLLUPS más abajo)
+    "rollup_ingresos_dia": {"fecha": "date", "metodo_pago": "text", "total": "num", "tickets": "int"},
+    "rollup_cargos_dia": {"fecha": "date", "concepto": "text", "total": "num", "pagado": "num", "pendiente": "num"},
+    "rollup_ocupacion_dia": {"fecha": "date", "habitacion": "text", "noches": "int"},
+    # Filas borradas de las tablas con _SYNC (las llena un trigger, ver _crear_sync)
+    "sync_eliminaciones": {"tabla": "text", "fila_id": "text", "eliminado_en": "ts"},
+}
+
+DEFAULTS = {
+    "*": {"activo": True},
+    "perros": {"esterilizado": False},
+    "estancias": {"estado": "Activa"},
+    "paseos": {"pagado": False, "enviado_caja": False},
+    "cargos": {"pagado": False, "descuento": 0},
+    "catalogo_servicios": {"tipo_cobro": "por_dia"},
+    "catalogo_habitaciones": {"capacidad": 1},
+    "catalogo_colores": {"orden": 0},
+    "notas_estancia": {"autor": "Sistema"},
+    "catalogo_grooming": {"duracion_minutos": 60},
+    "grooming_citas": {"estado": "Pendiente", "enviado_caja": False},
+    "alimentacion_registro": {"comio": True},
+    "inventario_items": {"unidad": "piezas", "stock_actual": 0, "stock_minimo": 0, "version": 0},
+}
+
+# (tabla, columna, tabla referenciada, on delete)
+LLAVES_FORANEAS = [
+    ("perros", "propietario_id", "propietarios", None),
+    ("estancias", "perro_id", "perros", None),
+    ("paseos", "perro_id", "perros", None),
+    ("paseos", "catalogo_paseo_id", "catalogo_paseos", None),
+    ("tickets", "perro_id", "perros", None),
+    ("tickets", "propietario_id", "propietarios", None),
+    ("cargos", "perro_id", "perros", None),
+    ("cargos", "ticket_id", "tickets", None),
+    ("notas_estancia", "estancia_id", "estancias", "CASCADE"),
+    ("grooming_citas", "perro_id", "perros", None),
+    ("alimentacion_registro", "perro_id", "perros", None),
+    ("medicamentos_log", "perro_id", "perros", None),
+    ("inventario_movimientos", "item_id", "inventario_items", None),
+]
+
+# Relaciones sin FK declarada en SQL pero que PostgREST resuelve al embeber
+_RELACIONES_EXTRA = [
+    ("grooming_citas", "catalogo_grooming_id", "catalogo_grooming"),
+    ("alimentacion_registro", "estancia_id", "estancias"),
+    ("medicamentos_log", "estancia_id", "estancias"),
+]
+
+INDICES = [
+    ("estancias", "estado"), ("estancias", "fecha_entrada"), ("paseos", "fecha"),
+    ("cargos", "pagado"), ("cargos", "fecha_cargo"), ("tickets", "fecha"), ("tickets", "created_at"),
+    ("grooming_citas", "fecha"), ("alimentacion_registro", "fecha"), ("medicamentos_log", "fecha"),
+    ("propietarios", "updated_at"), ("perros", "updated_at"), ("estancias", "updated_at"),
+    ("sync_eliminaciones", "eliminado_en"),
+]
+
+
+class ErrorPostgrest(Exception):
+    def __init__(self, status_code: int, message: str, code: str = "PGRST100"):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.code = code
+
+
+def crear_conexion(path: str = ":memory:") -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA journal_mode = WAL")
+    fks = {(t, c): (ref, on_delete) for t, c, ref, on_delete in LLAVES_FORANEAS}
+    for tabla, columnas in ESQUEMA.items():
+        defs = []
+        for col in columnas:
+            if col == "id":
+                defs.append("id TEXT PRIMARY KEY")
+            elif (tabla, col) in fks:
+                ref, on_delete = fks[(tabla, col)]
+                extra = f" ON DELETE {on_delete}" if on_delete else ""
+                defs.append(f"{col} REFERENCES {ref}(id){extra}")
+            else:
+                defs.append(col)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {tabla} ({', '.join(defs)})")
+    for tabla, col, _, _ in LLAVES_FORANEAS:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{tabla}_{col} ON {tabla}({col})")
+    for tabla, col in INDICES:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{tabla}_{col} ON {tabla}({col})")
+    _crear_rollups(conn)
+    _crear_sync(conn)
+    return conn
+
+
+# ============================================
+# ROLLUPS DIARIOS
+# ============================================
+# Equivalente local de los triggers documentados en main.py: cada alta, cambio o
+# baja de tickets, cargos y estancias suma/resta su aportación al resumen del día.
+
+LLAVES_ROLLUP = {
+    "rollup_ingresos_dia": ("fecha", "metodo_pago"),
+    "rollup_cargos_dia": ("fecha", "concepto"),
+    "rollup_ocupacion_dia": ("fecha", "habitacion"),
+}
+
+# Noches máximas que se reparten por estancia (tabla auxiliar _numeros)
+MAX_NOCHES_ROLLUP = 3660
+
+
+def _aporte_ingresos(r: str, signo: int) -> str:
+    return f"""
+        INSERT INTO rollup_ingresos_dia (fecha, metodo_pago, total, tickets)
+        SELECT substr({r}.fecha, 1, 10), COALESCE({r}.metodo_pago, 'Otro'), {signo} * COALESCE({r}.total, 0), {signo}
+         WHERE {r}.fecha IS NOT NULL
+        ON CONFLICT (fecha, metodo_pago) DO UPDATE
+           SET total = total + excluded.total, tickets = tickets + excluded.tickets;"""
+
+
+def _aporte_cargos(r: str, signo: int) -> str:
+    return f"""
+        INSERT INTO rollup_cargos_dia (fecha, concepto, total, pagado, pendiente)
+        SELECT substr({r}.fecha_cargo, 1, 10), COALESCE({r}.concepto, 'Otro'), {signo} * COALESCE({r}.monto, 0),
+               {signo} * (CASE WHEN {r}.pagado THEN COALESCE({r}.monto, 0) ELSE 0 END),
+               {signo} * (CASE WHEN {r}.pagado THEN 0 ELSE COALESCE({r}.monto, 0) END)
+         WHERE {r}.fecha_cargo IS NOT NULL
+        ON CONFLICT (fecha, concepto) DO UPDATE
+           SET total = total + excluded.total, pagado = pagado + excluded.pagado,
+               pendiente = pendiente + excluded.pendiente;"""
+
+
+def _aporte_ocupacion(r: str, signo: int) -> str:
+    noches = (f"MAX(1, COALESCE(CAST(julianday({r}.fecha_salida) - julianday({r}.fecha_entrada) AS INTEGER), 1))")
+    return f"""
+        INSERT INTO rollup_ocupacion_dia (fecha, habitacion, noches)
+        SELECT date({r}.fecha_entrada, '+' || n || ' days'), COALESCE(NULLIF({r}.habitacion, ''), 'Sin asignar'), {signo}
+          FROM _numeros
+         WHERE {r}.fecha_entrada IS NOT NULL AND COALESCE({r}.estado, '') <> 'Cancelada' AND n < {noches}
+        ON CONFLICT (fecha, habitacion) DO UPDATE SET noches = noches + excluded.noches;"""
+
+
+# tabla origen -> (columnas que afectan el resumen, generador del INSERT)
+TRIGGERS_ROLLUP = {
+    "tickets": ("fecha, metodo_pago, total", _aporte_ingresos),
+    "cargos": ("fecha_cargo, concepto, monto, pagado", _aporte_cargos),
+    "estancias": ("fecha_entrada, fecha_salida, habitacion, estado", _aporte_ocupacion),
+}
+
+
+def _crear_rollups(conn: sqlite3.Connection):
+    for tabla, llave in LLAVES_ROLLUP.items():
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{tabla} ON {tabla}({', '.join(llave)})")
+    conn.execute("CREATE TABLE IF NOT EXISTS _numeros (n INTEGER PRIMARY KEY)")
+    if conn.execute("SELECT COUNT(*) FROM _numeros").fetchone()[0] < MAX_NOCHES_ROLLUP:
+        conn.executemany("INSERT OR IGNORE INTO _numeros (n) VALUES (?)", ((n,) for n in range(MAX_NOCHES_ROLLUP)))
+    for tabla, (columnas, aporte) in TRIGGERS_ROLLUP.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS tr_rollup_{tabla}_ins AFTER INSERT ON {tabla} "
+                     f"BEGIN {aporte('NEW', 1)} END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS tr_rollup_{tabla}_del AFTER DELETE ON {tabla} "
+                     f"BEGIN {aporte('OLD', -1)} END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS tr_rollup_{tabla}_upd AFTER UPDATE OF {columnas} ON {tabla} "
+                     f"BEGIN {aporte('OLD', -1)} {aporte('NEW', 1)} END")
+
+
+# ============================================
+# SYNC POR DELTAS
+# ============================================
+# updated_at lo pone la capa de escritura (insertar/actualizar); el borrado deja
+# una lápida en sync_eliminaciones con el mismo formato de timestamp.
+
+TABLAS_SYNC = [t for t, columnas in ESQUEMA.items() if "updated_at" in columnas]
+
+_AHORA_SQL = "strftime('%Y-%m-%dT%H:%M:%f000+00:00', 'now')"
+
+
+def _crear_sync(conn: sqlite3.Connection):
+    for tabla in TABLAS_SYNC:
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS tr_sync_{tabla}_del AFTER DELETE ON {tabla} "
+                     f"BEGIN INSERT INTO sync_eliminaciones (tabla, fila_id, eliminado_en) "
+                     f"VALUES ('{tabla}', OLD.id, {_AHORA_SQL}); END")
+
+
+def _ahora_iso() -> str:
+    # Siempre con microsegundos: los timestamps se comparan como texto
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+# ============================================
+# PARSER DE SINTAXIS POSTGREST
+# ============================================
+
+def _dividir(texto: str, sep: str = ",") -> list:
+    """Divide por `sep` respetando paréntesis y comillas."""
+    partes, actual, nivel, comillas = [], [], 0, False
+    for ch in texto:
+        if ch == '"':
+            comillas = not comillas
+        elif not comillas and ch == "(":
+            nivel += 1
+        elif not comillas and ch == ")":
+            nivel -= 1
+        if ch == sep and nivel == 0 and not comillas:
+            partes.append("".join(actual))
+            actual = []
+        else:
+            actual.append(ch)
+    if actual or partes:
+        partes.append("".join(actual))
+    return [p.strip() for p in partes if p.strip()]
+
+
+def parse_select(texto: str) -> list:
+    """`*,perros(id,nombre,propietarios(nombre))` -> lista de columnas y embebidos."""
+    items = []
+    for parte in _dividir(texto or "*"):
+        alias = None
+        m = re.match(r"^([\w]+):(.+)$", parte)
+        if m and "(" not in m.group(1):
+            alias, parte = m.group(1), m.group(2)
+        if "(" in parte and parte.endswith(")"):
+            nombre = parte[:parte.index("(")]
+            interno = parte[parte.index("(") + 1:-1]
+            tabla = nombre.split("!")[0]
+            items.append({"embed": tabla, "alias": alias or tabla, "select": parse_select(interno)})
+        else:
+            col = parte.split("::")[0]
+            items.append({"col": col, "alias": alias or col})
+    return items
+
+
+def _lista_in(valor: str) -> list:
+    if not (valor.startswith("(") and valor.endswith(")")):
+        raise ErrorPostgrest(400, f"Lista inválida para in: {valor}")
+    return [v.strip().strip('"') for v in _dividir(valor[1:-1])]
+
+
+def _coercionar(tipo: str, valor: str):
+    if valor is None:
+        return None
+    if tipo == "bool":
+        return 1 if str(valor).lower() == "true" else 0
+    if tipo == "num":
+        try:
+            return float(valor)
+        except ValueError:
+            raise ErrorPostgrest(400, f'invalid input syntax for type numeric: "{valor}"', "22P02")
+    if tipo == "int":
+        try:
+            return int(valor)
+        except ValueError:
+            raise ErrorPostgrest(400, f'invalid input syntax for type integer: "{valor}"', "22P02")
+    return valor
+
+
+_OPERADORES = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+class _Consulta:
+    """Traduce filtros PostgREST de una tabla a una cláusula WHERE con parámetros."""
+
+    def __init__(self, tabla: str):
+        if tabla not in ESQUEMA:
+            raise ErrorPostgrest(404, f'relation "public.{tabla}" does not exist', "42P01")
+        self.tabla = tabla
+        self.columnas = ESQUEMA[tabla]
+
+    def columna(self, col: str) -> str:
+        if col not in self.columnas:
+            raise ErrorPostgrest(400, f"column {self.tabla}.{col} does not exist", "42703")
+        return col
+
+    def condicion(self, col: str, expresion: str) -> tuple:
+        col = self.columna(col)
+        negar = False
+        if expresion.startswith("not."):
+            negar, expresion = True, expresion[4:]
+        if "." not in expresion:
+            raise ErrorPostgrest(400, f'"failed to parse filter ({expresion})"', "PGRST100")
+        op, valor = expresion.split(".", 1)
+        if op != "in" and len(valor) >= 2 and valor[0] == valor[-1] == '"':
+            valor = valor[1:-1]
+        tipo = self.columnas[col]
+        if op in _OPERADORES:
+            sql, params = f"{col} {_OPERADORES[op]} ?", [_coercionar(tipo, valor)]
+        elif op == "in":
+            valores = [_coercionar(tipo, v) for v in _lista_in(valor)]
+            sql = f"{col} IN ({','.join('?' * len(valores))})" if valores else "0"
+            params = valores
+        elif op == "is":
+            v = valor.lower()
+            if v == "null":
+                sql, params = f"{col} IS NULL", []
+            elif v in ("true", "false"):
+                sql, params = f"{col} IS ?", [1 if v == "true" else 0]
+            else:
+                raise ErrorPostgrest(400, f"Valor inválido para is: {valor}")
+        elif op == "like":
+            sql, params = f"{col} GLOB ?", [valor.replace("%", "*")]
+        elif op == "ilike":
+            sql, params = f"lower({col}) LIKE lower(?)", [valor.replace("*", "%")]
+        else:
+            raise ErrorPostgrest(400, f"Operador no soportado: {op}")
+        if negar:
+            sql = f"NOT ({sql})"
+        return sql, params
+
+    def logica(self, operador: str, cuerpo: str) -> tuple:
+        """`or=(a.eq.1,and(b.gte.2,c.lte.3))`"""
+        if not (cuerpo.startswith("(") and cuerpo.endswith(")")):
+            raise ErrorPostgrest(400, f'"failed to parse logic tree ({cuerpo})"', "PGRST100")
+        partes, params = [], []
+        for termino in _dividir(cuerpo[1:-1]):
+            negar = termino.startswith("not.")
+            if negar:
+                termino = termino[4:]
+            m = re.match(r"^(and|or)(\(.*\))$", termino)
+            if m:
+                sql, p = self.logica(m.group(1), m.group(2))
+            else:
+                col, expresion = termino.split(".", 1)
+                sql, p = self.condicion(col, expresion)
+            partes.append(f"NOT ({sql})" if negar else f"({sql})")
+            params.extend(p)
+        return f" {operador.upper()} ".join(partes) or "1", params
+
+    def where(self, filtros: list) -> tuple:
+        partes, params = [], []
+        for clave, valor in filtros:
+            if clave in ("or", "and", "not.or", "not.and"):
+                negar = clave.startswith("not.")
+                sql, p = self.logica(clave.replace("not.", ""), valor)
+                sql = f"NOT ({sql})" if negar else sql
+            elif "." in clave:
+                raise ErrorPostgrest(400, f"Filtros sobre recursos embebidos no soportados: {clave}")
+            else:
+                sql, p = self.condicion(clave, valor)
+            partes.append(f"({sql})")
+            params.extend(p)
+        return (" WHERE " + " AND ".join(partes)) if partes else "", params
+
+    def order(self, texto: Optional[str]) -> str:
+        if not texto:
+            return ""
+        partes = []
+        for termino in _dividir(texto):
+            trozos = termino.split(".")
+            col = self.columna(trozos[0])
+            desc = "desc" in trozos[1:]
+            nulls = "NULLS FIRST" if desc else "NULLS LAST"
+            if "nullsfirst" in trozos[1:]:
+                nulls = "NULLS FIRST"
+            elif "nullslast" in trozos[1:]:
+                nulls = "NULLS LAST"
+            partes.append(f"{col} {'DESC' if desc else 'ASC'} {nulls}")
+        return " ORDER BY " + ", ".join(partes)
+
+
+# ============================================
+# MOTOR
+# ============================================
+
+class BaseLocal:
+    """Ejecuta operaciones PostgREST contra la conexión SQLite."""
+
+    PARAMS_RESERVADOS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.storage: dict = {}
+        self.funciones_rpc: dict = dict(FUNCIONES_RPC)
+        self._savepoints = 0
+
+    @contextmanager
+    def transaccion(self):
+        """Transacción anidable (SAVEPOINT): revierte todo si algo falla adentro."""
+        self._savepoints += 1
+        nombre = f"sp{self._savepoints}"
+        self.conn.execute(f"SAVEPOINT {nombre}")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute(f"ROLLBACK TO {nombre}")
+            self.conn.execute(f"RELEASE {nombre}")
+            raise
+        finally:
+            self._savepoints -= 1
+        self.conn.execute(f"RELEASE {nombre}")
+
+    # -- serialización ------------------------------------------------------
+
+    def _a_json(self, tabla: str, fila: sqlite3.Row) -> dict:
+        tipos = ESQUEMA[tabla]
+        out = {}
+        for col in fila.keys():
+            v = fila[col]
+            tipo = tipos.get(col)
+            if v is not None:
+                if tipo == "bool":
+                    v = bool(v)
+                elif tipo == "json":
+                    v = json.loads(v)
+                elif tipo == "num":
+                    v = float(v)
+            out[col] = v
+        return out
+
+    def _a_sql(self, tabla: str, datos: dict) -> dict:
+        tipos = ESQUEMA[tabla]
+        out = {}
+        for col, v in datos.items():
+            if col not in tipos:
+                raise ErrorPostgrest(
+                    400, f"Could not find the '{col}' column of '{tabla}' in the schema cache", "PGRST204")
+            tipo = tipos[col]
+            if v is not None:
+                if tipo == "bool":
+                    v = 1 if v else 0
+                elif tipo == "json":
+                    v = json.dumps(v)
+                elif tipo == "num":
+                    v = float(v)
+            out[col] = v
+        return out
+
+    # -- lectura ------------------------------------------------------------
+
+    def _relacion(self, tabla: str, embebida: str) -> tuple:
+        for t, col, ref, _ in LLAVES_FORANEAS:
+            if t == tabla and ref == embebida:
+                return "uno", col
+        for t, col, ref in _RELACIONES_EXTRA:
+            if t == tabla and ref == embebida:
+                return "uno", col
+        for t, col, ref, _ in LLAVES_FORANEAS:
+            if t == embebida and ref == tabla:
+                return "muchos", col
+        raise ErrorPostgrest(
+            400, f"Could not find a relationship between '{tabla}' and '{embebida}' in the schema cache", "PGRST200")
+
+    def _proyectar(self, tabla: str, filas: list, select: list) -> list:
+        columnas = ESQUEMA[tabla]
+        simples = [s for s in select if "col" in s]
+        embebidos = [s for s in select if "embed" in s]
+        resultado = []
+        for fila in filas:
+            out = {}
+            for s in simples:
+                if s["col"] == "*":
+                    out.update(fila)
+                elif s["col"] in columnas:
+                    out[s["alias"]] = fila.get(s["col"])
+                else:
+                    raise ErrorPostgrest(400, f"column {tabla}.{s['col']} does not exist", "42703")
+            resultado.append(out)
+        for emb in embebidos:
+            tipo, col = self._relacion(tabla, emb["embed"])
+            if tipo == "uno":
+                ids = list({f.get(col) for f in filas if f.get(col)})
+                relacionados = self._por_columna(emb["embed"], "id", ids, emb["select"])
+                indice = {r["_id"]: r["fila"] for r in relacionados}
+                for fila, out in zip(filas, resultado):
+                    out[emb["alias"]] = indice.get(fila.get(col))
+            else:
+                ids = [f["id"] for f in filas]
+                relacionados = self._por_columna(emb["embed"], col, ids, emb["select"])
+                grupos: dict = {}
+                for r in relacionados:
+                    grupos.setdefault(r["_fk"], []).append(r["fila"])
+                for fila, out in zip(filas, resultado):
+                    out[emb["alias"]] = grupos.get(fila["id"], [])
+        return resultado
+
+    def _por_columna(self, tabla: str, col: str, valores: list, select: list) -> list:
+        if not valores:
+            return []
+        filas = []
+        # SQLite limita el número de parámetros por sentencia
+        for i in range(0, len(valores), 900):
+            lote = valores[i:i + 900]
+            cursor = self.conn.execute(
+                f"SELECT * FROM {tabla} WHERE {col} IN ({','.join('?' * len(lote))})", lote)
+            filas.extend(self._a_json(tabla, f) for f in cursor)
+        proyectadas = self._proyectar(tabla, filas, select)
+        return [{"_id": f["id"], "_fk": f.get(col), "fila": p} for f, p in zip(filas, proyectadas)]
+
+    def seleccionar(self, tabla: str, params: list, rango: Optional[tuple] = None,
+                    contar: bool = False) -> tuple:
+        consulta = _Consulta(tabla)
+        opciones = {k: v for k, v in params if k in self.PARAMS_RESERVADOS}
+        filtros = [(k, v) for k, v in params if k not in self.PARAMS_RESERVADOS]
+        where, valores = consulta.where(filtros)
+        sql = f"SELECT * FROM {tabla}{where}{consulta.order(opciones.get('order'))}"
+        offset = int(opciones.get("offset", 0))
+        limit = int(opciones["limit"]) if "limit" in opciones else None
+        if rango:
+            offset = rango[0]
+            limit = rango[1] - rango[0] + 1 if rango[1] is not None else limit
+        total = None
+        if contar:
+            total = self.conn.execute(f"SELECT COUNT(*) FROM {tabla}{where}", valores).fetchone()[0]
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            valores = valores + [limit if limit is not None else -1, offset]
+        filas = [self._a_json(tabla, f) for f in self.conn.execute(sql, valores)]
+        select = parse_select(opciones.get("select", "*"))
+        return self._proyectar(tabla, filas, select), offset, total
+
+    # -- escritura ----------------------------------------------------------
+
+    def _con_defaults(self, tabla: str, datos: dict) -> dict:
+        fila = {k: v for k, v in DEFAULTS["*"].items() if k in ESQUEMA[tabla]}
+        fila.update(DEFAULTS.get(tabla, {}))
+        fila.update(datos)
+        fila.setdefault("id", str(uuid.uuid4()))
+        fila.setdefault("created_at", _ahora_iso())
+        if "updated_at" in ESQUEMA[tabla]:
+            fila.setdefault("updated_at", fila["created_at"])
+        return fila
+
+    def insertar(self, tabla: str, datos, params: list) -> list:
+        _Consulta(tabla)
+        filas = datos if isinstance(datos, list) else [datos]
+        if any(d.keys() != filas[0].keys() for d in filas[1:]):
+            # PostgREST toma las columnas del primer objeto y rechaza el arreglo si no coinciden
+            raise ErrorPostgrest(400, "All object keys must match", "PGRST102")
+        insertadas = []
+        with self.transaccion():
+            for d in filas:
+                fila = self._a_sql(tabla, self._con_defaults(tabla, d))
+                cols = list(fila)
+                self.conn.execute(
+                    f"INSERT INTO {tabla} ({','.join(cols)}) VALUES ({','.join('?' * len(cols))})",
+                    [fila[c] for c in cols])
+                insertadas.append(fila["id"])
+        opciones = dict((k, v) for k, v in params if k == "select")
+        return self._releer(tabla, insertadas, opciones.get("select", "*"))
+
+    def actualizar(self, tabla: str, datos: dict, params: list) -> list:
+        consulta = _Consulta(tabla)
+        filtros = [(k, v) for k, v in params if k not in self.PARAMS_RESERVADOS]
+        where, valores = consulta.where(filtros)
+        if datos and "updated_at" in ESQUEMA[tabla]:
+            datos = {**datos, "updated_at": _ahora_iso()}
+        fila = self._a_sql(tabla, datos or {})
+        ids = [r[0] for r in self.conn.execute(f"SELECT id FROM {tabla}{where}", valores)]
+        if fila and ids:
+            sets = ", ".join(f"{c} = ?" for c in fila)
+            self.conn.execute(
+                f"UPDATE {tabla} SET {sets} WHERE id IN ({','.join('?' * len(ids))})",
+                list(fila.values()) + ids)
+        opciones = dict((k, v) for k, v in params if k == "select")
+        return self._releer(tabla, ids, opciones.get("select", "*"))
+
+    def eliminar(self, tabla: str, params: list) -> list:
+        consulta = _Consulta(tabla)
+        filtros = [(k, v) for k, v in params if k not in self.PARAMS_RESERVADOS]
+        where, valores = consulta.where(filtros)
+        filas = [self._a_json(tabla, f) for f in self.conn.execute(f"SELECT * FROM {tabla}{where}", valores)]
+        self.conn.execute(f"DELETE FROM {tabla}{where}", valores)
+        opciones = dict((k, v) for k, v in params if k == "select")
+        return self._proyectar(tabla, filas, parse_select(opciones.get("select", "*")))
+
+    def _releer(self, tabla: str, ids: list, select: str) -> list:
+        if not ids:
+            return []
+        filas = []
+        for i in range(0, len(ids), 900):
+            lote = ids[i:i + 900]
+            cursor = self.conn.execute(
+                f"SELECT * FROM {tabla} WHERE id IN ({','.join('?' * len(lote))})", lote)
+            filas.extend(self._a_json(tabla, f) for f in cursor)
+        orden = {id_: i for i, id_ in enumerate(ids)}
+        filas.sort(key=lambda f: orden[f["id"]])
+        return self._proyectar(tabla, filas, parse_select(select))
+
+
+# ============================================
+# FUNCIONES RPC
+# ============================================
+# Equivalentes locales de las funciones SQL documentadas en main.py
+
+def _lista_uuid(ids: list) -> str:
+    return "in.(" + ",".join(f'"{i}"' for i in ids) + ")"
+
+
+def rpc_crear_ticket_checkout(base: BaseLocal, p_ticket: dict, p_cargos_ids: list) -> dict:
+    ids = list(dict.fromkeys(p_cargos_ids or []))
+    with base.transaccion():
+        ticket = base.insertar("tickets", {**p_ticket, "cargos_ids": ids}, [])[0]
+        cargos = []
+        if ids:
+            cargos = base.actualizar("cargos", {"pagado": True, "ticket_id": ticket["id"]},
+                                     [("id", _lista_uuid(ids)), ("pagado", "eq.false")])
+        if len(cargos) != len(ids):
+            raise ErrorPostgrest(409, "Cargos ya pagados o inexistentes", "PT409")
+    return {**ticket, "cargos": cargos}
+
+
+def rpc_eliminar_perros_cascada(base: BaseLocal, p_perros_ids: list, p_propietario_id: str = None) -> dict:
+    ids = _lista_uuid(p_perros_ids or [])
+    tablas = {}
+
+    def borrar(tabla, params, datos=None):
+        t0 = time.perf_counter()
+        n = len(base.actualizar(tabla, datos, params) if datos else base.eliminar(tabla, params))
+        previo = tablas.get(tabla, {"filas": 0, "ms": 0.0})
+        tablas[tabla] = {"filas": previo["filas"] + n,
+                         "ms": round(previo["ms"] + (time.perf_counter() - t0) * 1000, 3)}
+
+    with base.transaccion():
+        estancias = [r[0] for r in base.conn.execute(
+            "SELECT id FROM estancias WHERE perro_id IN (SELECT value FROM json_each(?))",
+            [json.dumps(p_perros_ids or [])])]
+        borrar("notas_estancia", [("estancia_id", _lista_uuid(estancias))])
+        for tabla in ("paseos", "grooming_citas", "alimentacion_registro", "medicamentos_log",
+                      "cargos", "estancias"):
+            borrar(tabla, [("perro_id", ids)])
+        borrar("tickets", [("perro_id", ids)], {"perro_id": None})
+        borrar("perros", [("id", ids)])
+        if p_propietario_id:
+            borrar("tickets", [("propietario_id", f"eq.{p_propietario_id}")], {"propietario_id": None})
+            borrar("perros", [("propietario_id", f"eq.{p_propietario_id}")])
+            borrar("propietarios", [("id", f"eq.{p_propietario_id}")])
+    return {"tablas": tablas}
+
+
+def rpc_registrar_movimientos_inventario(base: BaseLocal, p_movimientos: list) -> dict:
+    ids = list(dict.fromkeys(m["item_id"] for m in p_movimientos))
+    with base.transaccion():
+        for m in p_movimientos:
+            delta = float(m["cantidad"]) * (1 if m["tipo"] == "entrada" else -1)
+            cursor = base.conn.execute(
+                "UPDATE inventario_items SET stock_actual = MAX(0, ROUND(stock_actual + ?, 2)), "
+                "version = version + 1 WHERE id = ?", [delta, m["item_id"]])
+            if cursor.rowcount == 0:
+                raise ErrorPostgrest(404, f"Ítem {m['item_id']} no existe", "PT404")
+        base.insertar("inventario_movimientos", [
+            {k: m.get(k) for k in ("item_id", "tipo", "cantidad", "motivo")} for m in p_movimientos], [])
+    items = base.seleccionar("inventario_items", [("id", _lista_uuid(ids)), ("select", "id,stock_actual")])[0]
+    return {"registrados": len(p_movimientos), "items": items}
+
+
+def _consulta(base: BaseLocal, sql: str, args: list = ()) -> list:
+    return [dict(r) for r in base.conn.execute(sql, list(args))]
+
+
+def rpc_reporte_ingresos(base: BaseLocal, p_desde: str, p_hasta: str) -> dict:
+    rango = "FROM tickets WHERE fecha >= ? AND fecha <= ?"
+    totales = _consulta(base, f"SELECT COUNT(*) AS n, ROUND(COALESCE(SUM(total), 0), 2) AS total {rango}",
+                        [p_desde, p_hasta])[0]
+    por_dia = _consulta(base, f"SELECT substr(fecha, 1, 10) AS fecha, ROUND(SUM(total), 2) AS total {rango} "
+                              "GROUP BY 1 ORDER BY 1", [p_desde, p_hasta])
+    por_metodo = _consulta(base, f"SELECT COALESCE(metodo_pago, 'Otro') AS metodo, ROUND(SUM(total), 2) AS total "
+                                 f"{rango} GROUP BY 1 ORDER BY 2 DESC", [p_desde, p_hasta])
+    return {"total": totales["total"], "num_tickets": totales["n"], "por_dia": por_dia, "por_metodo": por_metodo}
+
+
+def rpc_reporte_cargos_concepto(base: BaseLocal, p_desde: str, p_hasta: str) -> list:
+    # Mismo SQL que la función documentada en main.py: SUM ... FILTER da NULL sin filas,
+    # como en Postgres (un SUM(CASE ... ELSE 0) daría 0 y escondería el caso)
+    return _consulta(base, """
+        SELECT COALESCE(concepto, 'Otro') AS concepto,
+               ROUND(SUM(monto), 2) AS total,
+               COALESCE(ROUND(SUM(monto) FILTER (WHERE pagado), 2), 0) AS pagado,
+               COALESCE(ROUND(SUM(monto) FILTER (WHERE NOT pagado), 2), 0) AS pendiente
+          FROM cargos WHERE fecha_cargo >= ? AND fecha_cargo <= ?
+         GROUP BY 1 ORDER BY 2 DESC""", [p_desde, p_hasta])
+
+
+def rpc_reporte_ocupacion(base: BaseLocal, p_desde: str, p_hasta: str) -> list:
+    return _consulta(base, """
+        SELECT COALESCE(NULLIF(habitacion, ''), 'Sin asignar') AS habitacion, COUNT(*) AS estancias
+          FROM estancias WHERE fecha_entrada <= ? AND fecha_salida >= ?
+         GROUP BY 1 ORDER BY 2 DESC""", [p_hasta, p_desde])
+
+
+def rpc_reporte_clientes_frecuentes(base: BaseLocal, p_limite: int = 20) -> list:
+    return _consulta(base, """
+        SELECT p.id AS perro_id, p.nombre AS nombre, COALESCE(o.nombre, '') AS propietario,
+               COALESCE(o.telefono, '') AS telefono, COUNT(*) AS visitas
+          FROM estancias e JOIN perros p ON p.id = e.perro_id
+          LEFT JOIN propietarios o ON o.id = p.propietario_id
+         GROUP BY p.id ORDER BY visitas DESC, MAX(e.created_at) DESC LIMIT ?""", [p_limite])
+
+
+def rpc_resumen_montos(base: BaseLocal, p_desde: str) -> dict:
+    return _consulta(base, """
+        SELECT (SELECT ROUND(COALESCE(SUM(monto), 0), 2) FROM cargos WHERE NOT pagado) AS monto_pendiente,
+               (SELECT ROUND(COALESCE(SUM(total), 0), 2) FROM tickets WHERE fecha >= ?) AS ingresos_mes""",
+                     [p_desde])[0]
+
+
+def rpc_refrescar_rollups(base: BaseLocal, p_desde: str, p_hasta: str) -> dict:
+    """Reconstruye los resúmenes de [p_desde, p_hasta] a partir de las tablas de origen."""
+    args = [p_desde, p_hasta]
+    with base.transaccion():
+        for tabla in LLAVES_ROLLUP:
+            base.conn.execute(f"DELETE FROM {tabla} WHERE fecha >= ? AND fecha <= ?", args)
+        base.conn.execute("""
+            INSERT INTO rollup_ingresos_dia (fecha, metodo_pago, total, tickets)
+            SELECT substr(fecha, 1, 10), COALESCE(metodo_pago, 'Otro'), SUM(COALESCE(total, 0)), COUNT(*)
+              FROM tickets WHERE fecha >= ? AND fecha <= ? GROUP BY 1, 2""", args)
+        base.conn.execute("""
+            INSERT INTO rollup_cargos_dia (fecha, concepto, total, pagado, pendiente)
+            SELECT substr(fecha_cargo, 1, 10), COALESCE(concepto, 'Otro'), SUM(COALESCE(monto, 0)),
+                   COALESCE(SUM(monto) FILTER (WHERE pagado), 0),
+                   COALESCE(SUM(monto) FILTER (WHERE NOT pagado), 0)
+              FROM cargos WHERE fecha_cargo >= ? AND fecha_cargo <= ? GROUP BY 1, 2""", args)
+        base.conn.execute("""
+            INSERT INTO rollup_ocupacion_dia (fecha, habitacion, noches)
+            SELECT dia, hab, COUNT(*) FROM (
+                SELECT date(e.fecha_entrada, '+' || n || ' days') AS dia,
+                       COALESCE(NULLIF(e.habitacion, ''), 'Sin asignar') AS hab
+                  FROM estancias e JOIN _numeros ON n < MAX(1, COALESCE(CAST(
+                       julianday(e.fecha_salida) - julianday(e.fecha_entrada) AS INTEGER), 1))
+                 WHERE e.fecha_entrada IS NOT NULL AND COALESCE(e.estado, '') <> 'Cancelada'
+                   AND e.fecha_entrada <= ?)
+             WHERE dia >= ? AND dia <= ? GROUP BY 1, 2""", [p_hasta, p_desde, p_hasta])
+        filas = {t: base.conn.execute(f"SELECT COUNT(*) FROM {t} WHERE fecha >= ? AND fecha <= ?", args).fetchone()[0]
+                 for t in LLAVES_ROLLUP}
+    return {"tablas": filas}
+
+
+FUNCIONES_RPC = {
+    "refrescar_rollups": rpc_refrescar_rollups,
+    "crear_ticket_checkout": rpc_crear_ticket_checkout,
+    "eliminar_perros_cascada": rpc_eliminar_perros_cascada,
+    "reporte_ingresos": rpc_reporte_ingresos,
+    "reporte_cargos_concepto": rpc_reporte_cargos_concepto,
+    "reporte_ocupacion": rpc_reporte_ocupacion,
+    "reporte_clientes_frecuentes": rpc_reporte_clientes_frecuentes,
+    "resumen_montos": rpc_resumen_montos,
+    "registrar_movimientos_inventario": rpc_registrar_movimientos_inventario,
+}
+
+
+# ============================================
+# TRANSPORTE HTTPX
+# ============================================
+
+def _respuesta(status: int, body=None, headers: Optional[dict] = None) -> httpx.Response:
+    content = b"" if body is None else json.dumps(body, default=str).encode()
+    h = {"content-type": "application/json; charset=utf-8"}
+    h.update(headers or {})
+    return httpx.Response(status, headers=h, content=content)
+
+
+def _parse_rango(valor: Optional[str]) -> Optional[tuple]:
+    if not valor:
+        return None
+    m = re.match(r"^\s*(\d+)-(\d*)\s*$", valor)
+    if not m:
+        return None
+    return int(m.group(1)), (int(m.group(2)) if m.group(2) else None)
+
+
+class SQLiteTransport(httpx.AsyncBaseTransport):
+    """Sirve /rest/v1, /storage/v1 y /auth/v1 desde SQLite.
+
+    `latencia_ms` agrega un retardo artificial por petición para simular el
+    round trip a Supabase en los benchmarks.
+    """
+
+    def __init__(self, path: str = ":memory:", latencia_ms: float = 0.0,
+                 conn: Optional[sqlite3.Connection] = None, jwt_secreto: str = "local-jwt-secret"):
+        self.base = BaseLocal(conn or crear_conexion(path))
+        self.latencia_ms = latencia_ms
+        self.jwt_secreto = jwt_secreto
+        self.peticiones = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.peticiones += 1
+        await request.aread()  # cuerpos en streaming (uploads sin Pillow)
+        if self.latencia_ms:
+            await asyncio.sleep(self.latencia_ms / 1000)
+        try:
+            return self._despachar(request)
+        except ErrorPostgrest as e:
+            return _respuesta(e.status_code, {"code": e.code, "message": e.message, "details": None, "hint": None})
+        except sqlite3.IntegrityError as e:
+            codigo = "23503" if "FOREIGN KEY" in str(e) else "23505"
+            return _respuesta(409, {"code": codigo, "message": str(e), "details": None, "hint": None})
+
+    def _despachar(self, request: httpx.Request) -> httpx.Response:
+        path = unquote(request.url.path)
+        metodo = request.method.upper()
+        if path.startswith("/rest/v1/rpc/"):
+            return self._rpc(path[len("/rest/v1/rpc/"):], request)
+        if path.startswith("/rest/v1/"):
+            tabla = path[len("/rest/v1/"):].strip("/")
+            if not tabla:
+                return _respuesta(200, {})
+            return self._rest(metodo, tabla, request)
+        if path.startswith("/storage/v1/"):
+            return self._storage(metodo, path[len("/storage/v1/"):], request)
+        if path.startswith("/auth/v1/token"):
+            return self._auth(request)
+        if path.startswith("/auth/v1/.well-known/jwks.json"):
+            # Los tokens locales son HS256: no hay llaves públicas que publicar
+            return _respuesta(200, {"keys": []})
+        return _respuesta(404, {"message": "Ruta no encontrada"})
+
+    def _rest(self, metodo: str, tabla: str, request: httpx.Request) -> httpx.Response:
+        params = parse_qsl(request.url.query.decode(), keep_blank_values=True)
+        prefer = request.headers.get("prefer", "")
+        body = json.loads(request.content) if request.content else None
+        minimal = "return=minimal" in prefer
+        if metodo in ("GET", "HEAD"):
+            contar = "count=exact" in prefer
+            rango = _parse_rango(request.headers.get("range"))
+            filas, offset, total = self.base.seleccionar(tabla, params, rango, contar)
+            fin = offset + len(filas) - 1
+            content_range = f"{offset}-{fin}" if filas else "*"
+            content_range += f"/{total if total is not None else '*'}"
+            status = 206 if total is not None and len(filas) < total else 200
+            return _respuesta(status, None if metodo == "HEAD" else filas, {"content-range": content_range})
+        if metodo == "POST":
+            filas = self.base.insertar(tabla, body, params)
+            return _respuesta(201, None if minimal else filas)
+        if metodo == "PATCH":
+            filas = self.base.actualizar(tabla, body, params)
+            return _respuesta(204 if minimal else 200, None if minimal else filas)
+        if metodo == "DELETE":
+            filas = self.base.eliminar(tabla, params)
+            return _respuesta(204 if minimal else 200, None if minimal else filas)
+        return _respuesta(405, {"message": f"Método no soportado: {metodo}"})
+
+    def _rpc(self, nombre: str, request: httpx.Request) -> httpx.Response:
+        funcion = self.base.funciones_rpc.get(nombre)
+        if funcion is None:
+            return _respuesta(404, {"code": "PGRST202",
+                                    "message": f"Could not find the function public.{nombre} in the schema cache"})
+        args = json.loads(request.content) if request.content else {}
+        return _respuesta(200, funcion(self.base, **args))
+
+    def _storage(self, metodo: str, ruta: str, request: httpx.Request) -> httpx.Response:
+        if ruta.startswith("bucket/"):
+            return _respuesta(200, {"id": ruta[len("bucket/"):], "public": True})
+        if ruta.startswith("object/public/"):
+            clave = ruta[len("object/public/"):]
+            if clave not in self.base.storage:
+                return _respuesta(404, {"message": "Object not found"})
+            contenido, tipo = self.base.storage[clave]
+            return httpx.Response(200, headers={"content-type": tipo}, content=contenido)
+        if ruta.startswith("object/") and metodo in ("POST", "PUT"):
+            clave = ruta[len("object/"):]
+            self.base.storage[clave] = (request.content, request.headers.get("content-type", ""))
+            return _respuesta(200, {"Key": clave})
+        return _respuesta(404, {"message": "Ruta de storage no soportada"})
+
+    def _auth(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content) if request.content else {}
+        email = body.get("email", "")
+        if not email or not body.get("password"):
+            return _respuesta(400, {"error": "invalid_grant", "error_description": "Invalid login credentials"})
+        user_id = str(uuid.uuid5(uuid.NAMESPACE_URL, email))
+        ahora = int(time.time())
+        emisor = f"{request.url.scheme}://{request.url.netloc.decode()}/auth/v1"
+        token = firmar_hs256({"sub": user_id, "email": email, "role": "authenticated", "aud": "authenticated",
+                              "iss": emisor, "iat": ahora, "exp": ahora + 3600}, self.jwt_secreto)
+        return _respuesta(200, {"access_token": token, "token_type": "bearer",
+                                "user": {"id": user_id, "email": email}})
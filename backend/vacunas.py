@@ -0,0 +1,131 @@
+"""
+ComfortCan México - Índice de vencimiento de vacunas
+
+Lista ordenada de (fecha de vencimiento, perro, vacuna) para todos los perros
+activos. Las alertas "vencidas o por vencer antes de X" son una búsqueda
+binaria sobre esa lista en lugar de recorrer todos los perros en cada llamada.
+El índice se actualiza de forma incremental cuando se crea, edita o elimina
+un perro y se recarga completo periódicamente.
+"""
+
+import time
+from bisect import bisect_left, bisect_right, insort
+
+from indice_base import IndiceRecargable
+
+# (columna, nombre para mostrar); la vacuna extra usa vacuna_extra_nombre si existe
+VACUNAS = [
+    ("vacuna_rabia_vence", "Rabia"),
+    ("vacuna_sextuple_vence", "Séxtuple"),
+    ("vacuna_bordetella_vence", "Bordetella"),
+    ("vacuna_giardia_vence", "Giardia"),
+    ("vacuna_extra_vence", "Extra"),
+]
+
+SELECT_PERROS = ("id,nombre,activo,propietario_id,vacuna_extra_nombre,propietarios(nombre,telefono),"
+                 + ",".join(c for c, _ in VACUNAS))
+
+# Mayor que cualquier id o columna: cierra el rango de bisect_right en una fecha
+_FIN = "￿"
+
+
+class IndiceVacunas(IndiceRecargable):
+    """Vencimientos ordenados por fecha, con los datos del perro que necesitan las alertas."""
+
+    def __init__(self):
+        super().__init__()
+        self.vencimientos: list = []
+        self.perros: dict = {}
+
+    # -- carga --------------------------------------------------------------
+
+    def _reconstruir(self, filas: list):
+        self.perros = {}
+        vencimientos = []
+        for fila in filas:
+            if fila.get("activo") is False:
+                continue
+            self.perros[fila["id"]] = fila
+            vencimientos.extend(self._entradas(fila))
+        vencimientos.sort()
+        self.vencimientos = vencimientos
+
+    # -- escritura incremental ---------------------------------------------
+
+    def registrar(self, fila: dict):
+        """Alta o reemplazo de un perro (tal como lo regresa PostgREST con SELECT_PERROS)."""
+        self._anotar("registrar", fila)
+        self._quitar(fila["id"])
+        if fila.get("activo") is False:
+            return
+        self.perros[fila["id"]] = fila
+        for entrada in self._entradas(fila):
+            insort(self.vencimientos, entrada)
+
+    def quitar(self, perro_id: str):
+        self._anotar("quitar", perro_id)
+        self._quitar(perro_id)
+
+    def _quitar(self, perro_id: str):
+        previa = self.perros.pop(perro_id, None)
+        if previa is None:
+            return
+        for entrada in self._entradas(previa):
+            i = bisect_left(self.vencimientos, entrada)
+            if i < len(self.vencimientos) and self.vencimientos[i] == entrada:
+                del self.vencimientos[i]
+
+    def actualizar_propietario(self, propietario_id: str, datos: dict):
+        """Refleja nombre/teléfono editados en los perros del propietario."""
+        for fila in self.perros.values():
+            if fila.get("propietario_id") == propietario_id:
+                fila["propietarios"] = {**(fila.get("propietarios") or {}),
+                                        **{k: datos[k] for k in ("nombre", "telefono") if k in datos}}
+
+    @staticmethod
+    def _entradas(fila: dict) -> list:
+        return [(str(fila[campo])[:10], fila["id"], campo) for campo, _ in VACUNAS if fila.get(campo)]
+
+    # -- consultas ----------------------------------------------------------
+
+    def _hasta(self, hasta: str) -> list:
+        return self.vencimientos[:bisect_right(self.vencimientos, (hasta, _FIN, _FIN))]
+
+    def proximas(self, hasta: str) -> list:
+        """Perros con alguna vacuna que vence en o antes de `hasta` (incluye las vencidas),
+        ordenados por el vencimiento más cercano."""
+        vistos, perros = set(), []
+        for _, perro_id, _ in self._hasta(hasta):
+            if perro_id not in vistos:
+                vistos.add(perro_id)
+                perros.append(self.perros[perro_id])
+        return perros
+
+    def alertas(self, hasta: str, hoy: str) -> list:
+        """Una alerta por perro con las vacunas vencidas o que vencen en o antes de `hasta`."""
+        nombres = dict(VACUNAS)
+        por_perro: dict = {}
+        for vence, perro_id, campo in self._hasta(hasta):
+            fila = self.perros[perro_id]
+            alerta = por_perro.get(perro_id)
+            if alerta is None:
+                propietario = fila.get("propietarios") or {}
+                alerta = por_perro[perro_id] = {
+                    "perro_id": perro_id,
+                    "nombre": fila.get("nombre"),
+                    "propietario": propietario.get("nombre", ""),
+                    "telefono": propietario.get("telefono", ""),
+                    "vacunas": [],
+                }
+            nombre = nombres[campo]
+            if campo == "vacuna_extra_vence":
+                nombre = fila.get("vacuna_extra_nombre") or nombre
+            alerta["vacunas"].append({"vacuna": nombre, "vence": vence, "vencida": vence < hoy})
+        return list(por_perro.values())
+
+    def estadisticas(self) -> dict:
+        return {
+            "perros": len(self.perros),
+            "vencimientos": len(self.vencimientos),
+            "edad_segundos": round(time.monotonic() - self.cargado_en, 1) if self.cargado_en else None,
+        }
@@ -13,6 +13,7 @@ let catalogoPaseos = [];
 let catalogoHabitaciones = [];
 let catalogoColores = [];
 let estancias = [];
+let dashboardData = null;
 let cargosActuales = [];
 let serviciosSeleccionados = [];
 let calendarioSemanaInicio = null;
@@ -243,6 +244,7 @@ async function handleLogin(e) {
 }
 
 function handleLogout() {
+    desconectarEventos();
     sessionStorage.removeItem('authToken');
     authToken = null;
     showLogin();
@@ -251,6 +253,8 @@ function handleLogout() {
 // ============================================
 // API HELPERS
 // ============================================
+// Las lecturas llevan ETag y `no-cache`: el navegador revalida cada vez con If-None-Match
+// y un 304 reutiliza su copia, así que los cambios hechos en otro equipo se ven al momento.
 async function apiGet(endpoint) {
     const response = await fetch(`${API_URL}${endpoint}`, {
         headers: { 'Authorization': `Bearer ${authToken}` }
@@ -373,6 +377,304 @@ function invalidarCachesCatalogos() {
         .forEach(k => sessionStorage.removeItem(`cache_${k}`));
 }
 
+// ============================================
+// ESPEJO LOCAL (IndexedDB) + SYNC POR DELTAS
+// Propietarios, perros y estancias se guardan completos en IndexedDB; al
+// arrancar solo se pide a /sync lo que cambió desde el último watermark
+// ============================================
+const ESPEJO_DB = 'comfortcan-espejo';
+const ESPEJO_TABLAS = ['propietarios', 'perros', 'estancias'];
+
+function usuarioDelToken() {
+    try {
+        const payload = authToken.split('.')[1].replace(/-/g, '+').replace(/_/g, '/');
+        return JSON.parse(atob(payload)).sub || null;
+    } catch {
+        return null;
+    }
+}
+
+function abrirEspejo() {
+    return new Promise((resolve, reject) => {
+        if (!window.indexedDB) return reject(new Error('IndexedDB no disponible'));
+        const req = indexedDB.open(ESPEJO_DB, 1);
+        req.onupgradeneeded = () => {
+            const db = req.result;
+            ESPEJO_TABLAS.forEach(t => db.createObjectStore(t, { keyPath: 'id' }));
+            db.createObjectStore('meta', { keyPath: 'clave' });
+        };
+        req.onsuccess = () => resolve(req.result);
+        req.onerror = () => reject(req.error);
+    });
+}
+
+function esperarTransaccion(tx) {
+    return new Promise((resolve, reject) => {
+        tx.oncomplete = () => resolve();
+        tx.onerror = () => reject(tx.error);
+        tx.onabort = () => reject(tx.error);
+    });
+}
+
+function leerStore(db, store) {
+    return new Promise((resolve, reject) => {
+        const req = db.transaction(store).objectStore(store).getAll();
+        req.onsuccess = () => resolve(req.result);
+        req.onerror = () => reject(req.error);
+    });
+}
+
+async function leerMetaEspejo(db) {
+    const filas = await leerStore(db, 'meta');
+    return Object.fromEntries(filas.map(f => [f.clave, f.valor]));
+}
+
+// Aplica una respuesta de /sync en una sola transacción (todo o nada)
+async function aplicarSync(db, datos, usuario) {
+    const tx = db.transaction([...ESPEJO_TABLAS, 'meta'], 'readwrite');
+    ESPEJO_TABLAS.forEach(t => {
+        const store = tx.objectStore(t);
+        if (datos.completo) store.clear();
+        (datos.cambios[t] || []).forEach(fila => store.put(fila));
+        (datos.eliminados[t] || []).forEach(id => store.delete(id));
+    });
+    const meta = tx.objectStore('meta');
+    meta.put({ clave: 'watermark', valor: datos.watermark });
+    meta.put({ clave: 'usuario', valor: usuario });
+    await esperarTransaccion(tx);
+}
+
+// Embebido `perros(...)` de una estancia, igual al de GET /estancias
+function perroEmbebidoEstancia(perro, dueno) {
+    if (!perro) return null;
+    return {
+        id: perro.id,
+        nombre: perro.nombre,
+        foto_perro_url: perro.foto_perro_url,
+        foto_perro_miniaturas: perro.foto_perro_miniaturas,
+        propietarios: dueno ? { nombre: dueno.nombre, telefono: dueno.telefono } : null
+    };
+}
+
+// Reconstruye las listas tal como las regresan /propietarios, /perros y /estancias
+function armarDesdeEspejo(filasProps, filasPerros, filasEstancias) {
+    const porNombre = (a, b) => (a.nombre || '').localeCompare(b.nombre || '', 'es');
+    const propsPorId = new Map(filasProps.map(p => [p.id, p]));
+    const perrosPorId = new Map(filasPerros.map(p => [p.id, p]));
+
+    const props = filasProps.filter(p => p.activo !== false).sort(porNombre);
+    const dogs = filasPerros.filter(p => p.activo !== false).map(p => {
+        const dueno = propsPorId.get(p.propietario_id);
+        return {
+            ...p,
+            propietarios: dueno
+                ? { id: dueno.id, nombre: dueno.nombre, telefono: dueno.telefono, direccion: dueno.direccion }
+                : null
+        };
+    }).sort(porNombre);
+    const estanciasData = filasEstancias.map(e => {
+        const perro = perrosPorId.get(e.perro_id);
+        return { ...e, perros: perroEmbebidoEstancia(perro, perro && propsPorId.get(perro.propietario_id)) };
+    }).sort((a, b) => (b.fecha_entrada || '').localeCompare(a.fecha_entrada || '') || (b.id < a.id ? -1 : 1));
+    return { props, dogs, estanciasData };
+}
+
+async function cargarDatosSincronizados() {
+    const db = await abrirEspejo();
+    try {
+        const usuario = usuarioDelToken();
+        const meta = await leerMetaEspejo(db);
+        // Otro usuario en el mismo navegador: su copia no sirve (RLS puede filtrar distinto)
+        const since = meta.usuario === usuario ? meta.watermark : null;
+        const datos = await apiGet('/sync' + (since ? `?since=${encodeURIComponent(since)}` : ''));
+        await aplicarSync(db, datos, usuario);
+        const [filasProps, filasPerros, filasEstancias] = await Promise.all(ESPEJO_TABLAS.map(t => leerStore(db, t)));
+        return armarDesdeEspejo(filasProps, filasPerros, filasEstancias);
+    } finally {
+        db.close();
+    }
+}
+
+// Sin IndexedDB o con un backend sin /sync: descarga completa como antes
+async function cargarDatosCompletos() {
+    const [props, dogs, estanciasData] = await Promise.all([
+        apiGet('/propietarios'),
+        apiGet('/perros'),
+        apiGet('/estancias')
+    ]);
+    return { props, dogs, estanciasData };
+}
+
+async function cargarDatosPrincipales() {
+    try {
+        return await cargarDatosSincronizados();
+    } catch (error) {
+        if (error.message === 'Sesión expirada') throw error;
+        console.warn('Sync por deltas no disponible, descarga completa:', error);
+        return cargarDatosCompletos();
+    }
+}
+
+// ============================================
+// EVENTOS EN VIVO (SSE)
+// Cambios de otros usuarios (check-in, salidas, colores, paseos, tickets) llegan
+// por /eventos y se aplican sobre el estado local sin volver a descargarlo.
+// Se usa fetch en lugar de EventSource para poder mandar el header Authorization.
+// ============================================
+let eventosControlador = null;
+let eventosUltimoId = null;
+let eventosEspera = 3000;
+
+function seccionActiva(id) {
+    return document.getElementById(`section-${id}`)?.classList.contains('active');
+}
+
+function conectarEventos() {
+    if (eventosControlador || !authToken || !window.ReadableStream) return;
+    eventosControlador = new AbortController();
+    escucharEventos(eventosControlador.signal);
+}
+
+function desconectarEventos() {
+    if (eventosControlador) eventosControlador.abort();
+    eventosControlador = null;
+    eventosUltimoId = null;
+}
+
+async function escucharEventos(signal) {
+    while (!signal.aborted) {
+        try {
+            const headers = { 'Authorization': `Bearer ${authToken}` };
+            if (eventosUltimoId) headers['Last-Event-ID'] = eventosUltimoId;
+            const response = await fetch(`${API_URL}/eventos`, { headers, signal });
+            if (response.status === 401) return desconectarEventos();
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            eventosEspera = 3000;
+
+            const lector = response.body.pipeThrough(new TextDecoderStream()).getReader();
+            let pendiente = '';
+            while (true) {
+                const { value, done } = await lector.read();
+                if (done) break;
+                pendiente += value;
+                const bloques = pendiente.split('\n\n');
+                pendiente = bloques.pop();
+                bloques.forEach(procesarBloqueSSE);
+            }
+        } catch (error) {
+            if (signal.aborted) return;
+            console.warn('Eventos en vivo desconectados:', error);
+        }
+        // Reconexión con espera creciente (máx. 30 s)
+        await new Promise(r => setTimeout(r, eventosEspera));
+        eventosEspera = Math.min(eventosEspera * 2, 30000);
+    }
+}
+
+function procesarBloqueSSE(bloque) {
+    let tipo = 'message', id = null;
+    const datos = [];
+    bloque.split('\n').forEach(linea => {
+        if (!linea || linea.startsWith(':')) return;
+        const i = linea.indexOf(':');
+        const campo = i < 0 ? linea : linea.slice(0, i);
+        const valor = i < 0 ? '' : linea.slice(i + 1).replace(/^ /, '');
+        if (campo === 'event') tipo = valor;
+        else if (campo === 'data') datos.push(valor);
+        else if (campo === 'id') id = valor;
+    });
+    if (!datos.length) return;
+    if (id) eventosUltimoId = id;
+    try {
+        aplicarEvento(tipo, JSON.parse(datos.join('\n')));
+    } catch (error) {
+        console.warn('Evento inválido:', tipo, error);
+    }
+}
+
+function aplicarEvento(tipo, datos) {
+    if (tipo === 'resync') return resincronizarEstado();
+    if (tipo === 'estancia') aplicarEventoEstancia(datos);
+    if (dashboardData && parchearDashboard(tipo, datos) && seccionActiva('dashboard')) {
+        renderDashboard(dashboardData);
+    }
+}
+
+function aplicarEventoEstancia(datos) {
+    const estanciaId = datos.estancia?.id || datos.id;
+    const i = estancias.findIndex(e => e.id === estanciaId);
+    if (datos.accion === 'eliminada') {
+        if (i >= 0) estancias.splice(i, 1);
+    } else {
+        const perro = perros.find(p => p.id === datos.estancia.perro_id);
+        const nueva = {
+            ...datos.estancia,
+            perros: (i >= 0 && estancias[i].perros) || perroEmbebidoEstancia(perro, perro?.propietarios)
+        };
+        if (i >= 0) estancias[i] = nueva;
+        else estancias.unshift(nueva);
+    }
+    if (seccionActiva('calendario')) renderCalendarioOcupacion();
+}
+
+// Aplica el evento al payload de /dashboard/resumen-dia. Regresa true si lo cambió.
+function parchearDashboard(tipo, datos) {
+    const d = dashboardData;
+    if (tipo === 'estancia') {
+        const estanciaId = datos.estancia?.id || datos.id;
+        d.estancias_activas = d.estancias_activas.filter(e => e.id !== estanciaId);
+        if (datos.estancia?.estado === 'Activa') {
+            d.estancias_activas.push(estancias.find(e => e.id === estanciaId) || datos.estancia);
+        }
+        d.checkouts_pendientes = d.estancias_activas.filter(
+            e => e.fecha_salida && String(e.fecha_salida).slice(0, 10) <= d.fecha);
+    } else if (tipo === 'paseo') {
+        const paseoId = datos.paseo?.id || datos.id;
+        const previo = d.paseos_hoy.find(p => p.id === paseoId);
+        d.paseos_hoy = d.paseos_hoy.filter(p => p.id !== paseoId);
+        if (datos.paseo && String(datos.paseo.fecha).slice(0, 10) === d.fecha) {
+            const perro = perros.find(p => p.id === datos.paseo.perro_id);
+            d.paseos_hoy.push({
+                ...datos.paseo,
+                perros: previo?.perros || (perro ? {
+                    id: perro.id,
+                    nombre: perro.nombre,
+                    propietarios: perro.propietarios
+                        ? { nombre: perro.propietarios.nombre, telefono: perro.propietarios.telefono } : null
+                } : null)
+            });
+        }
+    } else if (tipo === 'cargo' || tipo === 'ticket') {
+        const quitar = new Set(tipo === 'ticket' ? datos.cargos_ids : (datos.ids || datos.cargos.map(c => c.id)));
+        d.cargos_pendientes = d.cargos_pendientes.filter(c => !quitar.has(c.id));
+        (datos.cargos || []).filter(c => !c.pagado).forEach(c => {
+            d.cargos_pendientes.push({
+                id: c.id, monto: c.monto, perro_id: c.perro_id, concepto: c.concepto,
+                perros: { nombre: perros.find(p => p.id === c.perro_id)?.nombre }
+            });
+        });
+        d.monto_pendiente = d.cargos_pendientes.reduce((t, c) => t + parseFloat(c.monto || 0), 0);
+    } else {
+        return false;
+    }
+    return true;
+}
+
+// Se perdieron eventos (reconexión tardía o cliente lento): volver a sincronizar
+async function resincronizarEstado() {
+    eventosUltimoId = null;
+    try {
+        const { props, dogs, estanciasData } = await cargarDatosPrincipales();
+        propietarios = props || [];
+        perros = dogs || [];
+        estancias = estanciasData || [];
+        if (seccionActiva('calendario')) renderCalendarioOcupacion();
+        if (dashboardData && seccionActiva('dashboard')) cargarDashboard();
+    } catch (error) {
+        console.warn('No se pudo resincronizar:', error);
+    }
+}
+
 // ============================================
 // CARGA INICIAL
 // ============================================
@@ -386,14 +688,12 @@ async function loadInitialData() {
         const habCached = getCachedCatalogo('catalogo-habitaciones');
         const colCached = getCachedCatalogo('catalogo-colores');
 
-        const [props, dogs, servicios, paseos, habitaciones, colores, estanciasData] = await Promise.all([
-            apiGet('/propietarios'),
-            apiGet('/perros'),
+        const [{ props, dogs, estanciasData }, servicios, paseos, habitaciones, colores] = await Promise.all([
+            cargarDatosPrincipales(),
             svCached  ? Promise.resolve(svCached)  : apiGet('/catalogo-servicios'),
             psCached  ? Promise.resolve(psCached)  : apiGet('/catalogo-paseos'),
             habCached ? Promise.resolve(habCached) : apiGet('/catalogo-habitaciones'),
-            colCached ? Promise.resolve(colCached) : apiGet('/catalogo-colores').catch(() => []),
-            apiGet('/estancias')
+            colCached ? Promise.resolve(colCached) : apiGet('/catalogo-colores').catch(() => [])
         ]);
 
         // Guardar en caché los que se pidieron al servidor
@@ -421,6 +721,7 @@ async function loadInitialData() {
 
         hideLoading();
         showToast('Datos cargados', 'success');
+        conectarEventos();
 
     } catch (error) {
         hideLoading();
@@ -507,8 +808,7 @@ function navigateToSection(sectionId) {
     if (sectionId === 'paseos') cargarPaseos();
     if (sectionId === 'expedientes') renderListaExpedientes();
     if (sectionId === 'calendario') {
-        renderCalendarioOcupacion();
-        setTimeout(() => scrollCalendarioAHoy(true), 100);
+        renderCalendarioOcupacion().then(() => scrollCalendarioAHoy(true));
     }
     if (sectionId === 'configuracion') {
         renderTablaServicios();
@@ -673,6 +973,17 @@ async function handleNuevoPerro(e) {
     }
 }
 
+// Miniatura WebP más chica que cubra `tam` px; sin miniaturas (fotos viejas) usa la original
+function fotoMiniatura(perro, tam, foto = 'foto_perro') {
+    const miniaturas = perro?.[`${foto}_miniaturas`];
+    if (miniaturas) {
+        const tamanos = Object.keys(miniaturas).map(Number).sort((a, b) => a - b);
+        const elegido = tamanos.find(t => t >= tam) ?? tamanos[tamanos.length - 1];
+        if (elegido !== undefined) return miniaturas[elegido];
+    }
+    return perro?.[`${foto}_url`] || null;
+}
+
 async function subirFoto(perroId, file, tipo) {
     const formData = new FormData();
     formData.append('file', file);
@@ -1454,10 +1765,10 @@ function renderListaExpedientes() {
                 // Debug: mostrar si tiene foto
                 console.log(`Perro ${p.nombre} - foto_perro_url:`, p.foto_perro_url);
                 return `
-                    <div class="expediente-card" onclick="cargarExpedienteDirecto('${p.id}')">
+                    <div class="expediente-card" data-id="${p.id}" onclick="cargarExpedienteDirecto('${p.id}')">
                         <div class="expediente-foto">
                             ${p.foto_perro_url ?
-                                `<img src="${p.foto_perro_url}" alt="${p.nombre}" onerror="this.style.display='none'; this.nextElementSibling.style.display='flex';">
+                                `<img src="${fotoMiniatura(p, 160)}" alt="${p.nombre}" loading="lazy" onerror="this.style.display='none'; this.nextElementSibling.style.display='flex';">
                                  <div class="sin-foto" style="display:none;">${p.nombre.charAt(0)}</div>` :
                                 `<div class="sin-foto">${p.nombre.charAt(0)}</div>`
                             }
@@ -1474,13 +1785,52 @@ function renderListaExpedientes() {
     `;
 }
 
+// El filtro consulta /buscar (sin acentos, por prefijo, tolera errores de dedo y busca
+// también por teléfono o correo del dueño) y ordena las tarjetas por relevancia. Se espera
+// a que el usuario deje de teclear y solo se aplica la respuesta de la última petición.
+let expedientesBusqueda = 0;
+let expedientesEspera = null;
+
 function filtrarExpedientes() {
-    const busqueda = document.getElementById('filtro-expediente')?.value.toLowerCase() || '';
+    clearTimeout(expedientesEspera);
+    expedientesEspera = setTimeout(buscarExpedientes, 150);
+}
+
+async function buscarExpedientes() {
+    const texto = document.getElementById('filtro-expediente')?.value.trim() || '';
     const cards = document.querySelectorAll('.expediente-card');
+    const peticion = ++expedientesBusqueda;
+
+    if (!texto) {
+        cards.forEach(card => { card.style.display = 'flex'; card.style.order = ''; });
+        return;
+    }
+
+    let posicion;
+    try {
+        const { resultados } = await apiGet(`/buscar?q=${encodeURIComponent(texto)}&limite=100`);
+        if (peticion !== expedientesBusqueda) return;
+        // Un propietario encontrado (por nombre, teléfono o correo) trae a todos sus perros
+        posicion = new Map();
+        resultados.forEach(r => {
+            const ids = r.tipo === 'perro' ? [r.id] : perros.filter(p => p.propietario_id === r.id).map(p => p.id);
+            ids.forEach(id => { if (!posicion.has(id)) posicion.set(id, posicion.size); });
+        });
+    } catch (error) {
+        if (peticion !== expedientesBusqueda) return;
+        // Sin API: filtro local por texto visible
+        const busqueda = texto.toLowerCase();
+        cards.forEach(card => {
+            card.style.display = card.textContent.toLowerCase().includes(busqueda) ? 'flex' : 'none';
+            card.style.order = '';
+        });
+        return;
+    }
 
     cards.forEach(card => {
-        const texto = card.textContent.toLowerCase();
-        card.style.display = texto.includes(busqueda) ? 'flex' : 'none';
+        const orden = posicion.get(card.dataset.id);
+        card.style.display = orden === undefined ? 'none' : 'flex';
+        card.style.order = orden === undefined ? '' : orden;
     });
 }
 
@@ -1519,14 +1869,14 @@ async function cargarExpedienteDirecto(perroId) {
                         <div class="foto-box">
                             <p class="text-muted mb-1"><strong>Foto del Perro</strong></p>
                             ${perro.foto_perro_url ?
-                                `<img src="${perro.foto_perro_url}" alt="${perro.nombre}" class="foto-expediente-img" onclick="window.open('${perro.foto_perro_url}', '_blank')">` :
+                                `<img src="${fotoMiniatura(perro, 480)}" alt="${perro.nombre}" class="foto-expediente-img" onclick="window.open('${perro.foto_perro_url}', '_blank')">` :
                                 `<div class="sin-foto-grande">${perro.nombre.charAt(0).toUpperCase()}</div>`
                             }
                         </div>
                         <div class="foto-box">
                             <p class="text-muted mb-1"><strong>Cartilla de Vacunacion</strong></p>
                             ${perro.foto_cartilla_url ?
-                                `<img src="${perro.foto_cartilla_url}" alt="Cartilla" class="foto-expediente-img" onclick="window.open('${perro.foto_cartilla_url}', '_blank')">` :
+                                `<img src="${fotoMiniatura(perro, 480, 'foto_cartilla')}" alt="Cartilla" class="foto-expediente-img" onclick="window.open('${perro.foto_cartilla_url}', '_blank')">` :
                                 `<div class="sin-foto-grande" style="font-size: 1rem;">Sin cartilla</div>`
                             }
                         </div>
@@ -1749,14 +2099,14 @@ async function editarExpedienteCompleto(perroId) {
                     <div class="form-group">
                         <label class="form-label">Foto del Perro</label>
                         <div class="foto-edit-container">
-                            ${perro.foto_perro_url ? `<img src="${perro.foto_perro_url}" alt="${perro.nombre}" class="foto-preview-edit">` : '<div class="sin-foto-edit">Sin foto</div>'}
+                            ${perro.foto_perro_url ? `<img src="${fotoMiniatura(perro, 480)}" alt="${perro.nombre}" class="foto-preview-edit">` : '<div class="sin-foto-edit">Sin foto</div>'}
                             <input type="file" id="edit-foto-perro" accept="image/*" class="form-input mt-1">
                         </div>
                     </div>
                     <div class="form-group">
                         <label class="form-label">Cartilla de Vacunación</label>
                         <div class="foto-edit-container">
-                            ${perro.foto_cartilla_url ? `<img src="${perro.foto_cartilla_url}" alt="Cartilla" class="foto-preview-edit">` : '<div class="sin-foto-edit">Sin cartilla</div>'}
+                            ${perro.foto_cartilla_url ? `<img src="${fotoMiniatura(perro, 480, 'foto_cartilla')}" alt="Cartilla" class="foto-preview-edit">` : '<div class="sin-foto-edit">Sin cartilla</div>'}
                             <input type="file" id="edit-foto-cartilla" accept="image/*" class="form-input mt-1">
                         </div>
                     </div>
@@ -2723,7 +3073,11 @@ async function guardarEdicionColor(colorId) {
 // ============================================
 // CALENDARIO DE OCUPACION
 // ============================================
-function renderCalendarioOcupacion() {
+// Cada navegación pide su ventana a /calendario; si llegan respuestas fuera de orden
+// solo se pinta la de la última petición
+let calendarioPeticion = 0;
+
+async function renderCalendarioOcupacion() {
     const container = document.getElementById('calendario-ocupacion');
     const rangoLabel = document.getElementById('calendario-rango-fechas');
     if (!container) return;
@@ -2758,26 +3112,22 @@ function renderCalendarioOcupacion() {
         rangoLabel.textContent = `${fechaInicio.toLocaleDateString('es-MX', { day: 'numeric', month: 'short' })} - ${fechaFin.toLocaleDateString('es-MX', { day: 'numeric', month: 'short', year: 'numeric' })}`;
     }
 
+    // Estancias de la ventana con carril y cortes ya calculados por el servidor (columnas)
+    const desde = `${fechaInicio.getFullYear()}-${String(fechaInicio.getMonth() + 1).padStart(2, '0')}-${String(fechaInicio.getDate()).padStart(2, '0')}`;
+    const peticion = ++calendarioPeticion;
+    let cal;
+    try {
+        cal = await apiGet(`/calendario?desde=${desde}&dias=${TOTAL_DIAS}`);
+    } catch (error) {
+        if (peticion === calendarioPeticion) showToast('Error cargando calendario: ' + error.message, 'error');
+        return;
+    }
+    if (peticion !== calendarioPeticion) return;
+
     const hoyStr = new Date().toDateString();
     const COL_W = 100; // ancho de cada columna de día en px
     const HAB_W = 120; // ancho columna habitación
-    const ROW_H = 60; // altura fija de cada fila
-    const primerDia = dias[0];
-
-    // Función robusta para calcular diferencia en días (sin problemas de DST/milisegundos)
-    function diffDays(dateA, dateB) {
-        const a = new Date(dateA.getFullYear(), dateA.getMonth(), dateA.getDate());
-        const b = new Date(dateB.getFullYear(), dateB.getMonth(), dateB.getDate());
-        return Math.round((a - b) / 86400000);
-    }
-
-    // Filtrar estancias activas
-    const estanciasActivas = estancias.filter(e => e.estado !== 'Completada');
-
-    // Ordenar habitaciones
-    const habsOrdenadas = [...catalogoHabitaciones].sort((a, b) => {
-        return a.nombre.localeCompare(b.nombre, undefined, { numeric: true, sensitivity: 'base' });
-    });
+    const ROW_H = 60; // altura de cada carril
 
     // Construir Gantt con divs
     let html = '<div class="gantt">';
@@ -2801,25 +3151,25 @@ function renderCalendarioOcupacion() {
     });
     html += '</div>';
 
-    if (catalogoHabitaciones.length === 0) {
+    const habitaciones = cal.habitaciones.nombre;
+    if (habitaciones.length === 0) {
         html += '<div class="text-center text-muted" style="padding: 2rem;">No hay habitaciones configuradas.</div>';
         html += '</div>';
         container.innerHTML = html;
         return;
     }
 
-    // Filas por habitación
-    habsOrdenadas.forEach(hab => {
-        const estanciasHab = estanciasActivas
-            .filter(e => e.habitacion === hab.nombre)
-            .sort((a, b) => {
-                const fA = parseDateLocal(a.fecha_entrada);
-                const fB = parseDateLocal(b.fecha_entrada);
-                return fA - fB;
-            });
+    // Índices de estancia por habitación (vienen ordenadas por carril y entrada)
+    const est = cal.estancias;
+    const porHabitacion = habitaciones.map(() => []);
+    est.id.forEach((_, i) => porHabitacion[est.habitacion[i]].push(i));
+
+    // Filas por habitación: una franja de ROW_H por carril
+    habitaciones.forEach((nombreHab, h) => {
+        const rowH = ROW_H * cal.habitaciones.carriles[h];
 
-        html += `<div class="gantt-row" style="height: ${ROW_H}px;">`;
-        html += `<div class="gantt-hab-label" style="width: ${HAB_W}px;">${hab.nombre}</div>`;
+        html += `<div class="gantt-row" style="height: ${rowH}px;">`;
+        html += `<div class="gantt-hab-label" style="width: ${HAB_W}px;">${nombreHab}</div>`;
         html += `<div class="gantt-timeline" style="width: ${TOTAL_DIAS * COL_W}px;">`;
 
         // Grid de fondo (líneas de días)
@@ -2829,59 +3179,31 @@ function renderCalendarioOcupacion() {
             let cls = 'gantt-cell';
             if (esHoy) cls += ' gantt-hoy';
             if (esFinde) cls += ' gantt-finde';
-            html += `<div class="${cls}" style="left:${i * COL_W}px; width:${COL_W}px; height:${ROW_H}px;"></div>`;
+            html += `<div class="${cls}" style="left:${i * COL_W}px; width:${COL_W}px; height:${rowH}px;"></div>`;
         });
 
-        // Pre-calcular rangos de días para detectar overlaps
-        const barrasInfo = estanciasHab.map(estancia => {
-            const entrada = parseDateLocal(estancia.fecha_entrada);
-            const salida = estancia.fecha_salida ? parseDateLocal(estancia.fecha_salida) : entrada;
-            const startDay = Math.max(0, diffDays(entrada, primerDia));
-            const endDay = Math.min(TOTAL_DIAS - 1, diffDays(salida, primerDia));
-            return { estancia, startDay, endDay };
-        }).filter(b => b.endDay >= 0 && b.startDay < TOTAL_DIAS);
-
-        // Barras — solo clip-path diagonal cuando hay overlap real (mismo día)
-        barrasInfo.forEach((bInfo, idx) => {
-            const { estancia, startDay, endDay } = bInfo;
-            const perroNombre = estancia.perros?.nombre || 'Perro';
-            const perroFoto = estancia.perros?.foto_perro_url || null;
-            const color = estancia.color_etiqueta || '#45BF4D';
+        // Barras — clip-path diagonal solo en el día de cambio compartido (bits de `cortes`)
+        porHabitacion[h].forEach((i, idx) => {
+            const p = est.perro[i];
+            const perroNombre = cal.perros.nombre[p] || 'Perro';
+            const perroFoto = cal.perros.foto[p];
+            const color = est.color[i] || '#45BF4D';
             const textColor = esColorClaro(color) ? '#000' : '#fff';
             const colorTexto = catalogoColores.find(c => c.color === color)?.texto || '';
 
-            const left = startDay * COL_W;
-            const barW = (endDay - startDay + 1) * COL_W;
+            const left = est.inicio[i] * COL_W;
+            const barW = (est.fin[i] - est.inicio[i] + 1) * COL_W;
+            const top = est.carril[i] * ROW_H;
 
-            // Detectar overlap real: otra barra comparte al menos 1 día
-            const nextOverlap = barrasInfo.find((b, i) => i > idx && b.startDay <= endDay && b.startDay > startDay);
-            const prevOverlap = barrasInfo.find((b, i) => i < idx && b.endDay >= startDay && b.endDay < endDay);
-
-            let topLeft = '0 0';
             let topRight = `${barW}px 0`;
-            let bottomRight = `${barW}px ${ROW_H}px`;
             let bottomLeft = `0 ${ROW_H}px`;
-            let needsClip = false;
-
-            if (nextOverlap) {
-                const cutX = (nextOverlap.startDay - startDay) * COL_W;
-                topRight = `${cutX}px 0`;
-                bottomRight = `${barW}px ${ROW_H}px`;
-                needsClip = true;
-            }
+            if (est.cortes[i] & 2) topRight = `${(est.fin[i] - est.inicio[i]) * COL_W}px 0`;
+            if (est.cortes[i] & 1) bottomLeft = `${COL_W}px ${ROW_H}px`;
+            const clipStyle = est.cortes[i] ? `clip-path: polygon(0 0, ${topRight}, ${barW}px ${ROW_H}px, ${bottomLeft});` : '';
 
-            if (prevOverlap) {
-                const cutX = (prevOverlap.endDay - startDay + 1) * COL_W;
-                bottomLeft = `${cutX}px ${ROW_H}px`;
-                topLeft = '0 0';
-                needsClip = true;
-            }
-
-            const clipStyle = needsClip ? `clip-path: polygon(${topLeft}, ${topRight}, ${bottomRight}, ${bottomLeft});` : '';
-
-            html += `<div class="gantt-bar" style="left:${left}px; width:${barW}px; top:0; height:${ROW_H}px; background-color:${color}; color:${textColor}; z-index:${2 + idx}; ${clipStyle}"
-                title="${perroNombre}: ${formatDate(estancia.fecha_entrada)} - ${formatDate(estancia.fecha_salida)}${colorTexto ? ' (' + colorTexto + ')' : ''}"
-                onclick="mostrarDetalleEstancia('${estancia.id}')">`;
+            html += `<div class="gantt-bar" style="left:${left}px; width:${barW}px; top:${top}px; height:${ROW_H}px; background-color:${color}; color:${textColor}; z-index:${2 + idx}; ${clipStyle}"
+                title="${perroNombre}: ${formatDate(est.fecha_entrada[i])} - ${formatDate(est.fecha_salida[i])}${colorTexto ? ' (' + colorTexto + ')' : ''}"
+                onclick="mostrarDetalleEstancia('${est.id[i]}')">`;
             html += `<div class="gantt-bar-content">`;
             if (perroFoto) {
                 html += `<img src="${perroFoto}" class="gantt-bar-foto" alt="${perroNombre}">`;
@@ -2937,7 +3259,7 @@ async function mostrarDetalleEstancia(estanciaId) {
                 </div>
                 <div class="modal-body">
                     <div class="estancia-detalle-info">
-                        ${perro.foto_perro_url ? `<img src="${perro.foto_perro_url}" alt="${perro.nombre}" class="estancia-detalle-foto">` : ''}
+                        ${perro.foto_perro_url ? `<img src="${fotoMiniatura(perro, 480)}" alt="${perro.nombre}" class="estancia-detalle-foto">` : ''}
                         <h4>${perro.nombre || 'Perro'}</h4>
                     </div>
                     <div class="form-row mt-2">
@@ -3070,10 +3392,10 @@ function cambiarSemanaCalendario(direccion) {
     if (cont) cont.scrollLeft = 0;
 }
 
-function scrollCalendarioAHoy(soloScroll = false) {
+async function scrollCalendarioAHoy(soloScroll = false) {
     if (!soloScroll) {
         calendarioSemanaInicio = null;
-        renderCalendarioOcupacion();
+        await renderCalendarioOcupacion();
     }
     setTimeout(() => {
         const cont = document.querySelector('.calendario-ocupacion-container');
@@ -3402,6 +3724,7 @@ async function cargarDashboard() {
         showLoading();
         const data = await apiGet('/dashboard/resumen-dia');
         hideLoading();
+        dashboardData = data;
         renderDashboard(data);
     } catch (error) {
         hideLoading();
@@ -4072,7 +4395,7 @@ async function ejecutarReporte() {
     try {
         showLoading();
         const [ingresos, conceptos, ocupacion, frecuentes] = await Promise.all([
-            apiGet(`/reportes/ingresos?fecha_inicio=${inicio}&fecha_fin=${fin}`),
+            apiGet(`/reportes/ingresos?fecha_inicio=${inicio}&fecha_fin=${fin}&incluir_tickets=true`),
             apiGet(`/reportes/cargos-por-concepto?fecha_inicio=${inicio}&fecha_fin=${fin}`),
             apiGet(`/reportes/ocupacion?fecha_inicio=${inicio}&fecha_fin=${fin}`),
             apiGet('/reportes/clientes-frecuentes')
@@ -4167,9 +4490,9 @@ function renderReporteConceptos(data) {
     tbody.innerHTML = data.por_concepto.map(c => `
         <tr>
             <td>${c.concepto}</td>
-            <td>$${c.total.toFixed(2)}</td>
-            <td class="text-success">$${c.pagado.toFixed(2)}</td>
-            <td style="color:#FF6666;">$${c.pendiente.toFixed(2)}</td>
+            <td>$${Number(c.total || 0).toFixed(2)}</td>
+            <td class="text-success">$${Number(c.pagado || 0).toFixed(2)}</td>
+            <td style="color:#FF6666;">$${Number(c.pendiente || 0).toFixed(2)}</td>
         </tr>
     `).join('');
 }